@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+from qrac.models import Crazyflie, Quadrotor, AffineQuadrotor
+from qrac.control import NMPC, AdaptiveNMPC
+from qrac.estimation import LMS
+from qrac.sim import MinimalSim
+import numpy as np
+import os
+
+
+class FixedBounds:
+    """
+    Feeds LMS constant parameter bounds,
+    so only the NMPC formulation differs between runs.
+    """
+    def __init__(self, lms, p_min, p_max):
+        self._lms = lms
+        self._p_min = p_min
+        self._p_max = p_max
+
+    @property
+    def is_nonlinear(self) -> bool:
+        return False
+
+    def get_param(self, x, u, param, timer=False):
+        return self._lms.get_param(
+            x=x, u=u, param=param,
+            param_min=self._p_min, param_max=self._p_max, timer=False
+        )
+
+
+def run():
+    CTRL_T = 0.01
+    NODES = 150
+    STEPS = 500
+    Q = np.diag([1,1,1, 1,1,1, 1,1,1, 1,1,1,])
+    R = np.diag([0, 0, 0, 0])
+    SIM_T = CTRL_T / 10
+
+    refs = os.path.join(os.path.dirname(__file__), "../lemniscate/refs")
+    xref = np.load(os.path.join(refs, "xref.npy"))
+    uref = np.load(os.path.join(refs, "uref.npy"))
+    steps = min(STEPS, xref.shape[0] - 1)
+
+    inacc = Crazyflie(Ax=0, Ay=0, Az=0)
+    acc = Quadrotor(
+        1.5*inacc.m, 1.8*inacc.Ixx, 1.8*inacc.Iyy, 1.8*inacc.Izz,
+        0, 0, 0, inacc.xB, inacc.yB, inacc.k, inacc.u_min, inacc.u_max)
+    p_true = AffineQuadrotor(acc).get_parameters()
+    p_min = p_true - 2*np.abs(p_true)
+    p_max = p_true + 2*np.abs(p_true)
+
+    ctrls = {
+        "nominal": NMPC(
+            model=inacc, Q=Q, R=R,
+            u_min=inacc.u_min, u_max=inacc.u_max, time_step=CTRL_T,
+            num_nodes=NODES, rti=True, nlp_max_iter=1, qp_max_iter=4,
+            stats_size=steps,
+        ),
+    }
+    for runtime_params in [False, True]:
+        lms = LMS(model=inacc, update_gain=1000, time_step=CTRL_T)
+        label = "params" if runtime_params else "augmented"
+        ctrls[label] = AdaptiveNMPC(
+            model=inacc, estimator=FixedBounds(lms, p_min, p_max),
+            Q=Q, R=R, u_min=inacc.u_min, u_max=inacc.u_max,
+            time_step=CTRL_T, num_nodes=NODES, real_time=False, rti=True,
+            nlp_max_iter=1, qp_max_iter=4, stats_size=steps,
+            runtime_params=runtime_params,
+        )
+
+    print(f"{'ocp':>10} {'tot p50 ms':>11} {'tot p99 ms':>11} "
+          f"{'qp p50 ms':>10} {'rmse (m)':>9}")
+    for label, ctrl in ctrls.items():
+        sim = MinimalSim(
+            model=acc, data_len=steps,
+            sim_step=SIM_T, control_step=CTRL_T,
+        )
+        x = xref[0]
+        err = np.zeros(steps)
+        for k in range(steps):
+            idx = np.minimum(np.arange(k, k+NODES), xref.shape[0]-1)
+            u = ctrl.get_input(
+                x=x, xset=xref[idx].flatten(), uset=uref[idx].flatten()
+            )
+            x = sim.update(x=x, u=u)
+            err[k] = np.linalg.norm(x[0:3] - xref[k+1, 0:3])
+
+        summary = ctrl.stats.get_summary()
+        print(f"{label:>10} {1000*summary['time_tot']['p50']:>11.3f} "
+              f"{1000*summary['time_tot']['p99']:>11.3f} "
+              f"{1000*summary['time_qp']['p50']:>10.3f} "
+              f"{np.sqrt(np.mean(err**2)):>9.4f}")
+
+
+if __name__=="__main__":
+    run()
@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+
+from qrac.models import Crazyflie, AffineQuadrotor
+from qrac.estimation import get_discrete_dynamics
+import casadi as cs
+import numpy as np
+import time
+
+
+def run():
+    CTRL_T = 0.01
+    CALLS = 10000
+
+    model = AffineQuadrotor(Crazyflie(Ax=0, Ay=0, Az=0))
+    nx = model.nx - model.np
+    dyn = get_discrete_dynamics(model, CTRL_T)
+
+    # separate CasADi functions as previously used by LMS
+    Fd = model.x[:nx] + CTRL_T*model.F
+    Gd = CTRL_T*model.G
+    Fd_func = cs.Function("Fd_func", [model.x[:nx], model.u], [Fd])
+    Gd_func = cs.Function("Gd_func", [model.x[:nx], model.u], [Gd])
+    Gd_T_func = cs.Function("Gd_T_func", [model.x[:nx], model.u], [Gd.T])
+
+    rng = np.random.default_rng(0)
+    xs = rng.standard_normal((CALLS, nx))
+    us = rng.random((CALLS, model.nu))
+    p = model.get_parameters()
+
+    st = time.perf_counter()
+    for x, u in zip(xs, us):
+        x_err = x - Fd_func(x, u) - Gd_func(x, u)@p
+        p_old = np.array(p + Gd_T_func(x, u)@x_err).flatten()
+    t_old = (time.perf_counter() - st) / CALLS
+
+    st = time.perf_counter()
+    for x, u in zip(xs, us):
+        Fd, Gd = dyn.eval(x, u)
+        p_new = p + Gd.T@(x - Fd - Gd@p)
+    t_new = (time.perf_counter() - st) / CALLS
+
+    print(f"LMS gradient step over {CALLS} calls")
+    print(f"casadi functions {1e6*t_old:>8.1f} us")
+    print(f"compiled kernel  {1e6*t_new:>8.1f} us")
+    print(f"max difference   {np.max(np.abs(p_old - p_new)):.2e}")
+
+
+if __name__=="__main__":
+    run()
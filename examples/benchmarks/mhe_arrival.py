@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+from qrac.models import Crazyflie, Quadrotor, AffineQuadrotor
+from qrac.estimation import MHE
+from sm_update import get_transitions
+import numpy as np
+import time
+
+
+def run():
+    CTRL_T = 0.01
+    STEPS = 300
+    NODES = [5, 10, 20, 50]
+    Q_MHE = 10**-3 * np.eye(10)
+    D_MAX = 0.01*np.array([
+        0,0,0, 0,0,0, 1,1,1, 1,1,1,
+    ])
+
+    inacc = Crazyflie(Ax=0, Ay=0, Az=0)
+    acc = Quadrotor(
+        1.5*inacc.m, 1.8*inacc.Ixx, 1.8*inacc.Iyy, 1.8*inacc.Izz,
+        0, 0, 0, inacc.xB, inacc.yB, inacc.k, inacc.u_min, inacc.u_max)
+    p_true = AffineQuadrotor(acc).get_parameters()
+    p_min = p_true - 2*np.abs(p_true)
+    p_max = p_true + 2*np.abs(p_true)
+    xs, us = get_transitions(acc, p_true, D_MAX, CTRL_T, STEPS)
+
+    # the disturbance enters the state derivative, and the uniform
+    # transition noise has a variance of D_MAX^2 / 3 = dt R^-1
+    d_max = D_MAX / CTRL_T
+    R_MHE = np.diag(3 * CTRL_T / np.maximum(D_MAX, 10**-3)**2)
+    p_var = ((p_max - p_min) / 4)**2 + 10**-6
+
+    def get_run(num_nodes, arrival):
+        mhe = MHE(
+            model=inacc, Q=Q_MHE, R=R_MHE,
+            param_min=p_min, param_max=p_max,
+            disturb_min=-d_max, disturb_max=d_max,
+            time_step=CTRL_T, num_nodes=num_nodes,
+            rti=True, nonlinear=False,
+            nlp_tol=10**-6, nlp_max_iter=1, qp_max_iter=10,
+            arrival_cov=p_var if arrival else None,
+        )
+        p = AffineQuadrotor(inacc).get_parameters()
+        times = np.zeros(STEPS)
+        err = np.zeros(STEPS)
+        for k in range(STEPS):
+            st = time.perf_counter()
+            p = mhe.get_param(x=xs[k+1], u=us[k], param=p, timer=False)
+            times[k] = time.perf_counter() - st
+            err[k] = np.linalg.norm(p - p_true) / np.linalg.norm(p_true)
+        return times, err
+
+    res = []
+    for N in NODES:
+        for arrival in [False, True]:
+            res.append((N, arrival, *get_run(N, arrival)))
+
+    print(f"\nmhe over {STEPS} steps, error over the last {STEPS//2}")
+    print(f"{'N':>4} {'arrival':>8} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'rel err':>8}")
+    for N, arrival, times, err in res:
+        p50, p99 = 1000*np.percentile(times, [50, 99])
+        print(f"{N:>4} {str(arrival):>8} {p50:>8.3f} {p99:>8.3f} "
+              f"{np.mean(err[STEPS//2:]):>8.4f}")
+
+
+if __name__=="__main__":
+    run()
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+from qrac.models import Crazyflie
+from qrac.estimation import MHE
+import numpy as np
+import time
+
+
+def legacy_load(mhe, hist, x, u, p, p_min, p_max):
+    # per-stage concatenate + set, as MHE._solve used to do
+    N = mhe._N
+    solver = mhe._solver
+    for k in range(N):
+        if k == N-1:
+            # the last history stage was never written
+            k, xk, uk = N, x, u
+        else:
+            xk, uk, dk = hist["x"][k+1], hist["u"][k], hist["d"][k]
+        x_aug = np.concatenate((xk, p))
+        solver.set(k, "x", x_aug)
+        solver.set(k, "p", uk)
+        if k != N:
+            solver.set(k, "yref", np.concatenate((x_aug, dk)))
+            solver.set(k, "u", dk)
+        solver.set(k, "lbx", np.concatenate((xk, p_min)))
+        solver.set(k, "ubx", np.concatenate((xk, p_max)))
+
+
+def bulk_load(mhe, hist, x, u, p, p_min, p_max):
+    mhe._set_stages(x=x, u=u, p=p, p_min=p_min, p_max=p_max)
+
+
+def run():
+    CTRL_T = 0.01
+    NODES = [10, 50, 150]
+    REPS = 200
+    Q_MHE = 1*np.diag([1,1,1,1,1,1,1,1,1,1])
+    R_MHE = 1 * np.diag([1,1,1, 1,1,1, 1,1,1, 1,1,1])
+    D_MAX = np.array([
+        0,0,0, 0,0,0, 10,10,10, 10,10,10,
+    ])
+
+    model = Crazyflie(Ax=0, Ay=0, Az=0)
+    rng = np.random.default_rng(0)
+
+    print(f"{'N':>6} {'legacy (us)':>12} {'bulk (us)':>12} {'speedup':>8}")
+    for N in NODES:
+        mhe = MHE(
+            model=model, Q=Q_MHE, R=R_MHE,
+            param_min=-np.ones(10), param_max=np.ones(10),
+            disturb_min=-D_MAX, disturb_max=D_MAX,
+            time_step=CTRL_T, num_nodes=N,
+            rti=True, nonlinear=False,
+            nlp_tol=10**-6, nlp_max_iter=1, qp_max_iter=3
+        )
+        # fill the history with random measurements
+        for _ in range(N):
+            mhe._update_horizon(
+                x=rng.random(model.nx), u=rng.random(model.nu),
+                d=rng.random(model.nx)
+            )
+        hist = mhe.get_state()
+        x = rng.random(model.nx)
+        u = rng.random(model.nu)
+        p = rng.random(10)
+        p_min, p_max = mhe.param_bounds
+
+        times = []
+        for load in [legacy_load, bulk_load]:
+            st = time.perf_counter()
+            for _ in range(REPS):
+                load(mhe, hist, x, u, p, p_min, p_max)
+            times.append((time.perf_counter() - st) / REPS)
+
+        print(f"{N:>6} {10**6*times[0]:>12.1f} {10**6*times[1]:>12.1f} "
+              f"{times[0]/times[1]:>8.2f}")
+
+
+if __name__=="__main__":
+    run()
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+
+from qrac.models import Crazyflie, Quadrotor, AffineQuadrotor
+from qrac.control import AdaptiveNMPC
+from qrac.estimation import SetMembershipEstimator, MHE
+from qrac.sim import MinimalSim
+import numpy as np
+import time
+import os
+
+
+def run():
+    # same controller and estimator as lemniscate/sm_mhe_nmpc.py
+    CTRL_T = 0.01
+    NODES = 150
+    STEPS = 500
+    Q = np.diag([1,1,1, 1,1,1, 1,1,1, 1,1,1,])
+    R = np.diag([0, 0, 0, 0])
+    Q_MHE = 1*np.diag([1,1,1,1,1,1,1,1,1,1])
+    R_MHE = 1 * np.diag([1,1,1, 1,1,1, 1,1,1, 1,1,1])
+    NODES_MHE = 50
+    P_TOL = 0.1*np.ones(10)
+    D_MAX = np.array([
+        0,0,0, 0,0,0, 10,10,10, 10,10,10,
+    ])
+    D_MIN = -D_MAX
+    SIM_T = CTRL_T / 10
+
+    refs = os.path.join(os.path.dirname(__file__), "../lemniscate/refs")
+    xref = np.load(os.path.join(refs, "xref.npy"))
+    uref = np.load(os.path.join(refs, "uref.npy"))
+    steps = min(STEPS, xref.shape[0] - 1)
+
+    inacc = Crazyflie(Ax=0, Ay=0, Az=0)
+    acc = Quadrotor(
+        1.5*inacc.m, 1.8*inacc.Ixx, 1.8*inacc.Iyy, 1.8*inacc.Izz,
+        0, 0, 0, inacc.xB, inacc.yB, inacc.k, inacc.u_min, inacc.u_max)
+    p_true = AffineQuadrotor(acc).get_parameters()
+    p_min = p_true - 2*np.abs(p_true)
+    p_max = p_true + 2*np.abs(p_true)
+
+    print(f"{'mode':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8} {'rmse (m)':>9}")
+    p50 = {}
+    for pipelined in [False, True]:
+        mhe = MHE(
+            model=inacc, Q=Q_MHE, R=R_MHE,
+            param_min=p_min, param_max=p_max,
+            disturb_min=D_MIN, disturb_max=D_MAX,
+            time_step=CTRL_T, num_nodes=NODES_MHE,
+            rti=True, nonlinear=False,
+            nlp_tol=10**-6, nlp_max_iter=1, qp_max_iter=3
+        )
+        sm = SetMembershipEstimator(
+            model=inacc, estimator=mhe,
+            param_tol=P_TOL, param_min=p_min, param_max=p_max,
+            disturb_min=D_MIN, disturb_max=D_MAX, time_step=CTRL_T,
+            qp_tol=10**-6, max_iter=10
+        )
+        anmpc = AdaptiveNMPC(
+            model=inacc, estimator=sm, Q=Q, R=R,
+            u_min=inacc.u_min, u_max=inacc.u_max, time_step=CTRL_T,
+            num_nodes=NODES, real_time=False, rti=True,
+            nlp_tol=10**-6, nlp_max_iter=1, qp_max_iter=4,
+            pipelined=pipelined,
+        )
+        sim = MinimalSim(
+            model=acc, data_len=steps,
+            sim_step=SIM_T, control_step=CTRL_T,
+        )
+
+        # identical disturbance sequence for both modes
+        rng = np.random.default_rng(0)
+        x = xref[0]
+        lat = np.zeros(steps)
+        err = np.zeros(steps)
+        for k in range(steps):
+            idx = np.minimum(np.arange(k, k+NODES), xref.shape[0]-1)
+            st = time.perf_counter()
+            u = anmpc.get_input(
+                x=x, xset=xref[idx].flatten(), uset=uref[idx].flatten()
+            )
+            lat[k] = time.perf_counter() - st
+            d = 2*D_MAX*(-0.5 + rng.random(12))
+            x = sim.update(x=x, u=u, d=d)
+            err[k] = np.linalg.norm(x[0:3] - xref[k+1, 0:3])
+
+        label = "pipelined" if pipelined else "sequential"
+        p50[label], p95, p99 = 1000*np.percentile(lat, [50, 95, 99])
+        print(f"{label:>10} {p50[label]:>8.3f} {p95:>8.3f} {p99:>8.3f} "
+              f"{1000*np.max(lat):>8.3f} {np.sqrt(np.mean(err**2)):>9.4f}")
+
+    reduction = 1 - p50["pipelined"] / p50["sequential"]
+    print(f"\nmedian end-to-end latency reduction: {100*reduction:.1f} %")
+
+
+if __name__=="__main__":
+    run()
@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+
+from qrac.estimation import project_box, project_polytope
+from proxsuite import proxqp
+import numpy as np
+import time
+
+
+def proxqp_project(p, C, l, u, p_min, p_max):
+    qp = proxqp.dense.QP(len(p), 0, len(l), True)
+    qp.settings.eps_abs = 10**-9
+    qp.settings.verbose = False
+    qp.init(np.eye(len(p)), -p, None, None, C, l, u, p_min, p_max)
+    qp.solve()
+    return qp.results.x, \
+        qp.results.info.status == proxqp.QPSolverOutput.PROXQP_SOLVED
+
+
+def run():
+    TRIALS = 2000
+    NP = 10
+
+    # sizes of the sliding-window set membership polytopes, once with
+    # params of one scale and once as far apart as those of the models
+    rng = np.random.default_rng(0)
+    problems = {"polytope": [], "scaled polytope": []}
+    for k in range(TRIALS):
+        n = rng.integers(2, 5)
+        m = rng.integers(1, 30)
+        p_feas = rng.standard_normal(n)
+        C = rng.standard_normal((m, n))
+        l = C@p_feas - rng.random(m)
+        u = C@p_feas + rng.random(m)
+        p_min = p_feas - 2*rng.random(n)
+        p_max = p_feas + 2*rng.random(n)
+        p = p_feas + 0.3*rng.standard_normal(n)
+        problems["polytope"].append((p, C, l, u, p_min, p_max))
+        scale = 10**rng.uniform(0, 4, n)
+        problems["scaled polytope"].append((
+            scale*p, C/scale, l, u, scale*p_min, scale*p_max
+        ))
+
+    print(f"{'projection':>20} {'qrac us':>12} {'proxqp us':>10} "
+          f"{'max dist':>11} {'qp fails':>9}")
+
+    p_min = -np.ones(NP)
+    p_max = np.ones(NP)
+    ps = 2*rng.standard_normal((TRIALS, NP))
+    st = time.perf_counter()
+    for p in ps:
+        project_box(p, p_min, p_max)
+    t_box = (time.perf_counter() - st) / TRIALS
+    st = time.perf_counter()
+    for p in ps:
+        proxqp_project(p, np.zeros((0, NP)), np.zeros(0), np.zeros(0),
+                       p_min, p_max)
+    t_qp = (time.perf_counter() - st) / TRIALS
+    print(f"{'box':>20} {1e6*t_box:>12.1f} {1e6*t_qp:>10.1f}")
+
+    # distance to p relative to proxqp where it solved,
+    # at most 1 if never farther
+    for name, probs in problems.items():
+        st = time.perf_counter()
+        sols = [project_polytope(*prob) for prob in probs]
+        t_poly = (time.perf_counter() - st) / TRIALS
+        st = time.perf_counter()
+        refs = [proxqp_project(*prob) for prob in probs]
+        t_qp = (time.perf_counter() - st) / TRIALS
+        ratio = max(
+            np.linalg.norm(sol - prob[0])
+            / max(np.linalg.norm(ref - prob[0]), 10**-12)
+            for sol, (ref, solved), prob in zip(sols, refs, probs) if solved
+        )
+        fails = sum(not solved for ref, solved in refs)
+        print(f"{name:>20} {1e6*t_poly:>12.1f} {1e6*t_qp:>10.1f} "
+              f"{ratio:>11.6f} {fails:>9}")
+
+if __name__=="__main__":
+    run()
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+from qrac.models import Crazyflie
+from qrac.control import NMPC
+import numpy as np
+import time
+
+
+def legacy_load(nmpc, xset, uset):
+    # per-stage concatenate + set, as NMPC._solve used to do
+    nx = nmpc._nx
+    nu = nmpc._nu
+    for k in range(nmpc._N):
+        yref = np.concatenate(
+            (xset[k*nx : k*nx + nx], uset[k*nu : k*nu + nu])
+        )
+        nmpc._solver.set(k, "yref", yref)
+
+
+def bulk_load(nmpc, xset, uset):
+    nx = nmpc._nx
+    nmpc._yref[:, :nx] = xset
+    nmpc._yref[:, nx:] = uset
+    nmpc._set_yref(nmpc._yref)
+
+
+def run():
+    CTRL_T = 0.01
+    NODES = [10, 50, 150, 500, 1000, 3000]
+    REPS = 200
+    Q = np.diag([1,1,1, 1,1,1, 1,1,1, 1,1,1,])
+    R = np.diag([0, 0, 0, 0])
+
+    model = Crazyflie(Ax=0, Ay=0, Az=0)
+    nx = model.nx
+    nu = model.nu
+
+    print(f"{'N':>6} {'legacy (us)':>12} {'bulk (us)':>12} {'speedup':>8}")
+    for N in NODES:
+        nmpc = NMPC(
+            model=model, Q=Q, R=R,
+            u_min=model.u_min, u_max=model.u_max,
+            time_step=CTRL_T, num_nodes=N,
+            rti=True, nlp_max_iter=1, qp_max_iter=5
+        )
+        xset = np.random.rand(N, nx)
+        uset = np.random.rand(N, nu)
+        xset_flat = xset.flatten()
+        uset_flat = uset.flatten()
+
+        st = time.perf_counter()
+        for _ in range(REPS):
+            legacy_load(nmpc, xset_flat, uset_flat)
+        t_legacy = (time.perf_counter() - st) / REPS
+
+        st = time.perf_counter()
+        for _ in range(REPS):
+            bulk_load(nmpc, xset, uset)
+        t_bulk = (time.perf_counter() - st) / REPS
+
+        print(f"{N:>6} {10**6*t_legacy:>12.1f} {10**6*t_bulk:>12.1f} "
+              f"{t_legacy/t_bulk:>8.2f}")
+
+
+if __name__=="__main__":
+    run()
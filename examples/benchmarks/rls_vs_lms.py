@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+from qrac.models import Crazyflie, Quadrotor, AffineQuadrotor
+from qrac.estimation import LMS, RLS
+from sm_update import get_transitions
+from contextlib import redirect_stdout
+import numpy as np
+import time
+import io
+
+
+def run():
+    CTRL_T = 0.01
+    STEPS = 1000
+    D_MAX = 0.001*np.array([
+        0,0,0, 0,0,0, 1,1,1, 1,1,1,
+    ])
+    TOL = 0.05
+    GAINS = [1, 100, 1000]
+
+    inacc = Crazyflie(Ax=0, Ay=0, Az=0)
+    acc = Quadrotor(
+        1.5*inacc.m, 1.8*inacc.Ixx, 1.8*inacc.Iyy, 1.8*inacc.Izz,
+        0, 0, 0, inacc.xB, inacc.yB, inacc.k, inacc.u_min, inacc.u_max)
+    p_true = AffineQuadrotor(acc).get_parameters()
+    p_init = AffineQuadrotor(inacc).get_parameters()
+    p_min = p_true - 2*np.abs(p_true)
+    p_max = p_true + 2*np.abs(p_true)
+    # params that are excited by the rotating start
+    idx = [0, 4, 5, 6, 7, 8]
+
+    x0 = np.zeros(12)
+    x0[2] = 1
+    x0[6:9] = [1, 1, 0]
+    x0[9:12] = [3, -3, 2]
+    xs, us = get_transitions(acc, p_true, D_MAX, CTRL_T, STEPS, x0=x0)
+
+    estimators = [
+        (f"lms, gain {gain:g}", LMS(
+            model=inacc, update_gain=gain, time_step=CTRL_T
+        )) for gain in GAINS
+    ]
+    estimators += [
+        (f"rls, forget {lam:g}", RLS(
+            model=inacc, param_cov=((p_max - p_min)/2)**2 + 10**-12,
+            noise_var=D_MAX**2/3 + 10**-12, time_step=CTRL_T,
+            forget_factor=lam
+        )) for lam in [1.0, 0.99]
+    ]
+
+    print(f"{STEPS} steps, convergence to {100*TOL:g} % relative error")
+    print(f"{'estimator':>18} {'steps':>6} {'us/step':>8} {'final err':>10}")
+    for label, est in estimators:
+        p = np.copy(p_init)
+        times = np.zeros(STEPS)
+        steps = None
+        with redirect_stdout(io.StringIO()):
+            est.get_param(
+                x=xs[0], u=us[0], param=p,
+                param_min=p_min, param_max=p_max, timer=False
+            )
+            for k in range(STEPS):
+                st = time.perf_counter()
+                p = est.get_param(
+                    x=xs[k+1], u=us[k], param=p,
+                    param_min=p_min, param_max=p_max, timer=False
+                )
+                times[k] = time.perf_counter() - st
+                err = np.max(np.abs(p - p_true)[idx] / np.abs(p_true)[idx])
+                if steps is None and err < TOL:
+                    steps = k + 1
+        steps = "-" if steps is None else steps
+        print(f"{label:>18} {steps:>6} {1e6*np.mean(times):>8.1f} "
+              f"{err:>10.4f}")
+
+
+if __name__=="__main__":
+    run()
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+from qrac.models import Crazyflie
+from qrac.control import NMPC
+from qrac.sim import MinimalSim
+import numpy as np
+import time
+import os
+
+
+def run():
+    CTRL_T = 0.01
+    NODES = 150
+    STEPS = 1000
+    Q = np.diag([1,1,1, 1,1,1, 1,1,1, 1,1,1,])
+    R = np.diag([0, 0, 0, 0])
+    SIM_T = CTRL_T / 10
+
+    refs = os.path.join(os.path.dirname(__file__), "../lemniscate/refs")
+    xref = np.load(os.path.join(refs, "xref.npy"))
+    uref = np.load(os.path.join(refs, "uref.npy"))
+    steps = min(STEPS, xref.shape[0] - NODES)
+
+    model = Crazyflie(Ax=0, Ay=0, Az=0)
+    nmpc = NMPC(
+        model=model, Q=Q, R=R,
+        u_min=model.u_min, u_max=model.u_max,
+        time_step=CTRL_T, num_nodes=NODES,
+        rti=True, nlp_max_iter=1, qp_max_iter=5
+    )
+    sim = MinimalSim(
+        model=model, data_len=2*steps,
+        sim_step=SIM_T, control_step=CTRL_T,
+    )
+
+    # combined preparation and feedback on the critical path
+    x = xref[0]
+    t_full = np.zeros(steps)
+    for k in range(steps):
+        st = time.perf_counter()
+        u = nmpc.get_input(x=x, xset=xref[k:k+NODES], uset=uref[k:k+NODES])
+        t_full[k] = time.perf_counter() - st
+        x = sim.update(x=x, u=u)
+
+    # only the feedback phase between measurement and input
+    x = xref[0]
+    t_prep = np.zeros(steps)
+    t_fb = np.zeros(steps)
+    nmpc.prepare(xset=xref[0:NODES], uset=uref[0:NODES])
+    for k in range(steps):
+        st = time.perf_counter()
+        u = nmpc.feedback(x=x)
+        t_fb[k] = time.perf_counter() - st
+        x = sim.update(x=x, u=u)
+        st = time.perf_counter()
+        nmpc.prepare(xset=xref[k+1:k+1+NODES], uset=uref[k+1:k+1+NODES])
+        t_prep[k] = time.perf_counter() - st
+
+    print(f"N = {NODES}, {steps} steps")
+    print(f"get_input latency: p50 {1000*np.median(t_full):.3f} ms, "
+          f"max {1000*np.max(t_full):.3f} ms")
+    print(f"feedback latency:  p50 {1000*np.median(t_fb):.3f} ms, "
+          f"max {1000*np.max(t_fb):.3f} ms")
+    print(f"preparation:       p50 {1000*np.median(t_prep):.3f} ms, "
+          f"max {1000*np.max(t_prep):.3f} ms")
+
+
+if __name__=="__main__":
+    run()
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+
+from qrac.models import Crazyflie, Quadrotor, AffineQuadrotor
+from qrac.estimation import SetMembershipEstimator
+import casadi as cs
+import numpy as np
+import time
+
+
+class PassThrough:
+    """
+    Inner estimator that keeps the parameters,
+    so only the set membership update is timed.
+    """
+    @property
+    def is_nonlinear(self) -> bool:
+        return False
+
+    def get_param(self, x, u, param, param_min, param_max, timer=False):
+        return param
+
+    def get_state(self):
+        return {}
+
+    def set_state(self, state):
+        pass
+
+
+def get_transitions(model, p_true, d_max, dt, steps, seed=0, x0=None):
+    """
+    Transitions of the discretized parameter-affine model
+    with bounded disturbances, so every update is feasible.
+    """
+    aff = AffineQuadrotor(model)
+    nx = model.nx
+    step = cs.Function(
+        "step", [aff.x[:nx], aff.u], [aff.x[:nx] + dt*aff.F, dt*aff.G]
+    )
+    rng = np.random.default_rng(seed)
+    xs = np.zeros((steps+1, nx))
+    us = np.zeros((steps, model.nu))
+    xs[0, 2] = 1
+    if x0 is not None:
+        xs[0] = x0
+    for k in range(steps):
+        us[k] = model.u_max * (0.3 + 0.1*rng.random(model.nu))
+        Fd, Gd = step(xs[k], us[k])
+        d = d_max * (2*rng.random(nx) - 1)
+        xs[k+1] = np.array(Fd + Gd @ p_true).flatten() + d
+    return xs, us
+
+
+def run():
+    CTRL_T = 0.01
+    STEPS = 500
+    P_TOL = 0.1*np.ones(10)
+    D_MAX = 0.01*np.array([
+        0,0,0, 0,0,0, 1,1,1, 1,1,1,
+    ])
+
+    inacc = Crazyflie(Ax=0, Ay=0, Az=0)
+    acc = Quadrotor(
+        1.5*inacc.m, 1.8*inacc.Ixx, 1.8*inacc.Iyy, 1.8*inacc.Izz,
+        0, 0, 0, inacc.xB, inacc.yB, inacc.k, inacc.u_min, inacc.u_max)
+    p_true = AffineQuadrotor(acc).get_parameters()
+    p_min = p_true - 2*np.abs(p_true)
+    p_max = p_true + 2*np.abs(p_true)
+    xs, us = get_transitions(acc, p_true, D_MAX, CTRL_T, STEPS)
+
+    sm = SetMembershipEstimator(
+        model=inacc, estimator=PassThrough(),
+        param_tol=P_TOL, param_min=p_min, param_max=p_max,
+        disturb_min=-D_MAX, disturb_max=D_MAX, time_step=CTRL_T,
+        qp_tol=10**-6, max_iter=10
+    )
+    # each update pairs a state with the input that led to it
+    p = AffineQuadrotor(inacc).get_parameters()
+    sm.get_param(x=xs[0], u=us[0], param=p, timer=False)
+    times = np.zeros(STEPS)
+    for k in range(STEPS):
+        st = time.perf_counter()
+        p = sm.get_param(x=xs[k+1], u=us[k], param=p, timer=False)
+        times[k] = time.perf_counter() - st
+
+    p_lo, p_hi = sm.param_bounds
+    # params that are known to be zero have an empty initial box
+    width = np.divide(
+        p_hi - p_lo, p_max - p_min,
+        out=np.zeros(len(p_true)), where=p_max > p_min
+    )
+    print(f"sm update over {STEPS} steps, np = {len(p_true)}")
+    print(f"mean {1000*np.mean(times):.3f} ms, "
+          f"p99 {1000*np.percentile(times, 99):.3f} ms, "
+          f"total {np.sum(times):.3f} s")
+    print(f"relative box widths:\n{np.round(width, 4)}")
+
+
+if __name__=="__main__":
+    run()
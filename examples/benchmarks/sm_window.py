@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+from qrac.models import Crazyflie, Quadrotor, AffineQuadrotor
+from qrac.estimation import SetMembershipEstimator
+from sm_update import PassThrough, get_transitions
+import numpy as np
+import time
+
+
+def run():
+    CTRL_T = 0.01
+    STEPS = 500
+    WINDOWS = [1, 2, 5, 10, 20]
+    NOISE = [0.001, 0.01]
+
+    inacc = Crazyflie(Ax=0, Ay=0, Az=0)
+    acc = Quadrotor(
+        1.5*inacc.m, 1.8*inacc.Ixx, 1.8*inacc.Iyy, 1.8*inacc.Izz,
+        0, 0, 0, inacc.xB, inacc.yB, inacc.k, inacc.u_min, inacc.u_max)
+    p_true = AffineQuadrotor(acc).get_parameters()
+    p_min = p_true - 2*np.abs(p_true)
+    p_max = p_true + 2*np.abs(p_true)
+    # 5 % of the initial box, params that small are not identifiable
+    # under the disturbance bounds and count as converged
+    P_TOL = np.maximum(0.05*(p_max - p_min), 0.01)
+
+    # rotating start so that every param is excited
+    x0 = np.zeros(12)
+    x0[2] = 1
+    x0[6:9] = [1, 1, 0]
+    x0[9:12] = [3, -3, 2]
+
+    for noise in NOISE:
+        D_MAX = noise*np.array([
+            0,0,0, 0,0,0, 1,1,1, 1,1,1,
+        ])
+        xs, us = get_transitions(acc, p_true, D_MAX, CTRL_T, STEPS, x0=x0)
+        print(f"\ndisturbance bound {noise}, convergence to 5 % of the box")
+        print(f"{'window':>7} {'steps':>6} {'LPs':>6} {'cpu ms':>8} "
+              f"{'ms/step':>8}")
+        for window in WINDOWS:
+            sm = SetMembershipEstimator(
+                model=inacc, estimator=PassThrough(),
+                param_tol=P_TOL, param_min=p_min, param_max=p_max,
+                disturb_min=-D_MAX, disturb_max=D_MAX, time_step=CTRL_T,
+                qp_tol=10**-6, max_iter=10, window=window
+            )
+            p = AffineQuadrotor(inacc).get_parameters()
+            sm.get_param(x=xs[0], u=us[0], param=p, timer=False)
+            cpu = 0.0
+            steps = None
+            for k in range(STEPS):
+                st = time.perf_counter()
+                p = sm.get_param(x=xs[k+1], u=us[k], param=p, timer=False)
+                cpu += time.perf_counter() - st
+                p_lo, p_hi = sm.param_bounds
+                if (p_hi - p_lo <= P_TOL).all():
+                    steps = k + 1
+                    break
+            if steps is None:
+                print(f"{window:>7} {'-':>6} {sm.num_lps:>6} "
+                      f"{1000*cpu:>8.2f} {1000*cpu/STEPS:>8.3f}")
+            else:
+                print(f"{window:>7} {steps:>6} {sm.num_lps:>6} "
+                      f"{1000*cpu:>8.2f} {1000*cpu/steps:>8.3f}")
+
+
+if __name__=="__main__":
+    run()
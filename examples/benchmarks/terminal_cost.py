@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+from qrac.models import Crazyflie
+from qrac.control import NMPC
+from qrac.sim import MinimalSim
+import numpy as np
+import time
+import os
+
+
+def run():
+    CTRL_T = 0.01
+    STEPS = 1000
+    HORIZONS = [10, 20, 40, 75, 150]
+    TERMINAL_COSTS = [None, "hover", "reference"]
+    Q = np.diag([1,1,1, 1,1,1, 1,1,1, 1,1,1,])
+    R = np.diag([0, 0, 0, 0])
+    SIM_T = CTRL_T / 10
+
+    refs = os.path.join(os.path.dirname(__file__), "../lemniscate/refs")
+    xref = np.load(os.path.join(refs, "xref.npy"))
+    uref = np.load(os.path.join(refs, "uref.npy"))
+    steps = min(STEPS, xref.shape[0] - 1)
+
+    model = Crazyflie(Ax=0, Ay=0, Az=0)
+
+    # solver times from the acados statistics, call times of the
+    # whole get_input including the terminal cost update
+    print(f"{'N':>5} {'terminal':>10} {'rmse (m)':>9} "
+          f"{'qp p50 ms':>10} {'tot p50 ms':>11} "
+          f"{'call p50 ms':>12} {'call p99 ms':>12}")
+    for N in HORIZONS:
+        for term in TERMINAL_COSTS:
+            nmpc = NMPC(
+                model=model, Q=Q, R=R,
+                u_min=model.u_min, u_max=model.u_max,
+                time_step=CTRL_T, num_nodes=N,
+                rti=True, nlp_max_iter=1, qp_max_iter=5,
+                stats_size=steps, terminal_cost=term,
+            )
+            sim = MinimalSim(
+                model=model, data_len=steps,
+                sim_step=SIM_T, control_step=CTRL_T,
+            )
+
+            x = xref[0]
+            err = np.zeros(steps)
+            lat = np.zeros(steps)
+            for k in range(steps):
+                idx = np.minimum(np.arange(k, k+N), xref.shape[0]-1)
+                st = time.perf_counter()
+                u = nmpc.get_input(x=x, xset=xref[idx], uset=uref[idx])
+                lat[k] = time.perf_counter() - st
+                x = sim.update(x=x, u=u)
+                err[k] = np.linalg.norm(x[0:3] - xref[k+1, 0:3])
+
+            summary = nmpc.stats.get_summary()
+            call_p50, call_p99 = 1000*np.percentile(lat, [50, 99])
+            print(f"{N:>5} {str(term):>10} {np.sqrt(np.mean(err**2)):>9.4f} "
+                  f"{1000*summary['time_qp']['p50']:>10.3f} "
+                  f"{1000*summary['time_tot']['p50']:>11.3f} "
+                  f"{call_p50:>12.3f} {call_p99:>12.3f}")
+
+
+if __name__=="__main__":
+    run()
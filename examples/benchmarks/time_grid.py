@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+
+from qrac.models import Crazyflie
+from qrac.control import NMPC
+from qrac.sim import MinimalSim
+import numpy as np
+import os
+
+
+def run():
+    CTRL_T = 0.01
+    STEPS = 1000
+    Q = np.diag([1,1,1, 1,1,1, 1,1,1, 1,1,1,])
+    R = np.diag([0, 0, 0, 0])
+    SIM_T = CTRL_T / 10
+    # all grids look 1.5 s (150 control steps) ahead
+    GRIDS = {
+        "uniform": [1]*150,
+        "blocked": [1]*10 + [2]*10 + [4]*30,
+        "coarse": [1]*5 + [3]*5 + [13]*10,
+    }
+
+    refs = os.path.join(os.path.dirname(__file__), "../lemniscate/refs")
+    xref = np.load(os.path.join(refs, "xref.npy"))
+    uref = np.load(os.path.join(refs, "uref.npy"))
+    steps = min(STEPS, xref.shape[0] - 1)
+
+    model = Crazyflie(Ax=0, Ay=0, Az=0)
+
+    print(f"{'grid':>8} {'N':>4} {'rmse (m)':>9} "
+          f"{'tot p50 ms':>11} {'tot p99 ms':>11}")
+    for label, blocks in GRIDS.items():
+        nodes = len(blocks)
+        nmpc = NMPC(
+            model=model, Q=Q, R=R,
+            u_min=model.u_min, u_max=model.u_max,
+            time_step=CTRL_T, num_nodes=nodes,
+            rti=True, nlp_max_iter=1, qp_max_iter=5, stats_size=steps,
+            input_blocks=None if label == "uniform" else blocks,
+        )
+        sim = MinimalSim(
+            model=model, data_len=steps,
+            sim_step=SIM_T, control_step=CTRL_T,
+        )
+
+        x = xref[0]
+        err = np.zeros(steps)
+        for k in range(steps):
+            idx = np.minimum(np.arange(k, k+nmpc.n_ref), xref.shape[0]-1)
+            u = nmpc.get_input(x=x, xset=xref[idx], uset=uref[idx])
+            x = sim.update(x=x, u=u)
+            err[k] = np.linalg.norm(x[0:3] - xref[k+1, 0:3])
+
+        summary = nmpc.stats.get_summary()
+        print(f"{label:>8} {nodes:>4} {np.sqrt(np.mean(err**2)):>9.4f} "
+              f"{1000*summary['time_tot']['p50']:>11.3f} "
+              f"{1000*summary['time_tot']['p99']:>11.3f}")
+
+
+if __name__=="__main__":
+    run()
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+
+from qrac.models import Crazyflie
+from qrac.control import NMPC
+from qrac.sim import MinimalSim
+import numpy as np
+import os
+
+
+def run_closed_loop(nmpc, sim, xref, uref, nodes, steps):
+    nx = xref.shape[1]
+    xset = np.zeros((nodes, nx))
+    uset = np.zeros((nodes, uref.shape[1]))
+    x = xref[0]
+    iters = np.zeros(steps)
+    times = np.zeros(steps)
+    err = np.zeros(steps)
+
+    for k in range(steps):
+        idx = np.minimum(np.arange(k, k+nodes), xref.shape[0]-1)
+        xset[:] = xref[idx]
+        uset[:] = uref[idx]
+        u = nmpc.get_input(x=x, xset=xset, uset=uset)
+        iters[k] = nmpc._solver.get_stats("sqp_iter")
+        times[k] = nmpc._solver.get_stats("time_tot")
+        x = sim.update(x=x, u=u)
+        err[k] = np.linalg.norm(x[0:3] - xref[k+1, 0:3])
+    return iters, times, err
+
+
+def run():
+    CTRL_T = 0.01
+    NODES = 150
+    STEPS = 1000
+    Q = np.diag([1,1,1, 1,1,1, 1,1,1, 1,1,1,])
+    R = np.diag([0, 0, 0, 0])
+    SIM_T = CTRL_T / 10
+    # (rti, nlp_max_iter) settings to compare
+    SETTINGS = [(True, 1), (False, 1), (False, 2), (False, 5)]
+
+    refs = os.path.join(os.path.dirname(__file__), "../lemniscate/refs")
+    xref = np.load(os.path.join(refs, "xref.npy"))
+    uref = np.load(os.path.join(refs, "uref.npy"))
+    steps = min(STEPS, xref.shape[0] - 1)
+
+    model = Crazyflie(Ax=0, Ay=0, Az=0)
+
+    print(f"{'solver':>8} {'max it':>6} {'warm':>5} {'avg it':>7} "
+          f"{'avg ms':>7} {'max ms':>7} {'rmse (m)':>9}")
+    for rti, max_iter in SETTINGS:
+        for warm_start in [False, True]:
+            nmpc = NMPC(
+                model=model, Q=Q, R=R,
+                u_min=model.u_min, u_max=model.u_max,
+                time_step=CTRL_T, num_nodes=NODES,
+                rti=rti, nlp_max_iter=max_iter, qp_max_iter=5,
+                warm_start=warm_start
+            )
+            sim = MinimalSim(
+                model=model, data_len=steps,
+                sim_step=SIM_T, control_step=CTRL_T,
+            )
+            iters, times, err = run_closed_loop(
+                nmpc, sim, xref, uref, NODES, steps
+            )
+            print(f"{'RTI' if rti else 'SQP':>8} {max_iter:>6} "
+                  f"{str(warm_start):>5} {np.mean(iters):>7.2f} "
+                  f"{1000*np.mean(times):>7.3f} {1000*np.max(times):>7.3f} "
+                  f"{np.sqrt(np.mean(err**2)):>9.4f}")
+
+
+if __name__=="__main__":
+    run()
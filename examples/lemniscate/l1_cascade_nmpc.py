@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+import numpy as np
+from qrac.models import Quadrotor, Crazyflie
+from qrac.control import NMPC
+from qrac.control import MultiRateCascade
+from qrac.sim import MinimalSim
+
+
+def run():
+    # mpc settings
+    CTRL_T = 0.01
+    NODES = 150
+    Q = np.diag([1,1,1, 1,1,1, 1,1,1, 1,1,1,])
+    R = np.diag([0, 0, 0, 0])
+
+    # L1 settings, updated 10 times per NMPC solve
+    A_GAIN = 80
+    W = 1000
+    INNER_T = CTRL_T / 10
+
+    # sim settings
+    SIM_T = INNER_T / 10
+    D_MAX = np.array([
+        0,0,0, 0,0,0, 10,10,10, 10,10,10,
+    ])
+
+
+    # load in time optimal trajectory
+    xref = np.load("refs/xref.npy")
+    uref = np.load("refs/uref.npy")
+
+
+    # inaccurate model
+    inacc = Crazyflie(Ax=0, Ay=0, Az=0)
+
+    # true model
+    acc = Quadrotor(
+        1.5*inacc.m, 1.8*inacc.Ixx, 1.8*inacc.Iyy, 1.8*inacc.Izz,
+        0, 0, 0, inacc.xB, inacc.yB, inacc.k,
+        inacc.u_min, inacc.u_max)
+
+
+    # init mpc
+    mpc = NMPC(
+        model=inacc, Q=Q, R=R,
+        u_min=inacc.u_min, u_max=inacc.u_max,
+        time_step=CTRL_T, num_nodes=NODES,
+        rti=True, nlp_max_iter=1, qp_max_iter=5
+    )
+
+    # init cascade
+    cascade = MultiRateCascade(
+        model=inacc, control_ref=mpc,
+        adapt_gain=A_GAIN, bandwidth=W,
+        inner_step=INNER_T, interpolate=True,
+    )
+
+
+    # init sim at the inner rate
+    steps = xref.shape[0]
+    sim = MinimalSim(
+        model=acc, data_len=steps*cascade.ratio,
+        sim_step=SIM_T, control_step=cascade.dt,
+    )
+
+
+    # run for predefined number of steps
+    nx = inacc.nx
+    nu = inacc.nu
+    x = xref[0]
+    for k in range(steps * cascade.ratio):
+        j = k // cascade.ratio
+        idx = np.minimum(np.arange(j, j+NODES), steps-1)
+        xset = xref[idx].flatten()
+        uset = uref[idx].flatten()
+
+        u = cascade.get_input(x=x, xset=xset, uset=uset)
+        d = 2*D_MAX*(-0.5 + np.random.rand(nx))
+        x = sim.update(x=x, u=u, d=d)
+
+        if k % cascade.ratio == 0:
+            print(f"\nu: {u}")
+            print(f"x: {x}")
+            print(f"sim time: {(k+1)*cascade.dt}\n")
+
+
+    # plot
+    sim.get_animation()
+
+
+if __name__=="__main__":
+    run()
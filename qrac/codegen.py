@@ -0,0 +1,317 @@
+#!/usr/bin/python3
+
+from acados_template import AcadosOcpSolver, AcadosOcp,\
+                            AcadosSimSolver, AcadosSim
+import casadi as cs
+import numpy as np
+from contextlib import contextmanager
+import subprocess
+import itertools
+import ctypes
+import hashlib
+import tempfile
+import atexit
+import shutil
+import fcntl
+import time
+import os
+from typing import List, NamedTuple, Tuple
+
+
+# bump to invalidate every cached solver after a breaking change
+CACHE_VERSION = "1"
+_SKIP_KEYS = ("code_export_directory", "json_file")
+_CFLAGS = ["-O3", "-fPIC", "-shared"]
+_counters = {}
+
+
+class BuildInfo(NamedTuple):
+    name: str
+    path: str
+    cache_hit: bool
+    build_time: float
+
+
+def get_cache_dir() -> str:
+    """
+    Directory holding the compiled acados solvers.
+    Overridden by the QRAC_CACHE_DIR environment variable.
+    """
+    cache_dir = os.environ.get("QRAC_CACHE_DIR")
+    if not cache_dir:
+        xdg = os.environ.get(
+            "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+        )
+        cache_dir = os.path.join(xdg, "qrac")
+    return cache_dir
+
+
+def get_namespace(prefix: str) -> str:
+    """
+    Default build namespace of a solver instance: prefix plus a per-process
+    counter, so repeated runs of the same script keep hitting the cache.
+    """
+    counter = _counters.setdefault(prefix, itertools.count())
+    return f"{prefix}_{next(counter)}"
+
+
+def clear_cache() -> None:
+    """
+    Delete every cached acados solver.
+    """
+    shutil.rmtree(get_cache_dir(), ignore_errors=True)
+
+
+def hash_acados_obj(obj) -> str:
+    """
+    Hash of the symbolic model, dims, cost, constraints and solver options
+    of an AcadosOcp or AcadosSim.
+    """
+    h = hashlib.sha256()
+    h.update(CACHE_VERSION.encode())
+    _update_hash(h, obj)
+    return h.hexdigest()
+
+
+def get_ocp_solver(
+    ocp: AcadosOcp,
+    name: str,
+    cache=True,
+) -> Tuple[AcadosOcpSolver, BuildInfo]:
+    """
+    Load the compiled OCP solver from the cache,
+    or generate and build it on a miss.
+    """
+    return _get_solver(AcadosOcpSolver, ocp, name, cache)
+
+
+def get_sim_solver(
+    sim: AcadosSim,
+    name: str,
+    cache=True,
+) -> Tuple[AcadosSimSolver, BuildInfo]:
+    """
+    Load the compiled integrator from the cache,
+    or generate and build it on a miss.
+    """
+    return _get_solver(AcadosSimSolver, sim, name, cache)
+
+
+def get_compiled_function(
+    func: cs.Function,
+    name: str,
+    cache=True,
+) -> Tuple["CompiledFunction", BuildInfo]:
+    """
+    Load the compiled C code of a CasADi function from the cache,
+    or generate and compile it on a miss.
+    """
+    h = hashlib.sha256()
+    h.update(CACHE_VERSION.encode())
+    h.update(" ".join(_CFLAGS).encode())
+    h.update(func.serialize().encode())
+    if cache:
+        path = os.path.join(get_cache_dir(), f"{name}_{h.hexdigest()[:16]}")
+        os.makedirs(path, exist_ok=True)
+    else:
+        path = tempfile.mkdtemp(prefix=f"qrac_{name}_")
+        atexit.register(shutil.rmtree, path, True)
+    lib = os.path.join(path, f"{func.name()}.so")
+
+    with _build_lock(path):
+        st = time.perf_counter()
+        hit = _is_built(path)
+        if not hit:
+            gen = cs.CodeGenerator(
+                f"{func.name()}.c",
+                {"casadi_int": "long long int", "casadi_real": "double"}
+            )
+            gen.add(func)
+            gen.generate(path + os.sep)
+            cc = os.environ.get("CC", "gcc")
+            subprocess.run(
+                [cc, *_CFLAGS, os.path.join(path, f"{func.name()}.c"),
+                 "-o", lib, "-lm"],
+                check=True
+            )
+        compiled = CompiledFunction(func, lib)
+        info = _finish_build(name, path, hit, time.perf_counter() - st)
+    return compiled, info
+
+
+class CompiledFunction:
+    """
+    Compiled CasADi function called through ctypes on preallocated
+    dense float64 buffers, skipping the CasADi call overhead.
+    The outputs are overwritten by the next call.
+    """
+
+    def __init__(
+        self,
+        func: cs.Function,
+        lib_path: str,
+    ) -> None:
+        self._func = func
+        self._lib_path = lib_path
+        self._name = func.name()
+        self._lib = ctypes.CDLL(lib_path)
+        self._f = getattr(self._lib, self._name)
+        self._f.restype = ctypes.c_int
+        self._f.argtypes = [
+            ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_void_p),
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int
+        ]
+        self._in = [
+            np.zeros(func.size1_in(i) * func.size2_in(i))
+            for i in range(func.n_in())
+        ]
+        self._out = [
+            np.zeros(func.nnz_out(i)) for i in range(func.n_out())
+        ]
+        for i in range(func.n_in()):
+            if not func.sparsity_in(i).is_dense():
+                raise ValueError("Compiled function inputs must be dense!")
+        for i in range(func.n_out()):
+            if not func.sparsity_out(i).is_dense():
+                raise ValueError("Compiled function outputs must be dense!")
+        self._iw = np.zeros(max(func.sz_iw(), 1), dtype=np.int64)
+        self._w = np.zeros(max(func.sz_w(), 1))
+        self._arg = (ctypes.c_void_p * max(func.sz_arg(), 1))(
+            *[buf.ctypes.data for buf in self._in]
+        )
+        self._res = (ctypes.c_void_p * max(func.sz_res(), 1))(
+            *[buf.ctypes.data for buf in self._out]
+        )
+        self._iw_ptr = self._iw.ctypes.data
+        self._w_ptr = self._w.ctypes.data
+
+    @property
+    def inputs(self) -> List[np.ndarray]:
+        """
+        Input buffers, which may be written in place
+        and then evaluated with call().
+        """
+        return self._in
+
+    @property
+    def outputs(self) -> List[np.ndarray]:
+        return self._out
+
+    def copy(self) -> "CompiledFunction":
+        """
+        Function on the same loaded library with its own buffers,
+        so that copies may be called from separate threads.
+        """
+        return CompiledFunction(self._func, self._lib_path)
+
+    def __call__(self, *args) -> List[np.ndarray]:
+        for buf, arg in zip(self._in, args):
+            buf[:] = arg
+        return self.call()
+
+    def call(self) -> List[np.ndarray]:
+        """
+        Evaluate on the current contents of the input buffers.
+        """
+        if self._f(self._arg, self._res, self._iw_ptr, self._w_ptr, 0):
+            raise RuntimeError(f"Evaluation of '{self._name}' failed!")
+        return self._out
+
+
+def _get_solver(
+    solver_type,
+    obj,
+    name: str,
+    cache: bool
+):
+    # the namespace goes into the model name so that the C symbols
+    # of solvers loaded side by side in one process never collide
+    obj.model.name = f"{name}_{obj.model.name}"
+    path = _get_build_path(obj, name, cache)
+    obj.code_export_directory = os.path.join(path, "c_generated_code")
+    json_file = os.path.join(path, f"{name}.json")
+
+    # processes sharing the cache wait for each other's builds
+    with _build_lock(path):
+        st = time.perf_counter()
+        hit = _is_built(path)
+        if not hit:
+            # remove leftovers of an interrupted build
+            shutil.rmtree(obj.code_export_directory, ignore_errors=True)
+        solver = solver_type(
+            obj, json_file=json_file, generate=not hit, build=not hit
+        )
+        info = _finish_build(name, path, hit, time.perf_counter() - st)
+    return solver, info
+
+
+def _get_build_path(
+    obj,
+    name: str,
+    cache: bool
+) -> str:
+    if not cache:
+        # throwaway build, deleted when the script is terminated
+        path = tempfile.mkdtemp(prefix=f"qrac_{name}_")
+        atexit.register(shutil.rmtree, path, True)
+        return path
+    path = os.path.join(
+        get_cache_dir(), f"{name}_{hash_acados_obj(obj)[:16]}"
+    )
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+@contextmanager
+def _build_lock(path: str):
+    with open(os.path.join(path, ".lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _is_built(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, ".built"))
+
+
+def _finish_build(
+    name: str,
+    path: str,
+    hit: bool,
+    build_time: float
+) -> BuildInfo:
+    if not hit:
+        open(os.path.join(path, ".built"), "w").close()
+    status = "hit" if hit else "miss"
+    print(f"{name}: build cache {status}, loaded in {build_time:.3f} s")
+    return BuildInfo(
+        name=name, path=path, cache_hit=hit, build_time=build_time
+    )
+
+
+def _update_hash(h, obj) -> None:
+    if isinstance(obj, (cs.SX, cs.MX, cs.DM)):
+        # printing rounds the constants, the serialized
+        # function keeps them exactly
+        args = [] if isinstance(obj, cs.DM) else cs.symvar(obj)
+        h.update(cs.Function("h", args, [obj]).serialize().encode())
+    elif isinstance(obj, np.ndarray):
+        h.update(f"{obj.dtype}{obj.shape}".encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=str):
+            if str(key).endswith(_SKIP_KEYS):
+                continue
+            h.update(str(key).encode())
+            _update_hash(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f"{type(obj).__name__}{len(obj)}".encode())
+        for item in obj:
+            _update_hash(h, item)
+    elif hasattr(obj, "__dict__"):
+        h.update(type(obj).__name__.encode())
+        _update_hash(h, vars(obj))
+    else:
+        h.update(repr(obj).encode())
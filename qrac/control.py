@@ -11,16 +11,18 @@ May need to install qpOASES version 3.1 as well.
 from acados_template import AcadosOcpSolver, AcadosOcp
 import casadi as cs
 import numpy as np
-from scipy.linalg import block_diag, expm
+from scipy.linalg import block_diag, expm, solve_discrete_are
 from scipy.interpolate import make_interp_spline
 import matplotlib.pyplot as plt
 import matplotlib
-import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import time
 from typing import List, Tuple
-import atexit
-import shutil
-import os
+from qrac.codegen import BuildInfo, get_ocp_solver, get_namespace,\
+                         get_compiled_function
+from qrac.stats import SolverStats
+from qrac.realtime import EstimatorWorker, EstimatorStats
 from qrac.models import Quadrotor, AffineQuadrotor,\
                         ParameterizedQuadrotor
 
@@ -42,33 +44,118 @@ class NMPC:
         rti: bool,
         nlp_tol=10**-6,
         nlp_max_iter=20,
-        qp_max_iter=20
+        qp_max_iter=20,
+        cache=True,
+        name=None,
+        warm_start=False,
+        stats_size=0,
+        terminal_cost=None,
+        time_steps=None,
+        input_blocks=None,
+        terminal_tol=0.05,
     ) -> None:
         """
         Initialize the MPC with dynamics from casadi variables,
         Q & R cost matrices, maximum and minimum thrusts, time-step,
-        and number of shooting nodes (length of prediction horizon)
+        and number of shooting nodes (length of prediction horizon).
+        The compiled solver is reused from the build cache unless
+        cache is False. name sets the build namespace of this instance,
+        by default a unique one is generated. With warm_start, the previous
+        primal-dual solution is shifted by one node before every solve,
+        which needs a uniform grid.
+        A positive stats_size keeps the acados statistics of that many
+        recent solves. terminal_cost set to "hover" or "reference" adds
+        the DARE solution of the model linearized around hover, or around
+        the terminal reference, as the terminal weight. In "reference"
+        mode the DARE is only re-solved once a state that the
+        linearization depends on moves by more than terminal_tol, which
+        happens in prepare() when the RTI phases are split.
+        For a non-uniform grid, time_steps gives the length of each of the
+        num_nodes shooting intervals, or input_blocks gives how many control
+        steps each input is held for. References are then still passed at
+        the control step and resampled onto the shooting nodes.
         """
         self._nx = model.nx
         self._nu = model.nu
-        self._assert(model, Q, R, u_max, u_min, time_step, num_nodes,)
+        self._assert(
+            model, Q, R, u_max, u_min, time_step, num_nodes, terminal_cost,
+            time_steps, input_blocks, warm_start,
+        )
         self._u_avg = (u_min + u_max) / 2
         self._dt = time_step
         self._N = num_nodes
-        self._solver = self._init_solver(
+        self._init_grid(time_steps, input_blocks)
+        self._rti = rti
+        self._prepared = False
+        self._name = name if name else get_namespace("mpc")
+
+        # acados runtime parameters of the model, if any
+        self._n_p = model.p.shape[0] if type(model.p) == cs.SX else 0
+        self._p_val = model.get_parameters() if self._n_p else np.zeros(0)
+        self._p_buf = np.tile(self._p_val, (self._N + 1, 1))
+
+        self._f_step = self._get_step_func(model)
+        self._term = terminal_cost
+        self._term_tol = terminal_tol
+        if terminal_cost:
+            self._init_terminal_cost(model, Q, R)
+            W_e = self._get_terminal_weight(self._x_lin)
+        else:
+            W_e = None
+        self._solver, self._build_info = self._init_solver(
             model=model, Q=Q, R=R, u_min=u_min, u_max=u_max, rti=rti,
-            nlp_tol=nlp_tol, nlp_max_iter=nlp_max_iter, qp_max_iter=qp_max_iter
+            nlp_tol=nlp_tol, nlp_max_iter=nlp_max_iter,
+            qp_max_iter=qp_max_iter, cache=cache, W_e=W_e
         )
-        # deleting acados compiled files when script is terminated.
-        atexit.register(self._clear_files)
+        # one solve at a time per instance, solves release the GIL
+        self._lock = threading.Lock()
+        self._stats = SolverStats(stats_size) if stats_size else None
+
+        # persistent (N, nx+nu) reference buffer, hover input by default
+        self._yref = np.zeros((self._N, self._nx + self._nu))
+        self._yref[:, self._nx:] = self._u_avg
+        self._set_yref = self._get_yref_setter()
+
+        self._warm = warm_start
+        if warm_start:
+            self._lam_dims = [
+                self._solver.get(k, "lam").shape[0]
+                for k in range(self._N + 1)
+            ]
 
     @property
     def dt(self) -> float:
         return self._dt
 
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def build_info(self) -> BuildInfo:
+        return self._build_info
+
+    @property
+    def stats(self) -> SolverStats:
+        return self._stats
+
     @property
     def n_set(self) -> int:
-        return self._N * self._nx
+        return self._M * self._nx
+
+    @property
+    def n_ref(self) -> int:
+        """
+        Number of reference samples, spaced by the control step.
+        """
+        return self._M
+
+    @property
+    def t_nodes(self) -> np.ndarray:
+        """
+        Times of the N shooting nodes from the start of the horizon.
+        """
+        return self._t_nodes
 
     def get_input(
         self,
@@ -79,12 +166,77 @@ class NMPC:
     ) -> np.ndarray:
         """
         Get the first control input from the optimization.
+        xset and uset may be flat (N*nx,) / (N*nu,) vectors
+        or (N, nx) / (N, nu) arrays.
         """
-        if not len(uset):
-            uset = np.tile(self._u_avg, self._N)
-        self._solve(x=x, xset=xset, uset=uset, timer=timer)
-        nxt_ctrl = np.array(self._solver.get(0, "u"))
-        return nxt_ctrl
+        nxt_ctrl = np.empty((1, self._nu))
+        with self._lock:
+            self._solve(x=x, xset=xset, uset=uset, timer=timer)
+            self._read_solution(xs=None, us=nxt_ctrl, num_nodes=1)
+        return nxt_ctrl[0]
+
+    def set_parameters(
+        self,
+        p: np.ndarray,
+    ) -> None:
+        """
+        Set the runtime model parameters of every stage in one call.
+        """
+        assert p.shape[0] == self._n_p
+        with self._lock:
+            self._p_val[:] = p
+            self._p_buf[:] = p
+            self._solver.set_flat("p", self._p_buf.ravel())
+
+    def prepare(
+        self,
+        xset: np.ndarray,
+        uset=[],
+        timer=False,
+    ) -> None:
+        """
+        Load the references and run the RTI preparation phase,
+        meant to be called right after a control input is applied.
+        """
+        with self._lock:
+            if timer: st = time.perf_counter()
+            self._set_reference(xset=xset, uset=uset)
+            if self._rti:
+                self._solver.options_set("rti_phase", 1)
+                self._solve_phase(rti_phase=1)
+            self._prepared = True
+            if timer:
+                et = time.perf_counter()
+                print(f"mpc preparation runtime: {et - st}")
+
+    def feedback(
+        self,
+        x: np.ndarray,
+        timer=False,
+    ) -> np.ndarray:
+        """
+        Run the RTI feedback phase on the new measurement
+        and get the first control input. Outside of RTI mode
+        the full optimization is solved here.
+        """
+        with self._lock:
+            if timer: st = time.perf_counter()
+            if not self._prepared:
+                raise RuntimeError(
+                    "Please call 'prepare' before every call to 'feedback'!")
+            assert x.shape[0] == self._nx
+            self._solver.set(0, "lbx", x)
+            self._solver.set(0, "ubx", x)
+            if self._rti:
+                self._solver.options_set("rti_phase", 2)
+            self._solve_phase(rti_phase=2 if self._rti else 0)
+            self._prepared = False
+            nxt_ctrl = np.empty((1, self._nu))
+            self._read_solution(xs=None, us=nxt_ctrl, num_nodes=1)
+            if timer:
+                et = time.perf_counter()
+                print(f"mpc feedback runtime: {et - st}")
+        return nxt_ctrl[0]
 
     def get_state(
         self,
@@ -96,11 +248,11 @@ class NMPC:
         """
         Get the next state from the optimization.
         """
-        if not len(uset):
-            uset = np.tile(self._u_avg, self._N)
-        self._solve(x=x, xset=xset, uset=uset, timer=timer)
-        nxt_state = np.array(self._solver.get(1, "x"))
-        return nxt_state
+        nxt_states = np.empty((2, self._nx))
+        with self._lock:
+            self._solve(x=x, xset=xset, uset=uset, timer=timer)
+            self._read_solution(xs=nxt_states, us=None, num_nodes=2)
+        return nxt_states[1]
 
     def get_trajectory(
         self,
@@ -109,22 +261,88 @@ class NMPC:
         uset=[],
         timer=False,
         visuals=False,
+        xs=None,
+        us=None,
+        num_nodes=None,
     ) -> Tuple[np.ndarray]:
         """
-        Get the next state from the optimization.
+        Get the predicted state and input trajectories from the
+        optimization, optionally only the first num_nodes stages
+        and written into the preallocated xs and us.
         """
-        if not len(uset):
-            uset = np.tile(self._u_avg, self._N)
-        self._solve(x=x, xset=xset, uset=uset, timer=timer)
-        opt_xs = np.zeros((self._N, self._nx))
-        opt_us = np.zeros((self._N, self._nu))
-        for k in range(self._N):
-            opt_xs[k] = self._solver.get(k, "x")
-            opt_us[k] = self._solver.get(k, "u")
+        with self._lock:
+            self._solve(x=x, xset=xset, uset=uset, timer=timer)
+            opt_xs, opt_us = self._get_solution_buffers(xs, us, num_nodes)
+            self._read_solution(
+                xs=opt_xs, us=opt_us, num_nodes=opt_xs.shape[0]
+            )
         if visuals:
             self._vis_plots(opt_xs, opt_us)
         return opt_xs, opt_us
 
+    def get_solution(
+        self,
+        xs=None,
+        us=None,
+        num_nodes=None,
+        duals=False,
+    ) -> Tuple[np.ndarray]:
+        """
+        Read the trajectories of the last solve without solving again,
+        optionally only the first num_nodes stages and written into the
+        preallocated xs and us. With duals, the (N, nx) dynamics
+        multipliers pi and the flat inequality multipliers lam
+        of the full horizon are returned as well.
+        """
+        with self._lock:
+            opt_xs, opt_us = self._get_solution_buffers(xs, us, num_nodes)
+            self._read_solution(
+                xs=opt_xs, us=opt_us, num_nodes=opt_xs.shape[0]
+            )
+            if duals:
+                pis = self._solver.get_flat("pi").reshape(self._N, self._nx)
+                lams = self._solver.get_flat("lam")
+                return opt_xs, opt_us, pis, lams
+        return opt_xs, opt_us
+
+    def _get_solution_buffers(
+        self,
+        xs: np.ndarray,
+        us: np.ndarray,
+        num_nodes: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        if num_nodes is None:
+            num_nodes = self._N if xs is None else xs.shape[0]
+        assert 0 < num_nodes <= self._N
+        if xs is None: xs = np.empty((num_nodes, self._nx))
+        if us is None: us = np.empty((num_nodes, self._nu))
+        assert xs.shape == (num_nodes, self._nx)
+        assert us.shape == (num_nodes, self._nu)
+        return xs, us
+
+    def _read_solution(
+        self,
+        xs: np.ndarray,
+        us: np.ndarray,
+        num_nodes: int,
+    ) -> None:
+        """
+        Copy the first num_nodes stages of the solution into xs and us,
+        either can be None to skip it. Short prefixes are read stage by
+        stage, longer ones with one flat get per field.
+        """
+        if 2*num_nodes < self._N:
+            for k in range(num_nodes):
+                if xs is not None: xs[k] = self._solver.get(k, "x")
+                if us is not None: us[k] = self._solver.get(k, "u")
+        else:
+            if xs is not None:
+                xs[:] = self._solver.get_flat("x")[: num_nodes*self._nx]\
+                    .reshape(num_nodes, self._nx)
+            if us is not None:
+                us[:] = self._solver.get_flat("u")[: num_nodes*self._nu]\
+                    .reshape(num_nodes, self._nu)
+
     def _solve(
         self,
         x: np.ndarray,
@@ -138,28 +356,251 @@ class NMPC:
         """
         if timer: st = time.perf_counter()
         assert x.shape[0] == self._nx
-        assert xset.shape[0] == self.n_set
-        assert uset.shape[0] == self._nu * self._N
 
         # bound x to initial state
         self._solver.set(0, "lbx", x)
         self._solver.set(0, "ubx", x)
+        self._set_reference(xset=xset, uset=uset)
 
-        # the reference input will be the hover input
-        for k in range(self._N):
-            yref = np.concatenate(
-                (xset[k*self._nx : k*self._nx + self._nx],
-                 uset[k*self._nu : k*self._nu + self._nu])
-            )
-            self._solver.set(k, "yref", yref)
-        
-        self._solver.solve()
+        # both RTI phases at once
+        if self._rti:
+            self._solver.options_set("rti_phase", 0)
+        self._prepared = False
+        self._solve_phase(rti_phase=0)
         #self._solver.print_statistics()
 
         if timer:
             et = time.perf_counter()
             print(f"mpc runtime: {et - st}")
 
+    def _solve_phase(
+        self,
+        rti_phase: int,
+    ) -> int:
+        status = self._solver.solve()
+        if self._stats is not None:
+            self._stats.record(self._solver, status, rti_phase)
+        return status
+
+    def _set_reference(
+        self,
+        xset: np.ndarray,
+        uset: np.ndarray,
+    ) -> None:
+        """
+        Shift the warm start if enabled, then load the
+        state and input references of all stages.
+        """
+        assert xset.size == self.n_set
+        assert not len(uset) or uset.size == self._nu * self._M
+
+        if self._warm: self._shift_iterate()
+
+        # the reference input will be the hover input
+        xset = xset.reshape(self._M, self._nx)
+        self._resample(xset, self._yref[:, :self._nx])
+        if len(uset):
+            self._resample(
+                uset.reshape(self._M, self._nu), self._yref[:, self._nx:]
+            )
+        else:
+            self._yref[:, self._nx:] = self._u_avg
+        self._set_yref(self._yref)
+
+        if self._term:
+            self._set_terminal_cost(xset[-1])
+
+    def _resample(
+        self,
+        ref: np.ndarray,
+        out: np.ndarray,
+    ) -> None:
+        """
+        Linearly interpolate references sampled at the control step
+        onto the shooting nodes.
+        """
+        if self._uniform:
+            out[:] = ref
+        else:
+            np.take(ref, self._ref_idx, axis=0, out=out)
+            out += self._ref_w * (ref[self._ref_idx + 1] - out)
+
+    def _init_grid(
+        self,
+        time_steps: np.ndarray,
+        input_blocks: np.ndarray,
+    ) -> None:
+        """
+        Shooting interval lengths, integrator steps per interval
+        and reference interpolation onto the nodes.
+        """
+        if input_blocks is not None:
+            self._num_steps = np.array(input_blocks, dtype=int)
+            self._time_steps = self._dt * self._num_steps
+        elif time_steps is not None:
+            self._time_steps = np.array(time_steps, dtype=float)
+            # integrate coarse intervals as finely as the control step
+            self._num_steps = np.maximum(
+                1, np.round(self._time_steps / self._dt)).astype(int)
+        else:
+            self._time_steps = self._dt * np.ones(self._N)
+            self._num_steps = np.ones(self._N, dtype=int)
+        self._uniform = time_steps is None and input_blocks is None
+
+        self._t_nodes = np.concatenate(([0], np.cumsum(self._time_steps)[:-1]))
+        tf = np.sum(self._time_steps)
+        self._M = self._N if self._uniform else int(round(tf / self._dt))
+
+        # left sample index and weight of every node
+        t = np.minimum(self._t_nodes / self._dt, self._M - 1)
+        self._ref_idx = np.minimum(np.floor(t).astype(int), self._M - 2)
+        self._ref_idx = np.maximum(self._ref_idx, 0)
+        self._ref_w = (t - self._ref_idx).reshape(self._N, 1)
+
+    def _set_terminal_cost(
+        self,
+        x_e: np.ndarray,
+    ) -> None:
+        """
+        Track the last state reference at the terminal node, re-solving
+        the DARE in "reference" mode once the states the linearization
+        depends on move past the tolerance.
+        """
+        self._solver.cost_set(self._N, "yref", x_e)
+        if self._term == "reference":
+            idx = self._lin_idx
+            dist = np.max(np.abs(x_e[idx] - self._x_lin[idx]), initial=0)
+            if dist > self._term_tol:
+                self._x_lin[idx] = x_e[idx]
+                W_e = self._get_terminal_weight(self._x_lin)
+                self._solver.cost_set(self._N, "W", W_e)
+
+    def _init_terminal_cost(
+        self,
+        model: Quadrotor,
+        Q: np.ndarray,
+        R: np.ndarray,
+    ) -> None:
+        """
+        Linearization point and jacobians of the discrete model
+        for the DARE terminal weight.
+        """
+        # augmented models carry their constant parameters as states
+        self._np_lin = 0 if self._n_p else getattr(model, "np", 0)
+        n = self._nx - self._np_lin
+        self._x_lin = np.zeros(self._nx)
+        if self._np_lin:
+            self._x_lin[n:] = model.get_parameters()
+
+        # hover thrusts: total thrust cancels gravity, zero torques
+        B = np.array(cs.evalf(model.B))
+        alloc = np.vstack((np.ones((1, self._nu)), B))
+        thrust = np.concatenate(([9.81 * model.m], np.zeros(B.shape[0])))
+        self._u_lin = np.linalg.lstsq(alloc, thrust, rcond=None)[0]
+
+        p = self._get_param_sym(model)
+        xf = self._f_step(model.x, model.u, p)
+        self._jac_A = cs.Function(
+            "jac_A", [model.x, model.u, p], [cs.jacobian(xf, model.x)])
+        self._jac_B = cs.Function(
+            "jac_B", [model.x, model.u, p], [cs.jacobian(xf, model.u)])
+        # states the jacobians depend on, the positions do not matter and
+        # the parameters (if any) stay at the nominal linearization point
+        jac = cs.vertcat(
+            cs.vec(cs.jacobian(xf, model.x)), cs.vec(cs.jacobian(xf, model.u))
+        )
+        deps = np.unique(cs.jacobian(jac, model.x).sparsity().get_col())
+        self._lin_idx = deps[deps < n].astype(int)
+
+        # the DARE needs a positive definite input weight
+        R_lin = R + 10**-6 * np.eye(self._nu) \
+            if np.min(np.linalg.eigvalsh(R)) <= 0 else R
+        # path stages are weighted by their interval length and the
+        # terminal stage by 1 (see cost_scaling in _init_solver), so the
+        # cost-to-go is the sum of dt*(x'Qx + u'Ru) over control steps
+        self._Q_lin = self._dt * Q[:n, :n]
+        self._R_lin = self._dt * R_lin
+
+    def _get_terminal_weight(
+        self,
+        x_lin: np.ndarray,
+    ) -> np.ndarray:
+        n = self._nx - self._np_lin
+        A = np.array(self._jac_A(x_lin, self._u_lin, self._p_val))[:n, :n]
+        B = np.array(self._jac_B(x_lin, self._u_lin, self._p_val))[:n, :]
+        P = solve_discrete_are(A, B, self._Q_lin, self._R_lin)
+        W_e = np.zeros((self._nx, self._nx))
+        W_e[:n, :n] = P
+        return W_e
+
+    def _shift_iterate(self) -> None:
+        """
+        Shift the last primal-dual solution forward by one node.
+        The last input is duplicated and the terminal state is
+        extrapolated with one model step.
+        """
+        N = self._N
+        xs = self._solver.get_flat("x").reshape(N+1, self._nx)
+        us = self._solver.get_flat("u").reshape(N, self._nu)
+        pis = self._solver.get_flat("pi").reshape(N, self._nx)
+        lams = self._solver.get_flat("lam")
+
+        x_e = np.array(self._f_step(xs[N], us[N-1], self._p_val)).flatten()
+        xs[:N] = xs[1:]
+        xs[N] = x_e
+        us[:N-1] = us[1:]
+        pis[:N-1] = pis[1:]
+
+        # only the path stages share constraint dims
+        n_0, n_k = self._lam_dims[0], self._lam_dims[1]
+        lams[n_0 : n_0 + (N-2)*n_k] = lams[n_0 + n_k : n_0 + (N-1)*n_k]
+
+        self._solver.set_flat("x", xs.flatten())
+        self._solver.set_flat("u", us.flatten())
+        self._solver.set_flat("pi", pis.flatten())
+        self._solver.set_flat("lam", lams)
+
+    def _get_step_func(
+        self,
+        model: Quadrotor,
+    ) -> cs.Function:
+        """
+        One RK4 step of the prediction model over the control step.
+        """
+        x = model.x
+        u = model.u
+        p = self._get_param_sym(model)
+        f = cs.Function("f", [x, u, p], [model.xdot])
+        k1 = f(x, u, p)
+        k2 = f(x + self._dt/2 * k1, u, p)
+        k3 = f(x + self._dt/2 * k2, u, p)
+        k4 = f(x + self._dt * k3, u, p)
+        xf = x + self._dt/6 * (k1 + 2*k2 + 2*k3 + k4)
+        return cs.Function("f_step", [x, u, p], [xf])
+
+    def _get_param_sym(
+        self,
+        model: Quadrotor,
+    ) -> cs.SX:
+        if self._n_p:
+            return model.p
+        return cs.SX.sym("p", 0)
+
+    def _get_yref_setter(self):
+        """
+        Push the whole (N, ny) reference to acados in one call when the
+        installed acados_template has a slice setter, otherwise fall back
+        to per-stage sets on rows of the persistent buffer.
+        """
+        if hasattr(self._solver, "cost_set_slice"):
+            def set_yref(yref: np.ndarray) -> None:
+                self._solver.cost_set_slice(0, self._N, "yref", yref)
+        else:
+            def set_yref(yref: np.ndarray) -> None:
+                for k in range(self._N):
+                    self._solver.cost_set(k, "yref", yref[k])
+        return set_yref
+
     def _init_solver(
         self,
         model: Quadrotor,
@@ -170,8 +611,10 @@ class NMPC:
         rti: bool,
         nlp_tol: float,
         nlp_max_iter: int,
-        qp_max_iter: int
-    ) -> AcadosOcpSolver:
+        qp_max_iter: int,
+        cache: bool,
+        W_e=None,
+    ) -> Tuple[AcadosOcpSolver, BuildInfo]:
         """
         Guide to acados OCP formulation:
         https://github.com/acados/acados/blob/master/docs/problem_formulation/problem_formulation_ocp_mex.pdf
@@ -190,7 +633,10 @@ class NMPC:
         ocp.dims.nbu = model.nu
 
         # total horizon in seconds
-        ocp.solver_options.tf = self._dt * self._N
+        ocp.solver_options.tf = np.sum(self._time_steps)
+        if not self._uniform:
+            ocp.solver_options.time_steps = self._time_steps
+            ocp.solver_options.sim_method_num_steps = self._num_steps
 
         # formulate the default least-squares cost as a quadratic cost
         ocp.cost.cost_type = "LINEAR_LS"
@@ -208,9 +654,26 @@ class NMPC:
         # Initialize reference trajectory (will be overwritten)
         ocp.cost.yref = np.zeros(ny)
 
+        # acados weights each path stage by its interval length and
+        # the terminal stage by 1, pinned here where the option exists
+        if hasattr(ocp.solver_options, "cost_scaling"):
+            ocp.solver_options.cost_scaling = np.append(self._time_steps, 1)
+
+        # terminal value function from the DARE
+        if W_e is not None:
+            ocp.dims.ny_e = model.nx
+            ocp.cost.W_e = W_e
+            ocp.cost.Vx_e = np.eye(model.nx)
+            ocp.cost.yref_e = np.zeros(model.nx)
+
         # Initial state (will be overwritten)
         ocp.constraints.x0 = np.zeros(model.nx)
 
+        # runtime model parameters (will be overwritten)
+        if self._n_p:
+            ocp.dims.np = self._n_p
+            ocp.parameter_values = np.copy(self._p_val)
+
         # control input constraints (square of motor freq)
         ocp.constraints.idxbu = np.arange(model.nu)
         ocp.constraints.lbu = u_min
@@ -242,17 +705,14 @@ class NMPC:
         ocp.solver_options.integrator_type = "ERK"
         ocp.solver_options.print_level = 0
 
-        ocp.code_export_directory = "mpc_c_code"
-        name = "acados_mpc.json"
-
         if rti:
             ocp.solver_options.nlp_solver_type = "SQP_RTI"
-            solver = AcadosOcpSolver(ocp, json_file=name)
+            solver, info = get_ocp_solver(ocp, self._name, cache)
             solver.options_set("rti_phase", 0)
         else:
             ocp.solver_options.nlp_solver_type = "SQP"
-            solver = AcadosOcpSolver(ocp,  json_file=name)
-        return solver
+            solver, info = get_ocp_solver(ocp, self._name, cache)
+        return solver, info
 
     def _vis_plots(
         self,
@@ -265,7 +725,7 @@ class NMPC:
         """
         fig, axs = plt.subplots(5, figsize=(11, 9))
         interp_N = 1000
-        t = self._dt * np.arange(self._N)
+        t = self._t_nodes
 
         legend = ["u1", "u2", "u3", "u4"]
         self._plot_trajectory(
@@ -334,6 +794,10 @@ class NMPC:
         u_min: np.ndarray,
         time_step: float,
         num_nodes: int,
+        terminal_cost=None,
+        time_steps=None,
+        input_blocks=None,
+        warm_start=False,
     ) -> None:
         if type(model) != Quadrotor \
             and type(model) !=AffineQuadrotor\
@@ -361,19 +825,35 @@ class NMPC:
         if type(num_nodes) != int:
             raise ValueError(
                 "Please input the number of shooting nodes as an integer!")
-
-    def _clear_files(self) -> None:
-        """
-        Clean up the acados generated files.
-        """
-        try:
-            shutil.rmtree("mpc_c_code")
-        except:
-            print("failed to delete mpc_c_code")
-        try:
-            os.remove("acados_mpc.json")
-        except:
-            print("failed to delete acados_mpc.json")
+        if num_nodes < 1:
+            raise ValueError(
+                "Please input at least one shooting node!")
+        if terminal_cost not in (None, "hover", "reference"):
+            raise ValueError(
+                "Please input the terminal cost as None, 'hover' or 'reference'!")
+        if time_steps is not None and input_blocks is not None:
+            raise ValueError(
+                "Please input either the time steps or the input blocks, not both!")
+        for grid in [time_steps, input_blocks]:
+            if grid is not None and len(grid) != num_nodes:
+                raise ValueError(
+                    f"Please input the time steps or input blocks as a vector of length {num_nodes}!")
+            if grid is not None and np.min(grid) <= 0:
+                raise ValueError(
+                    "The time steps and input blocks should be positive!")
+        # references are interpolated between two control steps
+        tf = time_step * np.sum(input_blocks) if input_blocks is not None \
+            else np.sum(time_steps) if time_steps is not None else None
+        if tf is not None and round(tf / time_step) < 2:
+            raise ValueError(
+                "A non-uniform grid should span at least two control steps!")
+        # the warm start shifts the iterate by one node of length time_step
+        if warm_start and (
+            (time_steps is not None and not np.allclose(time_steps, time_step))
+            or (input_blocks is not None and np.any(np.array(input_blocks) != 1))
+        ):
+            raise ValueError(
+                "The shifted warm start is only available on a uniform grid!")
 
 
 def npify(arr_like) -> np.ndarray:
@@ -396,11 +876,39 @@ class AdaptiveNMPC():
         nlp_tol=10**-6,
         nlp_max_iter=10,
         qp_max_iter=10,
+        cache=True,
+        name=None,
+        warm_start=False,
+        stats_size=0,
+        terminal_cost=None,
+        time_steps=None,
+        input_blocks=None,
+        terminal_tol=0.05,
+        runtime_params=False,
+        sample_buffer_size=64,
+        pipelined=False,
     ) -> None:
+        """
+        With runtime_params, the estimated parameters are passed to the
+        OCP as acados runtime parameters instead of augmented states,
+        so the OCP keeps the nominal state dimension.
+        In real-time mode, up to sample_buffer_size measurements are
+        queued for the estimator process between two of its ticks.
+        Pipelined mode runs the estimator update of step k in a worker
+        thread during the solve of step k, which uses the estimate of
+        step k-1. Only the parts of the update that release the GIL,
+        such as acados solves, overlap with the NMPC solve, the
+        proxsuite bound LPs of set membership estimation do not.
+        """
+        if real_time and pipelined:
+            raise ValueError(
+                "Pipelined mode is only available outside of real-time mode!")
         self._nx = model.nx
         self._nu = model.nu
         self._N = num_nodes
         self._rt = real_time
+        self._pl = pipelined
+        self._rp = runtime_params
 
         self._est = estimator
         if estimator.is_nonlinear:
@@ -408,22 +916,43 @@ class AdaptiveNMPC():
         else:
             model_aug = AffineQuadrotor(model)
         self._np = model_aug.np
-        Q_aug = self._augment_cost(Q)
+        if runtime_params:
+            model_aug.set_runtime_parameters()
+            Q_aug = Q
+        else:
+            Q_aug = self._augment_cost(Q)
         self._mpc = NMPC(
             model=model_aug, Q=Q_aug, R=R,
             u_min=u_min, u_max=u_max,
             time_step=time_step,
             num_nodes=num_nodes, rti=rti,
             nlp_tol=nlp_tol, nlp_max_iter=nlp_max_iter,
-            qp_max_iter=qp_max_iter
+            qp_max_iter=qp_max_iter, cache=cache, name=name,
+            warm_start=warm_start, stats_size=stats_size,
+            terminal_cost=terminal_cost, time_steps=time_steps,
+            input_blocks=input_blocks, terminal_tol=terminal_tol
         )
-
-        self._p = mp.Array("f", model_aug.get_parameters())
-        self._x = mp.Array("f", np.zeros(model.nx))
-        self._u = mp.Array("f", np.zeros(self._nu))
-        self._timer = mp.Value("b", False)
+        # number of reference samples, N unless the grid is non-uniform
+        self._M = self._mpc.n_ref
+        # persistent augmented state and reference, the parameter
+        # blocks of the reference stay zero as they are not penalized
+        self._x_aug = np.zeros(self._nx + self._np)
+        self._xset_aug = np.zeros((self._M, self._nx + self._np))
+
+        self._p = np.array(model_aug.get_parameters(), dtype=float)
+        self._u_prev = np.zeros(self._nu)
         if real_time:
-            self._run_flag = mp.Value("b", True)
+            self._worker = EstimatorWorker(
+                estimator=estimator, nx=self._nx, nu=self._nu,
+                param_init=self._p, period=self.dt,
+                buffer_size=sample_buffer_size
+            )
+        if pipelined:
+            # persistent thread, acados releases the GIL while it solves
+            self._pool = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="qrac_est"
+            )
+            self._est_future = None
 
     @property
     def dt(self) -> float:
@@ -431,20 +960,72 @@ class AdaptiveNMPC():
 
     @property
     def n_set(self) -> int:
-        return self._N * self._nx
+        return self._M * self._nx
+
+    @property
+    def stats(self) -> SolverStats:
+        return self._mpc.stats
 
     def start(self) -> None:
         if not self._rt:
             print("Cannot call 'start' outside of real-time mode!")
         else:
-            proc = mp.Process(target=self._param_proc, args=[])
-            proc.start()
+            self._worker.start()
 
     def stop(self) -> None:
         if not self._rt:
             print("Cannot call 'stop' outside of real-time mode!")
         else:
-            self._run_flag.value = False
+            if self._worker.is_running:
+                self._worker.stop()
+                print("\nParameter Estimator successfully stopped.")
+
+    def close(self) -> None:
+        """
+        Shut down the estimator thread of pipelined mode,
+        after which no more inputs can be computed.
+        """
+        if self._pl:
+            self._pool.shutdown()
+
+    def __del__(self) -> None:
+        # the pool does not exist if the constructor raised
+        if hasattr(self, "_pool"):
+            self.close()
+
+    def get_estimator_stats(self) -> EstimatorStats:
+        """
+        Scheduling, throughput and latency statistics
+        of the real-time parameter estimation loop.
+        """
+        if not self._rt:
+            raise RuntimeError(
+                "The estimator is only scheduled in real-time mode!")
+        return self._worker.get_stats()
+
+    def get_param_bounds(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._rt:
+            return self._worker.get_param_bounds()
+        p_min, p_max = self._est.param_bounds
+        return np.copy(p_min), np.copy(p_max)
+
+    def get_estimator_state(self) -> dict:
+        """
+        Snapshot of the estimator history,
+        taken from the estimator process if it is running.
+        """
+        if self._rt:
+            return self._worker.get_state()
+        return self._est.get_state()
+
+    def set_estimator_state(
+        self,
+        state: dict,
+    ) -> None:
+        if self._rt:
+            self._worker.set_state(state)
+        else:
+            self._est.set_state(state)
 
     def get_input(
         self,
@@ -453,50 +1034,100 @@ class AdaptiveNMPC():
         uset=[],
         timer=False,
     ) -> np.ndarray:
-        self._x[:] = x
-        self._timer.value = timer
-        if not self._rt: self._get_param()
-
-        x_aug = np.concatenate((x, npify(self._p)))
-        xset_aug = self._augment_xset(xset)
-        self._u[:] = self._mpc.get_input(
-            x=x_aug, xset=xset_aug, uset=uset, timer=timer
-        )
-        return npify(self._u)
+        p = self._update_param(x, timer)
+        if self._rp:
+            self._mpc.set_parameters(p)
+            u = self._mpc.get_input(
+                x=x, xset=xset, uset=uset, timer=timer
+            )
+        else:
+            x_aug = self._augment_x(x, p)
+            xset_aug = self._augment_xset(xset)
+            u = self._mpc.get_input(
+                x=x_aug, xset=xset_aug, uset=uset, timer=timer
+            )
+        self._join_param()
+        self._u_prev[:] = u
+        return u
+
+    def prepare(
+        self,
+        xset: np.ndarray,
+        uset=[],
+        timer=False,
+    ) -> None:
+        """
+        Runtime parameters enter the linearization, so the latest
+        estimate is pushed here, one step behind the feedback.
+        """
+        if self._rp:
+            self._mpc.set_parameters(self._p)
+            self._mpc.prepare(xset=xset, uset=uset, timer=timer)
+        else:
+            xset_aug = self._augment_xset(xset)
+            self._mpc.prepare(xset=xset_aug, uset=uset, timer=timer)
+
+    def feedback(
+        self,
+        x: np.ndarray,
+        timer=False,
+    ) -> np.ndarray:
+        """
+        Augmented-state parameters only enter through the initial state
+        bound, so the estimator update stays out of the preparation phase.
+        """
+        p = self._update_param(x, timer)
+        if self._rp:
+            u = self._mpc.feedback(x=x, timer=timer)
+        else:
+            x_aug = self._augment_x(x, p)
+            u = self._mpc.feedback(x=x_aug, timer=timer)
+        self._join_param()
+        self._u_prev[:] = u
+        return u
+
+    def _augment_x(
+        self,
+        x: np.ndarray,
+        p: np.ndarray,
+    ) -> np.ndarray:
+        self._x_aug[:self._nx] = x
+        self._x_aug[self._nx:] = p
+        return self._x_aug
 
     def _augment_xset(
         self,
         xset: np.ndarray
     ) -> np.ndarray:
-        nx = self._nx
-        xset_aug = np.zeros(self._N * (nx+self._np))
-        for k in range(self._N):
-            xset_aug[k*(nx+self._np) : k*(nx+self._np) + nx] =\
-                xset[k*nx : k*nx + nx]
-        return xset_aug
-
-    def _param_proc(self) -> None:
-        param_proc = mp.Process(target=self._run_param_est)
-        param_proc.start()
-        param_proc.join()
-        print("\nParameter Estimator successfully stopped.")
-
-    def _run_param_est(self) -> None:
-        st = time.perf_counter()
-        while self._run_flag.value:
-            et = time.perf_counter()
-            if et - st >= self.dt:
-                st = et
-                self._get_param()
-
-    def _get_param(self) -> None:
-        param = self._est.get_param(
-            x=npify(self._x),
-            u=npify(self._u),
-            param=npify(self._p),
-            timer=self._timer.value
-        )
-        self._p[:] = param
+        # flat or (M, nx) input, one strided copy into the state block
+        self._xset_aug[:, :self._nx] = xset.reshape(self._M, self._nx)
+        return self._xset_aug
+
+    def _update_param(
+        self,
+        x: np.ndarray,
+        timer: bool,
+    ) -> np.ndarray:
+        # the estimator pairs each measurement with the input that led to it
+        if self._rt:
+            self._worker.push(x=x, u=self._u_prev, timer=timer)
+            self._worker.get_param(out=self._p)
+        elif self._pl:
+            self._est_future = self._pool.submit(
+                self._est.get_param, x=np.copy(x), u=np.copy(self._u_prev),
+                param=np.copy(self._p), timer=timer
+            )
+        else:
+            self._p = self._est.get_param(
+                x=x, u=self._u_prev, param=self._p, timer=timer
+            )
+        return self._p
+
+    def _join_param(self) -> None:
+        # the next step uses this estimate, whatever the thread timing
+        if self._pl:
+            self._p = self._est_future.result()
+            self._est_future = None
 
     def _augment_cost(
         self,
@@ -515,18 +1146,25 @@ class L1Augmentation():
         control_ref,
         adapt_gain: float,
         bandwidth: float,
+        cache=True,
+        name=None,
+        time_step=None,
     ) -> None:
+        """
+        The predictor, adaptation law and low-pass filter are compiled
+        into a single C function with every constant folded in.
+        name -> build namespace, unique by default
+        time_step -> L1 update step, the reference controller step
+            by default, see MultiRateCascade for faster updates
+        """
         self._z_idx = 6
         self._nz = 6
         self._nm = 4
         self._num = 2
-        self._assert(model, control_ref, adapt_gain, bandwidth,)
-
-        self._ul1 = np.zeros(model.nu)
-        self._z = np.zeros(self._nz)
-        self._d_m = np.zeros(self._nm)
-        self._d_um = np.zeros(self._num)
-        self._f, self._g_m, self._g_um = self._get_dynamics_funcs(model)
+        self._assert(model, control_ref, adapt_gain, bandwidth, time_step)
+        if time_step is None:
+            time_step = control_ref.dt
+        self._name = name if name else get_namespace("l1")
         self._Am = -np.array([
             [1, 0, 0, 0, 0, 0],
             [0, 1, 0, 0, 0, 0],
@@ -537,15 +1175,29 @@ class L1Augmentation():
         ])
         self._a_gain = adapt_gain
         self._adapt_exp, self._adapt_mat, self._filter_exp = \
-            self._get_l1_const(bandwidth, control_ref.dt)
+            self._get_l1_const(bandwidth, time_step)
 
         self._model = model
         self._ctrl_ref = control_ref
-        self._dt = control_ref.dt
+        self._dt = time_step
 
-        self._x = np.zeros(model.nx)
-        self._xset = np.zeros(control_ref.n_set)
-        self._u_ref = np.zeros(model.nu)
+        self._step, self._build_info = get_compiled_function(
+            self._get_step_func(model), self._name, cache
+        )
+        # the adaptive state is the state input buffer of the
+        # compiled step, with named views of z, ul1, d_m and d_um
+        self._s = self._step.inputs[2]
+        self._z, self._ul1, self._d_m, self._d_um = np.split(
+            self._s, np.cumsum([self._nz, model.nu, self._nm])
+        )
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def build_info(self) -> BuildInfo:
+        return self._build_info
 
     @property
     def dt(self) -> float:
@@ -563,63 +1215,59 @@ class L1Augmentation():
         timer=False,
     ) -> np.ndarray:
         assert x.shape[0] == self._model.nx
-        assert xset.shape[0] == self._ctrl_ref.n_set
+        assert xset.size == self._ctrl_ref.n_set
         uref = self._ctrl_ref.get_input(x=x, xset=xset, uset=uset, timer=timer)
         ul1 = self._get_l1_input(x=x, uref=uref, timer=timer)
         u = uref + ul1
         return u
 
-    def _get_l1_input(
+    def prepare(
         self,
-        x: np.ndarray,
-        uref: np.ndarray,
-        timer: bool
+        xset: np.ndarray,
+        uset=[],
+        timer=False,
     ) -> None:
-        st = time.perf_counter()
-        z_err, g_m, g_um = self._predictor(x=x, uref=uref)
-        d_m = self._adaptation(z_err=z_err, g_m=g_m, g_um=g_um)
-        ul1 = self._control_law(d_m=d_m)
-        if timer:
-            print(f"L1 runtime: {time.perf_counter() - st}")
-        return ul1
+        assert xset.size == self._ctrl_ref.n_set
+        self._ctrl_ref.prepare(xset=xset, uset=uset, timer=timer)
 
-    def _predictor(
+    def feedback(
         self,
         x: np.ndarray,
-        uref: np.ndarray
-    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-        z_err = np.array(
-            self._z - x[self._z_idx : self._z_idx+self._nz]
-        )
-        f = np.array(self._f(x, uref)).reshape(self._nz)
-        g_m = np.array(self._g_m(x))
-        g_um = np.array(self._g_um(x))
-        self._z += self._dt * (self._Am @ z_err \
-            + f + g_m@(self._ul1 + self._d_m) \
-            + g_um @ self._d_um)
-        return z_err, g_m, g_um
-
-    def _adaptation(
-        self,
-        z_err,
-        g_m: np.ndarray,
-        g_um: np.ndarray
+        timer=False,
     ) -> np.ndarray:
-        I = np.eye(self._nz)
-        G = np.block([g_m, g_um])
-        mu = self._adapt_exp @ z_err
-        adapt = self._a_gain * -I @ np.linalg.inv(G) @ self._adapt_mat @ mu
-        self._d_m = adapt[: self._nm]
-        self._d_um = adapt[self._nm : self._nm + self._num]
-        return self._d_m
+        assert x.shape[0] == self._model.nx
+        uref = self._ctrl_ref.feedback(x=x, timer=timer)
+        ul1 = self._get_l1_input(x=x, uref=uref, timer=timer)
+        u = uref + ul1
+        return u
 
-    def _control_law(
+    def get_l1_input(
         self,
-        d_m: np.ndarray
-    ) -> None:
-        self._ul1 = self._filter_exp * self._ul1 \
-            - (1-self._filter_exp)*d_m
-        return self._ul1
+        x: np.ndarray,
+        uref: np.ndarray,
+        timer=False,
+    ) -> np.ndarray:
+        """
+        Advance the L1 loop by one step on a reference input
+        and get the adaptive input to add to it.
+        """
+        assert x.shape[0] == self._model.nx
+        return self._get_l1_input(x=x, uref=uref, timer=timer)
+
+    def _get_l1_input(
+        self,
+        x: np.ndarray,
+        uref: np.ndarray,
+        timer: bool
+    ) -> np.ndarray:
+        st = time.perf_counter()
+        x_in, uref_in, _ = self._step.inputs
+        x_in[:] = x
+        uref_in[:] = uref
+        self._s[:] = self._step.call()[0]
+        if timer:
+            print(f"L1 runtime: {time.perf_counter() - st}")
+        return np.copy(self._ul1)
 
     def _get_l1_const(
         self,
@@ -631,28 +1279,50 @@ class L1Augmentation():
         filter_exp = np.exp(-bandwidth*time_step)
         return adapt_exp, adapt_mat, filter_exp
 
-    def _get_dynamics_funcs(
+    def _get_step_func(
         self,
         model: Quadrotor,
-    ) -> Tuple[cs.Function]:
+    ) -> cs.Function:
+        """
+        One L1 step: state predictor, piecewise-constant adaptation
+        and low-pass filter, mapping (x, uref, s) to the next s,
+        where s stacks z, ul1, d_m and d_um.
+        """
         # rotation matrix from body frame to inertial frame
         b1 = model.R[:,0]
         b2 = model.R[:,1]
         b3 = model.R[:,2]
 
         f = model.xdot[6:12]
-        g_m = cs.SX(cs.vertcat(
+        g_m = cs.vertcat(
             b3/model.m @ cs.SX.ones(1,4),
             cs.inv(model.J) @ model.B
-        ))
-        g_um = cs.SX(cs.vertcat(
+        )
+        g_um = cs.vertcat(
             cs.horzcat(b1, b2)/model.m,
             cs.SX.zeros(3,2)
-        ))
-        f_func = cs.Function("f", [model.x, model.u], [f])
-        g_m_func = cs.Function("g_m", [model.x], [g_m])
-        g_um_func = cs.Function("g_um", [model.x], [g_um])
-        return f_func, g_m_func, g_um_func
+        )
+
+        s = cs.SX.sym("s", self._nz + model.nu + self._nm + self._num)
+        z, ul1, d_m, d_um = cs.vertsplit(
+            s, np.cumsum([0, self._nz, model.nu, self._nm, self._num]).tolist()
+        )
+        z_err = z - model.x[self._z_idx : self._z_idx+self._nz]
+
+        # predictor
+        z_nxt = z + self._dt * (
+            cs.DM(self._Am) @ z_err + f + g_m @ (ul1 + d_m) + g_um @ d_um
+        )
+        # adaptation law
+        mu = cs.DM(self._adapt_mat @ self._adapt_exp) @ z_err
+        adapt = -self._a_gain * cs.solve(cs.horzcat(g_m, g_um), mu)
+        d_m_nxt = adapt[: self._nm]
+        d_um_nxt = adapt[self._nm : self._nm + self._num]
+        # low-pass filter
+        ul1_nxt = self._filter_exp*ul1 - (1-self._filter_exp)*d_m_nxt
+
+        s_nxt = cs.densify(cs.vertcat(z_nxt, ul1_nxt, d_m_nxt, d_um_nxt))
+        return cs.Function("l1_step", [model.x, model.u, s], [s_nxt])
 
     def _assert(
         self,
@@ -660,6 +1330,7 @@ class L1Augmentation():
         control_ref,
         adapt_gain: float,
         bandwidth: float,
+        time_step,
     ) -> None:
         if type(model) != Quadrotor:
             raise TypeError(
@@ -686,3 +1357,132 @@ class L1Augmentation():
         if type(bandwidth) != int and type(bandwidth) != float:
             raise TypeError(
                 "Please input the bandwidth as an integer or float!")
+        if time_step is not None:
+            if type(time_step) != int and type(time_step) != float:
+                raise TypeError(
+                    "Please input the L1 time step as an integer or float!")
+            if not 0 < time_step <= control_ref.dt:
+                raise ValueError(
+                    "The L1 time step should be positive and no greater than the reference controller step!")
+
+
+class MultiRateCascade():
+    def __init__(
+        self,
+        model: Quadrotor,
+        control_ref: NMPC,
+        adapt_gain: float,
+        bandwidth: float,
+        inner_step: float,
+        interpolate=True,
+        cache=True,
+        name=None,
+    ) -> None:
+        """
+        Runs the NMPC at its own step and an L1 loop around it at the
+        faster inner_step, which is also the step of get_input. Between
+        NMPC solves the reference input is held, or linearly interpolated
+        between the first two stages of the predicted input trajectory.
+        """
+        self._assert(control_ref, inner_step, interpolate)
+        self._ratio = int(round(control_ref.dt / inner_step))
+        self._ctrl_ref = control_ref
+        self._interp = interpolate
+        self._l1 = L1Augmentation(
+            model=model, control_ref=control_ref,
+            adapt_gain=adapt_gain, bandwidth=bandwidth,
+            cache=cache, name=name, time_step=inner_step,
+        )
+        self._dt = inner_step
+        self._nx = model.nx
+
+        self._k = 0
+        self._us = np.zeros((2, model.nu))
+        self._uref = np.zeros(model.nu)
+        if interpolate:
+            # time from an NMPC solve to its second stage
+            self._h = control_ref.t_nodes[1] - control_ref.t_nodes[0]
+
+    @property
+    def dt(self) -> float:
+        return self._dt
+
+    @property
+    def outer_dt(self) -> float:
+        return self._ctrl_ref.dt
+
+    @property
+    def ratio(self) -> int:
+        """
+        Number of inner steps per NMPC solve.
+        """
+        return self._ratio
+
+    @property
+    def n_set(self) -> int:
+        return self._ctrl_ref.n_set
+
+    def reset(self) -> None:
+        """
+        Solve the NMPC again on the next call.
+        """
+        self._k = 0
+
+    def get_input(
+        self,
+        x: np.ndarray,
+        xset: np.ndarray,
+        uset=[],
+        timer=False,
+    ) -> np.ndarray:
+        """
+        Call once every inner step, xset and uset
+        are only read at the steps with an NMPC solve.
+        """
+        assert x.shape[0] == self._nx
+        i = self._k % self._ratio
+        if i == 0:
+            assert xset.size == self._ctrl_ref.n_set
+            if self._interp:
+                _, us = self._ctrl_ref.get_trajectory(
+                    x=x, xset=xset, uset=uset, timer=timer, num_nodes=2
+                )
+                self._us[:] = us
+            else:
+                self._us[0] = self._ctrl_ref.get_input(
+                    x=x, xset=xset, uset=uset, timer=timer
+                )
+        self._k += 1
+        self._uref[:] = self._us[0]
+        if self._interp:
+            alpha = min(i * self._dt / self._h, 1.0)
+            self._uref += alpha * (self._us[1] - self._us[0])
+
+        ul1 = self._l1.get_l1_input(x=x, uref=self._uref, timer=timer)
+        return self._uref + ul1
+
+    def _assert(
+        self,
+        control_ref,
+        inner_step: float,
+        interpolate: bool,
+    ) -> None:
+        if type(inner_step) != int and type(inner_step) != float:
+            raise TypeError(
+                "Please input the inner step as an integer or float!")
+        if inner_step <= 0:
+            raise ValueError("The inner step should be positive!")
+        ratio = control_ref.dt / inner_step
+        if ratio < 1 or abs(ratio - round(ratio)) > 10**-6:
+            raise ValueError(
+                "The reference controller step should be an integer multiple of the inner step!")
+        if interpolate:
+            try:
+                control_ref.get_trajectory
+                control_ref.t_nodes
+            except AttributeError:
+                raise NotImplementedError(
+                    "Interpolation needs 'get_trajectory' and 't_nodes' in your reference controller class!")
+            if len(control_ref.t_nodes) < 2:
+                raise ValueError(
+                    "Interpolation needs a reference controller with at least two shooting nodes!")
@@ -4,15 +4,336 @@ from acados_template import AcadosOcpSolver, AcadosOcp
 import casadi as cs
 import numpy as np
 from scipy.linalg import block_diag
-from qpsolvers.solvers.proxqp_ import proxqp_solve_qp
+from proxsuite import proxqp
+import threading
 import time
-from typing import Tuple
-import atexit
-import shutil
-import os
+from typing import List, Tuple
+from qrac.codegen import BuildInfo, get_ocp_solver, get_namespace,\
+                         get_compiled_function, CompiledFunction
+from qrac.stats import SolverStats
 from qrac.models import Quadrotor, AffineQuadrotor, ParameterizedQuadrotor
 
 
+_kernels = {}
+_kernels_lock = threading.Lock()
+
+
+def get_discrete_dynamics(
+    model: AffineQuadrotor,
+    time_step: float,
+    cache=True,
+) -> "DiscreteDynamics":
+    """
+    Compiled discrete dynamics of the model. The library is compiled
+    and loaded once per process for the same model and time step,
+    but every call returns a kernel with its own buffers.
+    """
+    func, rows, cols = DiscreteDynamics.get_func(model, time_step)
+    key = func.serialize()
+    with _kernels_lock:
+        if key not in _kernels:
+            _kernels[key] = get_compiled_function(
+                func, "discrete_dynamics", cache
+            )
+    compiled, info = _kernels[key]
+    return DiscreteDynamics(compiled.copy(), info, rows, cols, model.np)
+
+
+def project(
+    p: np.ndarray,
+    p_min: np.ndarray,
+    p_max: np.ndarray,
+    C=None,
+    l=None,
+    u=None,
+) -> np.ndarray:
+    """
+    Euclidean projection of p onto the box, or onto the polytope
+    l <= C p <= u within the box if C is given.
+    """
+    if C is None or not len(C):
+        return project_box(p, p_min, p_max)
+    return project_polytope(p, C, l, u, p_min, p_max)
+
+
+def project_box(
+    p: np.ndarray,
+    p_min: np.ndarray,
+    p_max: np.ndarray,
+) -> np.ndarray:
+    return np.minimum(np.maximum(p, p_min), p_max)
+
+
+def project_polytope(
+    p: np.ndarray,
+    C: np.ndarray,
+    l: np.ndarray,
+    u: np.ndarray,
+    p_min: np.ndarray,
+    p_max: np.ndarray,
+    tol=10**-9,
+    max_iter=100,
+) -> np.ndarray:
+    """
+    Euclidean projection of p onto l <= C p <= u within the box by the
+    dual active-set method of Goldfarb and Idnani. It starts from p
+    itself and adds the most violated constraint until none is left,
+    so a p that is already feasible costs a single check. The QR
+    factors of the active rows are updated as rows are added and
+    dropped rather than refactored. Falls back to the box projection
+    if the polytope is empty.
+    """
+    n = len(p)
+    # two-sided rows scaled to unit norm so that tol is a distance
+    norms = np.sqrt(np.einsum("ij,ij->i", C, C))
+    norms[norms == 0] = 1.0
+    A = np.vstack((C / norms[:, None], np.eye(n)))
+    lo = np.concatenate((l / norms, p_min))
+    hi = np.concatenate((u / norms, p_max))
+
+    q = np.array(p, dtype=float)
+    # N^T = J[:, :k] R for the k active rows N, signed to read N q <= b,
+    # the columns of J from k on span the space they leave free
+    J = np.eye(n)
+    R = np.zeros((n, n))
+    R_inv = np.zeros((n, n))
+    mult = np.zeros(n)
+    k = 0
+    for _ in range(max_iter):
+        Aq = A @ q
+        viol = np.maximum(Aq - hi, lo - Aq)
+        j = int(np.argmax(viol))
+        if viol[j] <= tol:
+            return q
+        if Aq[j] > hi[j]:
+            a, b = A[j], hi[j]
+        else:
+            a, b = -A[j], -lo[j]
+        u_j = 0.0
+        while True:
+            d = a @ J
+            # largest step that keeps the multipliers nonnegative
+            t_dual = np.inf
+            if k:
+                z = J[:, k:] @ d[k:]
+                r = R_inv[:k, :k] @ d[:k]
+                ratios = np.where(r > tol, mult[:k], np.inf) \
+                    / np.maximum(r, tol)
+                drop = int(np.argmin(ratios))
+                t_dual = ratios[drop]
+            else:
+                z, r = a, mult[:0]
+            zn = z @ a
+            t_primal = (a @ q - b) / zn if zn > tol else np.inf
+            t = min(t_dual, t_primal)
+            if not np.isfinite(t):
+                return project_box(p, p_min, p_max)
+            q -= t * z
+            mult[:k] -= t * r
+            u_j += t
+            if t_primal <= t_dual:
+                # a Householder reflection of the free columns
+                # turns d[k:] into a multiple of the first one
+                v = d[k:]
+                sigma = -np.copysign(np.sqrt(v @ v), v[0])
+                v[0] -= sigma
+                J[:, k:] += np.outer(J[:, k:] @ v, v / (v[0] * sigma))
+                R[:k, k] = d[:k]
+                R[k, k] = sigma
+                R_inv[:k, k] = R_inv[:k, :k] @ d[:k] / -sigma
+                R_inv[k, k] = 1 / sigma
+                mult[k] = u_j
+                k += 1
+                break
+            # dropping a column leaves R upper Hessenberg from it on,
+            # which Givens rotations of its rows and of J undo
+            k -= 1
+            R[:, drop:k] = R[:, drop+1:k+1]
+            mult[drop:k] = mult[drop+1:k+1]
+            for i in range(drop, k):
+                G = np.array([
+                    [R[i, i], R[i+1, i]], [-R[i+1, i], R[i, i]]
+                ]) / np.hypot(R[i, i], R[i+1, i])
+                R[i:i+2] = G @ R[i:i+2]
+                J[:, i:i+2] = J[:, i:i+2] @ G.T
+            R[:, k] = 0.0
+            R[k] = 0.0
+            R_inv[:, k] = 0.0
+            R_inv[k] = 0.0
+            R_inv[:k, :k] = np.linalg.inv(R[:k, :k])
+    return q
+
+
+class DiscreteDynamics:
+    """
+    Compiled kernel of the discretized parameter-affine model
+    x_next = Fd(x, u) + Gd(x, u) p, evaluating Fd and only the
+    structurally nonzero entries of Gd in one call into preallocated
+    buffers. The last evaluation is reused when called again at the
+    same (x, u). The buffers are overwritten by the next evaluation,
+    so one kernel should not be shared across threads.
+    """
+
+    def __init__(
+        self,
+        func: CompiledFunction,
+        build_info: BuildInfo,
+        rows: np.ndarray,
+        cols: np.ndarray,
+        n_p: int,
+    ) -> None:
+        self._func = func
+        self._build_info = build_info
+        self._x, self._u = self._func.inputs
+        self._Fd, self._Gd_nz = self._func.outputs
+        self._rows = rows
+        self._cols = cols
+        self._Gd = np.zeros((len(self._x), n_p))
+        self._is_eval = False
+
+    @property
+    def build_info(self) -> BuildInfo:
+        return self._build_info
+
+    @property
+    def nonzero_rows(self) -> np.ndarray:
+        """
+        Rows of Gd that depend on the params.
+        """
+        return np.unique(self._rows)
+
+    @staticmethod
+    def get_func(
+        model: AffineQuadrotor,
+        dt: float,
+    ) -> Tuple[cs.Function, np.ndarray, np.ndarray]:
+        """
+        Fused function of Fd and the nonzeros of Gd,
+        along with their rows and columns.
+        """
+        nx = model.nx - model.np
+        rows, cols = np.nonzero([
+            [not model.G[i, j].is_zero() for j in range(model.np)]
+            for i in range(nx)
+        ])
+        Fd = model.x[:nx] + dt*model.F
+        Gd_nz = dt*cs.vertcat(*[model.G[i, j] for i, j in zip(rows, cols)])
+        func = cs.Function(
+            "discrete_dynamics", [model.x[:nx], model.u], [Fd, Gd_nz]
+        )
+        return func, rows, cols
+
+    def eval(
+        self,
+        x: np.ndarray,
+        u: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Fd and Gd at (x, u).
+        """
+        if not (self._is_eval and np.array_equal(self._x, x)
+                and np.array_equal(self._u, u)):
+            self._is_eval = True
+            self._x[:] = x
+            self._u[:] = u
+            self._func.call()
+            self._Gd[self._rows, self._cols] = self._Gd_nz
+        return self._Fd, self._Gd
+
+
+class BoundLP:
+    """
+    Persistent ProxQP instance for the bound LPs of set membership
+    estimation: the min or max of one parameter subject to
+    l <= C p <= u and the parameter box. All LPs of one step share
+    their constraints, so only the linear cost changes between solves,
+    and each solve starts from the previous primal-dual solution.
+    """
+
+    def __init__(
+        self,
+        n_p: int,
+        n_in: int,
+        tol: float,
+        max_iter: int,
+    ) -> None:
+        self._np = n_p
+        self._tol = tol
+        self._qp = proxqp.dense.QP(n_p, 0, n_in, True)
+        self._qp.settings.eps_abs = tol
+        self._qp.settings.max_iter = max_iter
+        self._qp.settings.verbose = False
+        # small residuals alone do not make an LP solution optimal
+        self._qp.settings.check_duality_gap = True
+        self._qp.settings.eps_duality_gap_abs = tol
+        self._qp.settings.eps_duality_gap_rel = 0.0
+        self._g = np.zeros(n_p)
+        self._scale = np.ones(n_p)
+        self._p_min = np.full(n_p, -np.inf)
+        self._p_max = np.full(n_p, np.inf)
+        self._is_init = False
+
+    def set_constraints(
+        self,
+        C: np.ndarray,
+        l: np.ndarray,
+        u: np.ndarray,
+        p_min: np.ndarray,
+        p_max: np.ndarray,
+    ) -> None:
+        self._p_min = p_min
+        self._p_max = p_max
+        # the params differ by orders of magnitude, so they are scaled
+        # by the box and the rows by their largest entry, which makes
+        # the absolute tolerance a relative one
+        self._scale = np.where(p_max > p_min, p_max - p_min, 1.0)
+        C = C * self._scale
+        row_scale = np.abs(C).max(axis=1)
+        row_scale[row_scale == 0] = 1.0
+        C = np.ascontiguousarray(C / row_scale[:, None], dtype=float)
+        l = l / row_scale
+        u = u / row_scale
+        self._box_min = p_min / self._scale
+        self._box_max = p_max / self._scale
+        if not self._is_init:
+            self._is_init = True
+            self._qp.init(
+                np.zeros((self._np, self._np)), self._g, None, None,
+                C, l, u, self._box_min, self._box_max
+            )
+        else:
+            self._qp.update(
+                None, None, None, None, C, l, u,
+                self._box_min, self._box_max, update_preconditioner=True
+            )
+
+    def solve(
+        self,
+        idx: int,
+        max: bool,
+    ) -> float:
+        """
+        Bound of parameter idx, relaxed by the solver tolerance,
+        or its box bound if the LP could not be solved.
+        """
+        self._g[:] = 0.0
+        self._g[idx] = -1.0 if max else 1.0
+        # the box has to be passed with every update of a boxed QP
+        self._qp.update(
+            None, self._g, None, None, None, None, None,
+            self._box_min, self._box_max, update_preconditioner=False
+        )
+        self._qp.solve()
+        # there is no previous result to start from before this, the
+        # proximal step sizes are reset as carrying them over stalls
+        self._qp.settings.initial_guess = \
+            proxqp.InitialGuess.COLD_START_WITH_PREVIOUS_RESULT
+        if self._qp.results.info.status != proxqp.QPSolverOutput.PROXQP_SOLVED:
+            return self._p_max[idx] if max else self._p_min[idx]
+        sol = self._qp.results.x[idx] + (self._tol if max else -self._tol)
+        return self._scale[idx] * sol
+
+
 class SetMembershipEstimator:
     def __init__(
         self,
@@ -26,12 +347,22 @@ class SetMembershipEstimator:
         time_step: float,
         qp_tol=10**-6,
         max_iter=10,
+        window=1,
+        cache=True,
     ) -> None:
+        """
+        window -> number of most recent transitions kept as half-spaces
+            of the parameter polytope, a window of 1 bounds the box
+            with the newest transition only
+        cache -> reuse the compiled dynamics across runs
+        """
+        if type(window) != int or window < 1:
+            raise ValueError(
+                "Please input the window as a positive integer!")
         self._nx = model.nx
         self._est = estimator
         model_aug = AffineQuadrotor(model)
-        self._Fd, self._Gd, self._Gd_T = \
-            self._get_discrete_dynamics(model_aug, self._nx, time_step)
+        self._dyn = get_discrete_dynamics(model_aug, time_step, cache)
 
         self._np = model_aug.np
         self._d_min = disturb_min
@@ -44,23 +375,65 @@ class SetMembershipEstimator:
         self._p_min = param_min
         self._p_max = param_max
         self._start = False
+        # the bound LPs split into independent blocks of params coupled
+        # by rows of Gd, blocks left with a single row are bounded
+        # in closed form
+        self._blocks, self._zero_rows = self._get_blocks(model_aug.G)
+        # half-spaces of the window per block, the rows of the oldest
+        # transition are overwritten by those of the newest one
+        self._W = window
+        self._k = 0
+        self._n_lps = 0
+        self._cons = [(
+            np.zeros((window*len(rows), len(cols))),
+            np.zeros(window*len(rows)),
+            np.zeros(window*len(rows)),
+            np.zeros(window*len(rows), dtype=bool),
+        ) for cols, rows in self._blocks]
+        # solvers per block, keyed by the number of rows
+        self._lps = [{} for b in self._blocks]
 
     @property
     def is_nonlinear(self) -> bool:
         return False
 
-    def _get_discrete_dynamics(
+    @property
+    def param_bounds(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self._p_min, self._p_max
+
+    @property
+    def num_lps(self) -> int:
+        """
+        Number of bound LPs solved so far.
+        """
+        return self._n_lps
+
+    def get_state(self) -> dict:
+        """
+        Copy of the estimator history, restored with set_state.
+        """
+        return {
+            "x": np.copy(self._x), "start": self._start,
+            "p_min": np.copy(self._p_min), "p_max": np.copy(self._p_max),
+            "k": self._k,
+            "cons": [tuple(np.copy(a) for a in c) for c in self._cons],
+            "est": self._est.get_state(),
+        }
+
+    def set_state(
         self,
-        model: AffineQuadrotor,
-        nx: int,
-        dt: float
-    ) -> Tuple[cs.Function, cs.Function, cs.Function]:
-        Fd = model.x[:nx] + dt*model.F
-        Gd = dt*model.G
-        Fd_func = cs.Function("Fd_func", [model.x[:nx], model.u], [Fd])
-        Gd_func = cs.Function("Gd_func", [model.x[:nx], model.u], [Gd])
-        Gd_T_func = cs.Function("Gd_T_func", [model.x[:nx], model.u], [Gd.T])
-        return Fd_func, Gd_func, Gd_T_func
+        state: dict,
+    ) -> None:
+        self._x = np.copy(state["x"])
+        self._start = state["start"]
+        self._k = state["k"]
+        for c, c_new in zip(self._cons, state["cons"]):
+            for a, a_new in zip(c, c_new):
+                a[:] = a_new
+        self._update_param_bds(
+            np.copy(state["p_min"]), np.copy(state["p_max"])
+        )
+        self._est.set_state(state["est"])
 
     def get_param(
         self,
@@ -77,6 +450,8 @@ class SetMembershipEstimator:
             param_min=p_min, param_max=p_max,
             timer=False
         )
+        if self._W > 1:
+            p = self._project(p, p_min, p_max)
         self._x = x
         if timer:
             et = time.perf_counter()
@@ -88,65 +463,201 @@ class SetMembershipEstimator:
         x: np.ndarray,
         u: np.ndarray
     ) -> Tuple[np.ndarray, np.ndarray]:
+        p_min = self._p_min
+        p_max = self._p_max
+        # there is no transition to bound the params with yet
         if self._start == False:
             self._start = True
-            self._x = x
+            return p_min, p_max
+        if (p_max - p_min < self._p_tol).all():
+            return p_min, p_max
 
-        p_min = self._p_min
-        p_max = self._p_max
-        if not (p_max - p_min < self._p_tol).all():
-            sol_min = np.zeros(self._np)
-            sol_max = np.zeros(self._np)
-
-            for i in range(self._np):
-                if p_max[i] - p_min[i] > self._p_tol[i]:
-                    sol_min[i] = self._solve_lp(
-                        idx=i, x=x, xprev=self._x,
-                        u=u, max=False
-                    )
-                    sol_max[i] = self._solve_lp(
-                        idx=i, x=x, xprev=self._x,
-                        u=u, max=True
-                    )
-                else:
-                    sol_min[i] = p_min[i]
-                    sol_max[i] = p_max[i]
+        # the dynamics are evaluated once for all bound LPs of the step
+        Fd, Gd = self._dyn.eval(self._x, u)
+        y_min = x - Fd - self._d_max
+        y_max = x - Fd - self._d_min
+        # zero rows have to agree with the disturbance bounds,
+        # otherwise every LP is infeasible and the bounds are kept
+        z = self._zero_rows
+        if (y_min[z] > self._sol_tol).any() \
+                or (y_max[z] < -self._sol_tol).any():
+            return p_min, p_max
+
+        # the newest half-spaces have to agree with the box,
+        # otherwise the transition is dropped
+        Cs = [Gd[np.ix_(rows, cols)] for cols, rows in self._blocks]
+        for (cols, rows), C in zip(self._blocks, Cs):
+            lo, hi = self._get_row_ranges(C, p_min[cols], p_max[cols])
+            if (lo > y_max[rows] + self._sol_tol).any() \
+                    or (hi < y_min[rows] - self._sol_tol).any():
+                return p_min, p_max
+
+        sol_min = np.copy(p_min)
+        sol_max = np.copy(p_max)
+        loose = p_max - p_min > self._p_tol
+        cons = {}
+        tasks = []
+        for b, ((cols, rows), C) in enumerate(zip(self._blocks, Cs)):
+            A, A_l, A_u, active = self._cons[b]
+            s = (self._k % self._W) * len(rows)
+            A[s : s+len(rows)] = C
+            A_l[s : s+len(rows)] = y_min[rows]
+            A_u[s : s+len(rows)] = y_max[rows]
+            active[s : s+len(rows)] = True
+            if not loose[cols].any():
+                continue
+            # the box only shrinks, so half-spaces it
+            # lies within can never tighten it again
+            lo, hi = self._get_row_ranges(A, p_min[cols], p_max[cols])
+            active &= (lo < A_l) | (hi > A_u)
+            idx = np.flatnonzero(active)
+            if len(idx) == 1:
+                bds = self._bound_row(
+                    a=A[idx[0]], l=A_l[idx[0]], u=A_u[idx[0]],
+                    p_min=p_min[cols], p_max=p_max[cols]
+                )
+                if bds is None:
+                    return p_min, p_max
+                sol_min[cols], sol_max[cols] = bds
+            elif len(idx) > 1:
+                cons[b] = (A[idx], A_l[idx], A_u[idx])
+                for j, i in enumerate(cols):
+                    if loose[i]:
+                        tasks += [(b, j, i, False), (b, j, i, True)]
+        self._k += 1
+        self._n_lps += len(tasks)
+
+        for (b, j, i, upper), bd in zip(
+            tasks, self._solve_lps(tasks, cons, p_min, p_max)
+        ):
+            if upper:
+                sol_max[i] = bd
+            else:
+                sol_min[i] = bd
 
-            p_min = np.maximum(sol_min, p_min)
-            p_max = np.minimum(sol_max, p_max)
+        p_min = np.maximum(sol_min, p_min)
+        p_max = np.minimum(sol_max, p_max)
         return p_min, p_max
 
-    def _solve_lp(
+    def _project(
         self,
-        idx: int,
-        x: np.ndarray,
-        xprev: np.ndarray,
-        u: np.ndarray,
-        max: bool
-    ) -> float:
-        P = np.zeros((self._np, self._np))
-        q = np.zeros(self._np)
-        if max: q[idx] = -1.0
-        else: q[idx] = 1.0
-
-        Fd = np.array(self._Fd(xprev, u)).flatten()
-        Gd = np.array(self._Gd(xprev, u))
-        G = np.block([[Gd], [-Gd]])
-        h = np.block([x-Fd-self._d_min, -x+Fd+self._d_max])
-
-        if max: p_init = self._p_max
-        else: p_init = self._p_min
-        p_bd = proxqp_solve_qp(
-            P=P, q=q, G=G, h=h,
-            lb=self._p_min, ub=self._p_max,
-            initvals=p_init, verbose=False, backend="dense",
-            eps_abs=self._sol_tol, max_iter=self._max_iter,
-        )
-        try:
-            return p_bd[idx]
-        except TypeError:
-            if max: return self._p_max[idx]
-            else: return self._p_min[idx]
+        p: np.ndarray,
+        p_min: np.ndarray,
+        p_max: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Project the estimate onto the polytope of the window,
+        block by block as they share no constraints.
+        """
+        p = np.copy(p)
+        for (cols, rows), (A, A_l, A_u, active) in zip(
+            self._blocks, self._cons
+        ):
+            p[cols] = project(
+                p[cols], p_min[cols], p_max[cols],
+                A[active], A_l[active], A_u[active]
+            )
+        return p
+
+    def _solve_lps(
+        self,
+        tasks: List[Tuple[int, int, int, bool]],
+        cons: dict,
+        p_min: np.ndarray,
+        p_max: np.ndarray,
+    ) -> List[float]:
+        """
+        Solve (block, local idx, idx, upper) bound LPs in order,
+        loading the constraints of each block once.
+        """
+        loaded = {}
+        bds = []
+        for b, j, i, upper in tasks:
+            if b not in loaded:
+                cols, rows = self._blocks[b]
+                C, l, u = cons[b]
+                lps = self._lps[b]
+                if len(l) not in lps:
+                    lps[len(l)] = BoundLP(
+                        n_p=len(cols), n_in=len(l),
+                        tol=self._sol_tol, max_iter=self._max_iter
+                    )
+                loaded[b] = lps[len(l)]
+                loaded[b].set_constraints(
+                    C=C, l=l, u=u, p_min=p_min[cols], p_max=p_max[cols]
+                )
+            bds.append(loaded[b].solve(idx=j, max=upper))
+        return bds
+
+    def _get_row_ranges(
+        self,
+        C: np.ndarray,
+        p_min: np.ndarray,
+        p_max: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Range of every row of C @ p over the box.
+        """
+        lo = np.minimum(C*p_min, C*p_max).sum(axis=1)
+        hi = np.maximum(C*p_min, C*p_max).sum(axis=1)
+        return lo, hi
+
+    def _bound_row(
+        self,
+        a: np.ndarray,
+        l: float,
+        u: float,
+        p_min: np.ndarray,
+        p_max: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact bounds of every param subject to l <= a @ p <= u
+        and the box, or None if this is infeasible.
+        """
+        lo = np.minimum(a*p_min, a*p_max)
+        hi = np.maximum(a*p_min, a*p_max)
+        if lo.sum() > u + self._sol_tol or hi.sum() < l - self._sol_tol:
+            return None
+        # range of a_i p_i left by the other terms of the row
+        ap_min = l - (hi.sum() - hi)
+        ap_max = u - (lo.sum() - lo)
+        pos = a > 0
+        neg = a < 0
+        p_lo = np.copy(p_min)
+        p_hi = np.copy(p_max)
+        p_lo[pos] = ap_min[pos] / a[pos]
+        p_hi[pos] = ap_max[pos] / a[pos]
+        p_lo[neg] = ap_max[neg] / a[neg]
+        p_hi[neg] = ap_min[neg] / a[neg]
+        return np.maximum(p_lo, p_min), np.minimum(p_hi, p_max)
+
+    def _get_blocks(
+        self,
+        G: cs.SX,
+    ) -> Tuple[list, np.ndarray]:
+        """
+        Params coupled through the structurally nonzero rows of G,
+        as (cols, rows) index pairs, along with the zero rows.
+        """
+        nz = np.array([
+            [not G[i, j].is_zero() for j in range(G.shape[1])]
+            for i in range(G.shape[0])
+        ])
+        # merge the blocks of single params that share a row
+        blocks = []
+        for j in range(G.shape[1]):
+            cols, rows = {j}, set(np.flatnonzero(nz[:, j]))
+            for block in [b for b in blocks if b[1] & rows]:
+                blocks.remove(block)
+                cols |= block[0]
+                rows |= block[1]
+            blocks.append((cols, rows))
+        blocks = [
+            (np.array(sorted(cols)), np.array(sorted(rows)))
+            for cols, rows in blocks if len(rows)
+        ]
+        zero_rows = np.flatnonzero(~nz.any(axis=1))
+        return blocks, zero_rows
 
     def _update_param_bds(
         self,
@@ -163,36 +674,39 @@ class LMS():
         model: Quadrotor,
         update_gain: float,
         time_step: float,
-        qp_tol=10**-6,
-        max_iter=10,
+        cache=True,
     ) -> None:
+        """
+        cache -> reuse the compiled dynamics across runs
+        """
         self._nx = model.nx
         model_aug = AffineQuadrotor(model)
-        self._Fd, self._Gd, self._Gd_T = \
-            self._get_discrete_dynamics(model_aug, self._nx, time_step)
+        self._dyn = get_discrete_dynamics(model_aug, time_step, cache)
 
         self._np = model_aug.np
         self._mu = update_gain
-        self._sol_tol = qp_tol
-        self._max_iter = max_iter
         self._x = np.zeros(self._nx)
 
     @property
     def is_nonlinear(self) -> bool:
         return False
 
-    def _get_discrete_dynamics(
+    @property
+    def param_bounds(self) -> Tuple[np.ndarray, np.ndarray]:
+        # bounds are only given per update
+        return np.full(self._np, -np.inf), np.full(self._np, np.inf)
+
+    def get_state(self) -> dict:
+        """
+        Copy of the estimator history, restored with set_state.
+        """
+        return {"x": np.copy(self._x)}
+
+    def set_state(
         self,
-        model: AffineQuadrotor,
-        nx: int,
-        dt: float
-    ) -> Tuple[cs.Function, cs.Function, cs.Function]:
-        Fd = model.x[:nx] + dt*model.F
-        Gd = dt*model.G
-        Fd_func = cs.Function("Fd_func", [model.x[:nx], model.u], [Fd])
-        Gd_func = cs.Function("Gd_func", [model.x[:nx], model.u], [Gd])
-        Gd_T_func = cs.Function("Gd_T_func", [model.x[:nx], model.u], [Gd.T])
-        return Fd_func, Gd_func, Gd_T_func
+        state: dict,
+    ) -> None:
+        self._x = np.copy(state["x"])
 
     def get_param(
         self,
@@ -204,12 +718,10 @@ class LMS():
         timer=True
     ) -> np.ndarray:
         if timer: st = time.perf_counter()
-        x_err = x - self._Fd(self._x, u) - self._Gd(self._x, u)@param
-        p_lms = param + self._mu*self._Gd_T(self._x, u)@x_err
-        p_lms = np.array(p_lms).flatten()
-        p_proj = self._solve_proj(
-            p=p_lms, p_min=param_min, p_max=param_max
-        )
+        Fd, Gd = self._dyn.eval(self._x, u)
+        x_err = x - Fd - Gd@param
+        p_lms = param + self._mu*Gd.T@x_err
+        p_proj = project_box(p_lms, param_min, param_max)
         self._x = x
         print(f"params: {p_proj}\n")
         if timer:
@@ -217,26 +729,160 @@ class LMS():
             print(f"LMS runtime: {et - st}")
         return p_proj
 
-    def _solve_proj(
+
+class RLS():
+    def __init__(
         self,
-        p: np.ndarray,
-        p_min: np.ndarray,
-        p_max: np.ndarray
+        model: Quadrotor,
+        param_cov: np.ndarray,
+        noise_var: np.ndarray,
+        time_step: float,
+        forget_factor=1.0,
+        cache=True,
+    ) -> None:
+        """
+        param_cov -> initial param covariance, as variances or a matrix,
+            which also bounds the covariance against windup
+        noise_var -> variance of the disturbance on each state
+        forget_factor -> discount of past measurements per step in (0, 1]
+        cache -> reuse the compiled dynamics across runs
+        """
+        self._nx = model.nx
+        model_aug = AffineQuadrotor(model)
+        self._dyn = get_discrete_dynamics(model_aug, time_step, cache)
+        self._np = model_aug.np
+        self._assert(param_cov, noise_var, forget_factor)
+
+        if np.ndim(param_cov) == 1:
+            param_cov = np.diag(param_cov)
+        self._P0 = np.array(param_cov, dtype=float)
+        self._P = np.copy(self._P0)
+        self._P_diag_max = np.diag(self._P0)
+        self._rows = self._dyn.nonzero_rows
+        self._r = np.asarray(noise_var, dtype=float)[self._rows]
+        self._lam = forget_factor
+        self._x = np.zeros(self._nx)
+        self._start = False
+
+    @property
+    def is_nonlinear(self) -> bool:
+        return False
+
+    @property
+    def param_bounds(self) -> Tuple[np.ndarray, np.ndarray]:
+        # bounds are only given per update
+        return np.full(self._np, -np.inf), np.full(self._np, np.inf)
+
+    @property
+    def param_cov(self) -> np.ndarray:
+        return self._P
+
+    def get_state(self) -> dict:
+        """
+        Copy of the estimator history, restored with set_state.
+        """
+        return {
+            "x": np.copy(self._x), "start": self._start,
+            "P": np.copy(self._P),
+        }
+
+    def set_state(
+        self,
+        state: dict,
+    ) -> None:
+        self._x = np.copy(state["x"])
+        self._start = state["start"]
+        self._P[:] = state["P"]
+
+    def reset(self) -> None:
+        self._P[:] = self._P0
+        self._start = False
+
+    def get_param(
+        self,
+        x: np.ndarray,
+        u: np.ndarray,
+        param: np.ndarray,
+        param_min=np.array([]),
+        param_max=np.array([]),
+        timer=True
     ) -> np.ndarray:
-        P = np.eye(self._np)
-        q = np.zeros(self._np)
-        lb = p_min - p
-        ub = p_max - p
-        p_err = proxqp_solve_qp(
-            P=P, q=q, lb=lb, ub=ub,
-            verbose=False, backend="dense",
-            eps_abs=self._sol_tol, max_iter=self._max_iter,
-        )
-        try:
-            p_proj = p_err + p
-            return p_proj
-        except TypeError:
-            return p
+        if timer: st = time.perf_counter()
+        p = np.array(param, dtype=float)
+        self.update(x, u, p)
+        if len(param_max):
+            p = project_box(p, param_min, param_max)
+        print(f"params: {p}\n")
+        if timer:
+            et = time.perf_counter()
+            print(f"RLS runtime: {et - st}")
+        return p
+
+    def update(
+        self,
+        x: np.ndarray,
+        u: np.ndarray,
+        param: np.ndarray,
+    ) -> None:
+        """
+        Update param and its covariance in place with the transition
+        to x, the first call only records x.
+        """
+        if self._start:
+            self._update(x, u, param)
+        self._start = True
+        self._x = x
+
+    def _update(
+        self,
+        x: np.ndarray,
+        u: np.ndarray,
+        p: np.ndarray,
+    ) -> None:
+        """
+        Kalman update of p and its covariance in place, as one
+        rank-k Sherman-Morrison-Woodbury update over the k rows
+        of the transition that depend on the params.
+        """
+        Fd, Gd = self._dyn.eval(self._x, u)
+        P = self._P
+        Phi = Gd[self._rows]
+        P_Phi = P @ Phi.T
+        S = Phi @ P_Phi
+        S[np.diag_indices_from(S)] += self._r
+        K = np.linalg.solve(S, P_Phi.T).T
+        p += K @ (x[self._rows] - Fd[self._rows] - Phi @ p)
+        P -= K @ P_Phi.T
+        # forgetting inflates the covariance, and each param whose
+        # variance grows past its initial one is scaled back in its
+        # row and column, so unexcited params cannot wind up while
+        # the excited ones keep forgetting
+        P /= self._lam
+        s = np.sqrt(np.minimum(self._P_diag_max / np.diag(P), 1.0))
+        P *= s[:, None]
+        P *= s
+        P += P.T
+        P *= 0.5
+
+    def _assert(
+        self,
+        param_cov: np.ndarray,
+        noise_var: np.ndarray,
+        forget_factor: float,
+    ) -> None:
+        if np.ndim(param_cov) == 1:
+            if len(param_cov) != self._np or (param_cov <= 0).any():
+                raise ValueError(
+                    "Please input the param variances as a positive vector!")
+        elif np.shape(param_cov) != (self._np, self._np):
+            raise ValueError(
+                "Please input the param covariance as a square matrix!")
+        if len(noise_var) != self._nx or (noise_var <= 0).any():
+            raise ValueError(
+                "Please input the noise variances as a positive vector!")
+        if not 0 < forget_factor <= 1:
+            raise ValueError(
+                "The forgetting factor should be in (0, 1]!")
 
 
 class MHE():
@@ -256,10 +902,18 @@ class MHE():
         nlp_max_iter=10,
         qp_max_iter=10,
         nonlinear=False,
+        cache=True,
+        name=None,
+        stats_size=0,
+        arrival_cov=None,
     ) -> None:
         """
         Q -> weight for params
         R -> weight for disturb
+        name -> build namespace, unique by default
+        stats_size -> number of recent solve statistics kept
+        arrival_cov -> initial param covariance of the arrival cost,
+            as variances or a matrix, no arrival cost by default
         """
         self._nx = model.nx
         self._nu = model.nu
@@ -269,6 +923,7 @@ class MHE():
         self._d_max = disturb_max
         self._d_avg = (disturb_min + disturb_max) / 2
         self._nl = nonlinear
+        self._name = name if name else get_namespace("mhe")
 
         if nonlinear:
             model_aug = ParameterizedQuadrotor(model)
@@ -281,24 +936,88 @@ class MHE():
         self._p_max = param_max
 
         Q_aug = self._augment_costs(Q)
-        self._solver = self._init_solver(
+        self._prior = self._init_prior(
+            model=model, R=R, arrival_cov=arrival_cov, cache=cache
+        )
+        self._Q = Q
+        self._W_0 = block_diag(Q_aug, R)
+        self._p_arr = np.zeros(self._np)
+        self._solver, self._build_info = self._init_solver(
             model=model_aug, Q=Q_aug, R=R,
             p_min=param_min, p_max=param_max,
             d_min=disturb_min, d_max=disturb_max, rti=rti,
             nlp_tol=nlp_tol, nlp_max_iter=nlp_max_iter,
-            qp_max_iter=qp_max_iter
+            qp_max_iter=qp_max_iter, cache=cache
         )
-        atexit.register(self._clear_files)
+        # one solve at a time per instance, solves release the GIL
+        self._lock = threading.Lock()
+        self._stats = SolverStats(stats_size) if stats_size else None
 
+        # measurement history in ring buffers of N rows,
+        # the oldest row is at self._head and is overwritten next
         self._x = np.zeros((self._N, self._nx))
-        self._u = np.zeros((self._N-1, self._nu))
-        self._d = np.zeros((self._N-1, self._nx))
-        
+        self._u = np.zeros((self._N, self._nu))
+        self._d = np.zeros((self._N, self._nx))
+        self._head = 0
+        self._n_meas = 0
+        # stage order of the N-1 newest rows for every head position
+        self._ring_idx = (
+            np.arange(self._N)[:, None] + 1 + np.arange(self._N - 1)
+        ) % self._N
+        self._init_stage_buffers()
+
 
     @property
     def is_nonlinear(self) -> bool:
         return self._nl
 
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def build_info(self) -> BuildInfo:
+        return self._build_info
+
+    @property
+    def stats(self) -> SolverStats:
+        return self._stats
+
+    @property
+    def param_bounds(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self._p_min, self._p_max
+
+    def get_state(self) -> dict:
+        """
+        Copy of the measurement and disturbance history,
+        restored with set_state.
+        """
+        with self._lock:
+            idx = self._ring_idx[self._head]
+            state = {
+                "x": self._x[np.append(self._head, idx)],
+                "u": self._u[idx], "d": self._d[idx],
+                "n_meas": self._n_meas,
+            }
+            if self._prior is not None:
+                state["prior"] = self._prior.get_state()
+                state["p_arr"] = np.copy(self._p_arr)
+            return state
+
+    def set_state(
+        self,
+        state: dict,
+    ) -> None:
+        with self._lock:
+            self._head = 0
+            self._x[:] = state["x"]
+            self._u[1:] = state["u"]
+            self._d[1:] = state["d"]
+            self._n_meas = state["n_meas"]
+            if self._prior is not None:
+                self._prior.set_state(state["prior"])
+                self._p_arr[:] = state["p_arr"]
+
     def get_param(
         self,
         x: np.ndarray,
@@ -308,13 +1027,14 @@ class MHE():
         param_max=np.array([]),
         timer=True
     ) -> np.ndarray:
-        self._solve(
-            x=x, u=u, p=param, p_min=param_min,
-            p_max=param_max, timer=timer
-        )
-        p = np.array(
-            self._solver.get(1,"x")[self._nx : self._nx+self._np]
-        )
+        with self._lock:
+            self._solve(
+                x=x, u=u, p=param, p_min=param_min,
+                p_max=param_max, timer=timer
+            )
+            p = np.array(
+                self._solver.get(1,"x")[self._nx : self._nx+self._np]
+            )
         print(f"params: {p}\n")
         return p
 
@@ -331,73 +1051,212 @@ class MHE():
         assert x.shape[0] == self._nx
         assert u.shape[0] == self._nu
         assert p.shape[0] == self._np
-        
+
+        if self._prior is not None:
+            self._update_prior(p=p, p_min=p_min, p_max=p_max)
         # set history of x, u, and d at each stage
-        for k in range(self._N - 1):
-            self._set_stage(
-                k=k, x=self._x[k+1], u=self._u[k], d=self._d[k],
-                p=p, p_min=p_min, p_max=p_max
-            )
-        # set new measurements
-        self._set_stage(
-            k=self._N, x=x, u=u,
-            p=p, p_min=p_min, p_max=p_max
+        # and the new measurements at the last stage
+        self._set_stages(
+            x=x, u=u, p=p, p_min=p_min, p_max=p_max
         )
-        self._solver.solve()
+        status = self._solver.solve()
+        if self._stats is not None:
+            self._stats.record(self._solver, status)
 
         # get the latest disturbance estimate
         # propagate the horizon by 1 step
-        d = np.array(self._solver.get(self._N-1, "u"))
+        d = self._solver.get(self._N-1, "u")
         self._update_horizon(x=x, u=u, d=d)
 
         if timer:
             et = time.perf_counter()
             print(f"mhe runtime: {et - st}")
 
-    def _set_stage(
+    def _set_stages(
         self,
-        k: int,
         x: np.ndarray,
         u: np.ndarray,
         p: np.ndarray,
         p_min: np.ndarray,
         p_max: np.ndarray,
-        d=np.array([]),
-    ):
-        x_aug = np.concatenate((x, p))
-        self._solver.set(k, "x", x_aug)
-        self._solver.set(k, "p", u)
+    ) -> None:
+        """
+        Stages 0 to N-2 hold the N-1 newest rows of the history
+        and stage N holds the new measurements,
+        stage N-1 is left as is.
+        """
+        N = self._N
+        nx = self._nx
+        idx = self._ring_idx[self._head]
+        hist = self._hist
+        np.take(self._x, idx, axis=0, out=hist[:N-1, :nx])
+        hist[N-1, :nx] = x
+        np.take(self._u, idx, axis=0, out=self._p_buf[:N-1])
+        self._p_buf[N] = u
+
+        # initial guess, only the last stage's is not overwritten
+        xs = self._solver.get_flat("x").reshape(N+1, self._nb)
+        xs[:N-1, :nx] = hist[:N-1, :nx]
+        xs[N, :nx] = x
+        xs[:N-1, nx:] = p
+        xs[N, nx:] = p
+        self._solver.set_flat("x", xs.ravel())
+        us = self._solver.get_flat("u").reshape(N, nx)
+        np.take(self._d, idx, axis=0, out=us[:N-1])
+        self._solver.set_flat("u", us.ravel())
+        self._solver.set_flat("p", self._p_buf.ravel())
+
+        self._yref[:N-1, :nx] = hist[:N-1, :nx]
+        self._yref[:N-1, nx:self._nb] = p
+        self._yref[:N-1, self._nb:] = us[:N-1]
+        if self._prior is not None:
+            self._set_arrival_cost(p)
+        self._set_yref(self._yref)
 
-        if k != self._N:
-            yref = np.concatenate((x_aug, d))
-            self._solver.set(k, "yref", yref)
-            self._solver.set(k, "u", d)
+        # the measured states are pinned by equal bounds
+        self._set_param_bounds(p_min, p_max)
+        self._lbx[:, :nx] = hist
+        self._ubx[:, :nx] = hist
+        for i, k in enumerate(self._bnd_stages):
+            self._solver.set(k, "lbx", self._lbx[i])
+            self._solver.set(k, "ubx", self._ubx[i])
 
+    def _set_param_bounds(
+        self,
+        p_min: np.ndarray,
+        p_max: np.ndarray,
+    ) -> None:
+        """
+        Only write the param part of the stage bounds
+        when it differs from the cached one.
+        """
+        nx = self._nx
         if len(p_min) == 0:
             p_min = self._p_min
-        lbx_aug = np.concatenate((x, p_min))
-        self._solver.set(k, "lbx", lbx_aug)
-
         if len(p_max) == 0:
             p_max = self._p_max
-        ubx_aug = np.concatenate((x, p_max))
-        self._solver.set(k, "ubx", ubx_aug)
+        if not np.array_equal(self._lbx[0, nx:], p_min):
+            self._lbx[:, nx:] = p_min
+        if not np.array_equal(self._ubx[0, nx:], p_max):
+            self._ubx[:, nx:] = p_max
 
     def _update_horizon(
         self,
         x: np.ndarray,
         u: np.ndarray,
         d: np.ndarray
-    ):
-        self._x = np.block([
-            [self._x[1:self._N, :]], [x]
-        ])
-        self._u = np.block([
-            [self._u[1:self._N, :]], [u]
-        ])
-        self._d = np.block([
-            [self._d[1:self._N, :]], [d]
-        ])    
+    ) -> None:
+        """
+        Overwrite the oldest row of the ring buffers.
+        """
+        self._x[self._head] = x
+        self._u[self._head] = u
+        self._d[self._head] = d
+        self._head = (self._head + 1) % self._N
+        self._n_meas += 1
+
+    def _update_prior(
+        self,
+        p: np.ndarray,
+        p_min: np.ndarray,
+        p_max: np.ndarray,
+    ) -> None:
+        """
+        Kalman update of the arrival cost with the transition into
+        the first stage, the newest one that is no longer in the
+        horizon. The prior starts at the first param guess.
+        """
+        if not self._n_meas:
+            self._p_arr[:] = p
+        if self._n_meas < self._N - 1:
+            return
+        i = self._ring_idx[self._head][0]
+        self._prior.update(np.copy(self._x[i]), self._u[i], self._p_arr)
+        if len(p_min) == 0:
+            p_min = self._p_min
+        if len(p_max) == 0:
+            p_max = self._p_max
+        self._p_arr[:] = project_box(self._p_arr, p_min, p_max)
+
+    def _set_arrival_cost(
+        self,
+        p: np.ndarray,
+    ) -> None:
+        """
+        Merge the arrival cost into the param cost of the first stage,
+        so the cost dimensions stay the same:
+        |p - p_ref|_Q + |p - p_arr|_W = |p - p_0|_(Q + W) + const
+        acados weights the stage by dt, so W = P^-1 / dt.
+        """
+        nx = self._nx
+        nb = self._nb
+        P_inv = np.linalg.inv(self._prior.param_cov) / self._dt
+        W_p = self._Q + P_inv
+        self._W_0[nx:nb, nx:nb] = W_p
+        self._yref[0, nx:nb] = np.linalg.solve(
+            W_p, self._Q @ p + P_inv @ self._p_arr
+        )
+        self._solver.cost_set(0, "W", self._W_0)
+
+    def _init_prior(
+        self,
+        model: Quadrotor,
+        R: np.ndarray,
+        arrival_cov,
+        cache: bool,
+    ) -> RLS:
+        """
+        Every stage cost is weighted by dt, so the disturbance d of a
+        stage has the variance (dt R)^-1. d enters the state derivative,
+        so each step adds dt^2 (dt R)^-1 = dt R^-1 to the state variance.
+        """
+        if arrival_cov is None:
+            return None
+        if self._nl:
+            raise ValueError(
+                "The arrival cost needs the parameter-affine model!")
+        if (np.diag(R) <= 0).any():
+            raise ValueError(
+                "The arrival cost needs positive disturbance weights!")
+        return RLS(
+            model=model, param_cov=arrival_cov,
+            noise_var=self._dt / np.diag(R),
+            time_step=self._dt, cache=cache
+        )
+
+    def _init_stage_buffers(self) -> None:
+        """
+        Persistent per-stage arrays that are pushed to acados in bulk.
+        Rows of the p and yref buffers that are never written keep
+        the solver's initial values.
+        """
+        N = self._N
+        self._nb = self._nx + self._np
+        # measured states of stages 0 to N-2 and of stage N
+        self._hist = np.zeros((N, self._nx))
+        self._p_buf = np.zeros((N+1, self._nu))
+        self._yref = np.zeros((N, self._nb + self._nx))
+        self._set_yref = self._get_yref_setter()
+        self._bnd_stages = list(range(N-1)) + [N]
+        self._lbx = np.zeros((N, self._nb))
+        self._ubx = np.zeros((N, self._nb))
+        self._lbx[:, self._nx:] = self._p_min
+        self._ubx[:, self._nx:] = self._p_max
+
+    def _get_yref_setter(self):
+        """
+        Push the (N, ny) reference to acados in one call when the
+        installed acados_template has a slice setter, otherwise fall back
+        to per-stage sets of the stages that hold history.
+        """
+        if hasattr(self._solver, "cost_set_slice"):
+            def set_yref(yref: np.ndarray) -> None:
+                self._solver.cost_set_slice(0, self._N, "yref", yref)
+        else:
+            def set_yref(yref: np.ndarray) -> None:
+                for k in range(self._N - 1):
+                    self._solver.cost_set(k, "yref", yref[k])
+        return set_yref
 
     def _init_solver(
         self,
@@ -411,8 +1270,9 @@ class MHE():
         rti: bool,
         nlp_tol: float,
         nlp_max_iter: int,
-        qp_max_iter: int
-    ) -> AcadosOcpSolver:
+        qp_max_iter: int,
+        cache: bool,
+    ) -> Tuple[AcadosOcpSolver, BuildInfo]:
         ny = model.nx + model.nu  # combine x and u into y
 
         ocp = AcadosOcp()
@@ -485,17 +1345,21 @@ class MHE():
         ocp.solver_options.integrator_type = "ERK"
         ocp.solver_options.print_level = 0
 
-        ocp.code_export_directory = "mhe_c_code"
-        name = "acados_mhe.json"
+        # acados weights each path stage by dt and the terminal stage
+        # by 1, pinned here where the option exists
+        if hasattr(ocp.solver_options, "cost_scaling"):
+            ocp.solver_options.cost_scaling = np.append(
+                self._dt * np.ones(self._N), 1
+            )
 
         if rti:
             ocp.solver_options.nlp_solver_type = "SQP_RTI"
-            solver = AcadosOcpSolver(ocp, json_file=name)
+            solver, info = get_ocp_solver(ocp, self._name, cache)
             solver.options_set("rti_phase", 0)
         else:
             ocp.solver_options.nlp_solver_type = "SQP"
-            solver = AcadosOcpSolver(ocp, json_file=name)
-        return solver
+            solver, info = get_ocp_solver(ocp, self._name, cache)
+        return solver, info
 
     def _augment_costs(
         self,
@@ -505,16 +1369,3 @@ class MHE():
             (10**10)*np.eye(self._nx), Q
         )
         return Q_aug
-
-    def _clear_files(self) -> None:
-        """
-        Clean up the acados generated files.
-        """
-        try:
-            shutil.rmtree("mhe_c_code")
-        except:
-            print("failed to delete mhe_c_code")
-        try:
-            os.remove("acados_mhe.json")
-        except:
-            print("failed to delete acados_mhe.json")
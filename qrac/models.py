@@ -190,6 +190,17 @@ class ParameterizedQuadrotor(Quadrotor):
         self.u = d
         self.xdot[:self.nu] += d
 
+    def set_runtime_parameters(self) -> None:
+        """
+        Move the constant parameters out of the augmented state
+        and into the acados runtime parameters.
+        """
+        nx = self.nx - self.np
+        self.p = self.x[nx:]
+        self.x = self.x[:nx]
+        self.xdot = self.xdot[:nx]
+        self.nx, self.nu = self.get_dims()
+
     def _get_param_dynamics(self) -> None:
         param = cs.SX.sym("param", self.np)
         x_aug = cs.SX(cs.vertcat(
@@ -235,6 +246,17 @@ class AffineQuadrotor(Quadrotor):
         self.u = d
         self.xdot[:self.nu] += d
 
+    def set_runtime_parameters(self) -> None:
+        """
+        Move the constant parameters out of the augmented state
+        and into the acados runtime parameters.
+        """
+        nx = self.nx - self.np
+        self.p = self.x[nx:]
+        self.x = self.x[:nx]
+        self.xdot = self.xdot[:nx]
+        self.nx, self.nu = self.get_dims()
+
     def _get_param_affine_dynamics(self) -> None:
         param = cs.SX.sym("param", self.np)
         x_aug = cs.SX(cs.vertcat(
@@ -0,0 +1,451 @@
+#!/usr/bin/python3
+
+from multiprocessing import shared_memory, resource_tracker
+import multiprocessing as mp
+import numpy as np
+import atexit
+import time
+import os
+from typing import NamedTuple, Tuple
+
+
+class _SharedMemory:
+    """
+    Shared memory segment that is unlinked by the creating process
+    and re-attached by name when pickled into a child process.
+    """
+
+    def __init__(
+        self,
+        nbytes: int,
+    ) -> None:
+        self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self._owner = True
+        self._attach()
+        atexit.register(self.unlink)
+
+    def __getstate__(self) -> dict:
+        state = self._get_dims()
+        state.update({"name": self._shm.name, "pid": os.getpid()})
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self._set_dims(state)
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        if state["pid"] != os.getpid():
+            # only the creating process may unlink the segment
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        self._owner = False
+        self._attach()
+
+    def unlink(self) -> None:
+        if self._owner:
+            self._owner = False
+            self._shm.close()
+            self._shm.unlink()
+
+    def _get_dims(self) -> dict:
+        raise NotImplementedError
+
+    def _set_dims(self, state: dict) -> None:
+        raise NotImplementedError
+
+    def _attach(self) -> None:
+        raise NotImplementedError
+
+
+class SharedDoubleBuffer(_SharedMemory):
+    """
+    Lock-free float64 vector in shared memory for one writer process
+    and any number of reader processes. The writer fills the inactive
+    of two slots and then bumps a version counter, so a reader never
+    sees a half-written vector: it retries only if a new vector was
+    published while it was copying.
+    """
+
+    def __init__(
+        self,
+        init: np.ndarray,
+    ) -> None:
+        init = np.asarray(init, dtype=np.float64).flatten()
+        self._n = init.shape[0]
+        super().__init__(8 * (1 + 2*self._n))
+        self._version[0] = 0
+        self._slots[:] = init
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def version(self) -> int:
+        return int(self._version[0])
+
+    def publish(
+        self,
+        val: np.ndarray,
+    ) -> None:
+        v = self._version[0]
+        self._slots[(v + 1) % 2] = val
+        self._version[0] = v + 1
+
+    def read(
+        self,
+        out=None,
+    ) -> np.ndarray:
+        if out is None:
+            out = np.empty(self._n)
+        while True:
+            v = self._version[0]
+            out[:] = self._slots[v % 2]
+            if self._version[0] == v:
+                return out
+
+    def _get_dims(self) -> dict:
+        return {"n": self._n}
+
+    def _set_dims(self, state: dict) -> None:
+        self._n = state["n"]
+
+    def _attach(self) -> None:
+        self._version = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        self._slots = np.ndarray(
+            (2, self._n), dtype=np.float64, buffer=self._shm.buf, offset=8
+        )
+
+
+class SharedRingBuffer(_SharedMemory):
+    """
+    Lock-free ring of float64 rows in shared memory for one writer
+    process and one reader process. The reader keeps its own cursor,
+    so every row pushed since its last read is returned, unless the
+    writer has lapped the reader, in which case the overwritten rows
+    are reported as dropped. The ring has one slot more than size,
+    the one the next push may be writing into while it is read.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        size: int,
+    ) -> None:
+        if type(size) != int or size < 1:
+            raise ValueError(
+                "Please input the ring buffer size as a positive integer!")
+        self._w = width
+        self._size = size + 1
+        super().__init__(8 * (1 + self._size*width))
+        self._count[0] = 0
+        self._rows[:] = 0.0
+
+    def __len__(self) -> int:
+        return self._size - 1
+
+    @property
+    def count(self) -> int:
+        """
+        Total number of rows pushed so far.
+        """
+        return int(self._count[0])
+
+    def push(
+        self,
+        row: np.ndarray,
+    ) -> None:
+        c = self._count[0]
+        self._rows[c % self._size] = row
+        self._count[0] = c + 1
+
+    def read(
+        self,
+        start: int,
+    ) -> Tuple[np.ndarray, int, int]:
+        """
+        Rows pushed since cursor start, oldest first, along with
+        the next cursor and the number of rows that were lost.
+        """
+        end = self.count
+        first = max(start, end - self._size + 1)
+        idx = np.arange(first, end) % self._size
+        rows = self._rows[idx]
+        # rows overwritten while they were being copied are lost as well,
+        # including the one in the slot a push is still writing into
+        first_valid = min(end, max(first, self.count - self._size + 1))
+        rows = rows[first_valid - first:]
+        return rows, end, first_valid - start
+
+    def _get_dims(self) -> dict:
+        return {"w": self._w, "size": self._size}
+
+    def _set_dims(self, state: dict) -> None:
+        self._w = state["w"]
+        self._size = state["size"]
+
+    def _attach(self) -> None:
+        self._count = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        self._rows = np.ndarray(
+            (self._size, self._w), dtype=np.float64,
+            buffer=self._shm.buf, offset=8
+        )
+
+
+class SchedulerStats(NamedTuple):
+    ticks: int
+    overruns: int
+    max_overrun: float
+    mean_jitter: float
+    max_jitter: float
+
+
+class PeriodicScheduler:
+    """
+    Runs a loop at a fixed period by sleeping until each deadline,
+    spinning only for the last spin_time seconds to cut wake-up jitter.
+    A tick that finishes after the next deadline counts as an overrun,
+    and the missed deadlines are dropped instead of run back to back.
+    """
+
+    def __init__(
+        self,
+        period: float,
+        spin_time=10**-4,
+    ) -> None:
+        if period <= 0:
+            raise ValueError("The scheduler period should be positive!")
+        self._T = period
+        self._spin = spin_time
+        self._next = None
+        self._ticks = 0
+        self._overruns = 0
+        self._max_overrun = 0.0
+        self._jitter_sum = 0.0
+        self._max_jitter = 0.0
+
+    @property
+    def period(self) -> float:
+        return self._T
+
+    def wait(
+        self,
+        stop_event=None,
+    ) -> bool:
+        """
+        Block until the next deadline. Returns False
+        as soon as the stop event is set.
+        """
+        now = time.perf_counter()
+        if self._next is None:
+            self._next = now
+        late = now - self._next
+        if late > 0 and self._ticks:
+            self._overruns += 1
+            self._max_overrun = max(self._max_overrun, late)
+            self._next += self._T * np.floor(late / self._T)
+        elif late < 0:
+            sleep_time = -late - self._spin
+            if sleep_time > 0:
+                if stop_event is None:
+                    time.sleep(sleep_time)
+                elif stop_event.wait(sleep_time):
+                    return False
+            while time.perf_counter() < self._next:
+                pass
+            jitter = time.perf_counter() - self._next
+            self._jitter_sum += jitter
+            self._max_jitter = max(self._max_jitter, jitter)
+
+        self._ticks += 1
+        self._next += self._T
+        return stop_event is None or not stop_event.is_set()
+
+    def get_stats(self) -> SchedulerStats:
+        return SchedulerStats(
+            ticks=self._ticks,
+            overruns=self._overruns,
+            max_overrun=self._max_overrun,
+            mean_jitter=self._jitter_sum / max(self._ticks, 1),
+            max_jitter=self._max_jitter,
+        )
+
+
+class EstimatorStats(NamedTuple):
+    ticks: int
+    overruns: int
+    max_overrun: float
+    mean_jitter: float
+    max_jitter: float
+    samples: int
+    dropped: int
+    mean_update: float
+    max_update: float
+    max_latency: float
+
+
+class EstimatorWorker:
+    """
+    Owns a parameter estimator in a separate process. Measurements are
+    streamed in as (timestamp, x, u) rows of a shared ring buffer and are
+    all fed to the estimator in order at every tick, while the parameters,
+    their bounds and the timing statistics are published back through
+    double buffers. The estimator state is sent back to the parent
+    on request and when the worker is stopped.
+    """
+
+    def __init__(
+        self,
+        estimator,
+        nx: int,
+        nu: int,
+        param_init: np.ndarray,
+        period: float,
+        buffer_size=64,
+    ) -> None:
+        self._est = estimator
+        self._nx = nx
+        self._nu = nu
+        self._T = period
+
+        p_min, p_max = estimator.param_bounds
+        self._samples = SharedRingBuffer(1 + nx + nu, buffer_size)
+        self._p = SharedDoubleBuffer(param_init)
+        self._bds = SharedDoubleBuffer(np.concatenate((p_min, p_max)))
+        self._stats = SharedDoubleBuffer(
+            np.zeros(len(EstimatorStats._fields))
+        )
+        self._row = np.zeros(1 + nx + nu)
+        self._timer = mp.Value("b", False)
+        self._stop_event = mp.Event()
+        self._conn, self._child_conn = mp.Pipe()
+        self._k = 0
+        self._proc = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._proc is not None
+
+    def start(self) -> None:
+        if self.is_running:
+            raise RuntimeError("The estimator worker is already running!")
+        # samples pushed before starting are not replayed
+        self._k = self._samples.count
+        self._stop_event.clear()
+        self._proc = mp.Process(target=self._run, daemon=True)
+        self._proc.start()
+
+    def stop(
+        self,
+        timeout=1.0,
+    ) -> None:
+        """
+        Stop the worker and load its final estimator
+        state into the estimator of this process.
+        """
+        if not self.is_running:
+            return
+        self._stop_event.set()
+        if self._conn.poll(timeout + self._T):
+            self._est.set_state(self._conn.recv())
+        self._proc.join()
+        self._proc = None
+
+    def push(
+        self,
+        x: np.ndarray,
+        u: np.ndarray,
+        timer=False,
+    ) -> None:
+        """
+        Queue a measurement x along with the input u that led to it.
+        """
+        self._row[0] = time.perf_counter()
+        self._row[1 : 1+self._nx] = x
+        self._row[1+self._nx :] = u
+        self._samples.push(self._row)
+        self._timer.value = timer
+
+    def get_param(
+        self,
+        out=None,
+    ) -> np.ndarray:
+        return self._p.read(out)
+
+    def get_param_bounds(self) -> Tuple[np.ndarray, np.ndarray]:
+        bds = self._bds.read()
+        n = len(bds) // 2
+        return bds[:n], bds[n:]
+
+    def get_stats(self) -> EstimatorStats:
+        vals = self._stats.read()
+        return EstimatorStats(*[
+            int(v) if field in ("ticks", "overruns", "samples", "dropped")
+            else v for field, v in zip(EstimatorStats._fields, vals)
+        ])
+
+    def get_state(self) -> dict:
+        """
+        Snapshot of the estimator history, taken
+        by the worker between two ticks if it is running.
+        """
+        if not self.is_running:
+            return self._est.get_state()
+        self._conn.send(("get", None))
+        return self._conn.recv()
+
+    def set_state(
+        self,
+        state: dict,
+    ) -> None:
+        if not self.is_running:
+            self._est.set_state(state)
+        else:
+            self._conn.send(("set", state))
+
+    def _run(self) -> None:
+        scheduler = PeriodicScheduler(self._T)
+        n_samples = 0
+        n_dropped = 0
+        update_sum = 0.0
+        update_max = 0.0
+        latency_max = 0.0
+        p = self._p.read()
+
+        while scheduler.wait(self._stop_event):
+            rows, self._k, dropped = self._samples.read(self._k)
+            n_dropped += dropped
+            for row in rows:
+                st = time.perf_counter()
+                p = self._est.get_param(
+                    x=row[1 : 1+self._nx],
+                    u=row[1+self._nx :],
+                    param=p,
+                    timer=bool(self._timer.value)
+                )
+                et = time.perf_counter()
+                update_sum += et - st
+                update_max = max(update_max, et - st)
+                latency_max = max(latency_max, et - row[0])
+            if len(rows):
+                n_samples += len(rows)
+                self._p.publish(p)
+                self._bds.publish(np.concatenate(self._est.param_bounds))
+
+            self._stats.publish(
+                scheduler.get_stats() + (
+                    n_samples, n_dropped,
+                    update_sum / max(n_samples, 1),
+                    update_max, latency_max
+                )
+            )
+            while self._child_conn.poll():
+                self._handle_request(*self._child_conn.recv())
+
+        self._child_conn.send(self._est.get_state())
+
+    def _handle_request(
+        self,
+        cmd: str,
+        arg,
+    ) -> None:
+        if cmd == "get":
+            self._child_conn.send(self._est.get_state())
+        elif cmd == "set":
+            self._est.set_state(arg)
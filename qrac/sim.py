@@ -4,11 +4,10 @@ from acados_template import AcadosSim, AcadosSimSolver
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
+import threading
 import time
-import atexit
-import os
-import shutil
 from typing import Tuple
+from qrac.codegen import BuildInfo, get_sim_solver, get_namespace
 from qrac.models import Quadrotor, DisturbedQuadrotor
 
 
@@ -20,7 +19,9 @@ class MinimalSim():
         control_step: float,
         data_len: int,
         axes_min=[-5,-5,0],
-        axes_max=[5,5,10]
+        axes_max=[5,5,10],
+        cache=True,
+        name=None,
     ) -> None:
         self._assert(model, sim_step, control_step)
         self._nx = model.nx
@@ -36,10 +37,14 @@ class MinimalSim():
         self._k = 0
 
         self._model = DisturbedQuadrotor(model)
-        self._solver = self._init_solver(self._model, sim_step, control_step)
+        self._name = name if name else get_namespace("sim")
+        self._solver, self._build_info = self._init_solver(
+            self._model, sim_step, control_step, cache
+        )
+        # one integration at a time per instance
+        self._lock = threading.Lock()
         self._fig, self._ax, self._line = self._init_fig()
         #self._line = self._init_line()[0]
-        atexit.register(self._clear_files)
 
     @property
     def nx(self) -> int:
@@ -49,6 +54,14 @@ class MinimalSim():
     def nu(self) -> int:
         return self._nu
 
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def build_info(self) -> BuildInfo:
+        return self._build_info
+
     def update(
         self,
         x: np.ndarray,
@@ -57,10 +70,11 @@ class MinimalSim():
         timer=False,
     ) -> np.ndarray:
         u_bd = self._bound_u(u)
-        self._solve(x=x, u=u_bd, d=d, timer=timer)
-        x_sol = self._solver.get("x")[:self._nx]
-        x_bd = self._bound_x(x_sol)
-        self._update_data(x_bd, u_bd)
+        with self._lock:
+            self._solve(x=x, u=u_bd, d=d, timer=timer)
+            x_sol = self._solver.get("x")[:self._nx]
+            x_bd = self._bound_x(x_sol)
+            self._update_data(x_bd, u_bd)
         return x_bd
 
     def get_xdata(self) -> np.ndarray:
@@ -180,15 +194,15 @@ class MinimalSim():
         model: Quadrotor,
         sim_step: float,
         control_step: float,
-    ) -> AcadosSimSolver:
+        cache: bool,
+    ) -> Tuple[AcadosSimSolver, BuildInfo]:
         sim = AcadosSim()
         sim.model = model.get_acados_model()
         sim.solver_options.T = control_step
         sim.solver_options.integrator_type = "ERK"
         sim.solver_options.num_stages = 4
         sim.solver_options.num_steps = int(round(control_step / sim_step))
-        solver = AcadosSimSolver(sim)
-        return solver
+        return get_sim_solver(sim, self._name, cache)
 
     def _assert(
         self,
@@ -207,17 +221,4 @@ class MinimalSim():
                 "Please input the desired control loop step as an integer or float!")
         if control_step < sim_step:
             raise ValueError(
-                "The control step should be greater than or equal to the simulator step!")        
-
-    def _clear_files(self) -> None:
-        """
-        Clean up the acados generated files.
-        """
-        try:
-            shutil.rmtree("c_generated_code")
-        except:
-            print("failed to delete c_generated_code")
-        try:
-            os.remove("acados_sim.json")
-        except:
-            print("acados_sim.json")
+                "The control step should be greater than or equal to the simulator step!")
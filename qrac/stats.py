@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+import numpy as np
+from typing import Dict, NamedTuple
+
+
+class SolveRecord(NamedTuple):
+    status: int
+    rti_phase: int
+    sqp_iter: int
+    qp_iter: int
+    time_tot: float
+    time_lin: float
+    time_qp: float
+    time_sim: float
+    res_stat: float
+    res_eq: float
+    res_ineq: float
+    res_comp: float
+
+
+class SolverStats:
+    """
+    Fixed-size ring buffer of per-solve acados statistics.
+    """
+
+    def __init__(
+        self,
+        size: int,
+    ) -> None:
+        if type(size) != int or size < 1:
+            raise ValueError(
+                "Please input the statistics buffer size as a positive integer!")
+        self._size = size
+        self._data = np.full((size, len(SolveRecord._fields)), np.nan)
+        self._k = 0
+
+    def __len__(self) -> int:
+        return min(self._k, self._size)
+
+    def record(
+        self,
+        solver,
+        status: int,
+        rti_phase=0,
+    ) -> SolveRecord:
+        """
+        Read the statistics of the last solve from an acados solver.
+        """
+        res = self._read_stat(solver, "residuals", 4)
+        rec = SolveRecord(
+            status=status,
+            rti_phase=rti_phase,
+            sqp_iter=self._read_stat(solver, "sqp_iter"),
+            qp_iter=self._read_stat(solver, "qp_iter"),
+            time_tot=self._read_stat(solver, "time_tot"),
+            time_lin=self._read_stat(solver, "time_lin"),
+            time_qp=self._read_stat(solver, "time_qp"),
+            time_sim=self._read_stat(solver, "time_sim"),
+            res_stat=res[0],
+            res_eq=res[1],
+            res_ineq=res[2],
+            res_comp=res[3],
+        )
+        self._data[self._k % self._size] = rec
+        self._k += 1
+        return self._to_record(np.array(rec, dtype=float))
+
+    def reset(self) -> None:
+        self._data[:] = np.nan
+        self._k = 0
+
+    def get_latest(self) -> SolveRecord:
+        if not self._k:
+            raise IndexError("No solve has been recorded yet!")
+        row = self._data[(self._k - 1) % self._size]
+        return self._to_record(row)
+
+    def get_records(self) -> np.ndarray:
+        """
+        Recorded statistics, oldest first, one column per
+        SolveRecord field.
+        """
+        if self._k <= self._size:
+            return self._data[: self._k].copy()
+        start = self._k % self._size
+        return np.roll(self._data, -start, axis=0)
+
+    def get_summary(
+        self,
+        rti_phase=None,
+    ) -> Dict[str, Dict[str, float]]:
+        """
+        p50/p95/p99/max of every timing, iteration and residual field,
+        optionally only over solves of one RTI phase.
+        """
+        data = self.get_records()
+        if rti_phase is not None:
+            data = data[data[:, 1] == rti_phase]
+        summary = {}
+        for i, field in enumerate(SolveRecord._fields[2:], start=2):
+            col = data[:, i]
+            col = col[~np.isnan(col)]
+            if not len(col):
+                continue
+            p50, p95, p99 = np.percentile(col, [50, 95, 99])
+            summary[field] = {
+                "p50": p50, "p95": p95, "p99": p99, "max": np.max(col)
+            }
+        return summary
+
+    def get_failures(self) -> int:
+        """
+        Number of recorded solves with a nonzero acados status.
+        """
+        status = self.get_records()[:, 0]
+        return int(np.count_nonzero(status))
+
+    def get_overruns(
+        self,
+        deadline: float,
+    ) -> float:
+        """
+        Fraction of recorded solves whose time_tot exceeded the deadline.
+        """
+        times = self.get_records()[:, 4]
+        if not len(times):
+            return 0.0
+        return float(np.mean(times > deadline))
+
+    def print_summary(
+        self,
+        rti_phase=None,
+    ) -> None:
+        print(f"{len(self)} solves, {self.get_failures()} failed")
+        print(f"{'':>10} {'p50':>11} {'p95':>11} {'p99':>11} {'max':>11}")
+        for field, vals in self.get_summary(rti_phase).items():
+            print(f"{field:>10} {vals['p50']:>11.4g} {vals['p95']:>11.4g} "
+                  f"{vals['p99']:>11.4g} {vals['max']:>11.4g}")
+
+    def _read_stat(
+        self,
+        solver,
+        field: str,
+        size=1,
+    ):
+        # not every field is available for every nlp solver type
+        try:
+            val = np.array(solver.get_stats(field), dtype=float).flatten()
+        except Exception:
+            val = np.array([])
+        if size == 1:
+            return float(np.sum(val)) if len(val) else np.nan
+        if len(val) != size:
+            return np.full(size, np.nan)
+        return val
+
+    def _to_record(
+        self,
+        row: np.ndarray,
+    ) -> SolveRecord:
+        vals = [
+            int(v) if i < 4 and not np.isnan(v) else v
+            for i, v in enumerate(row)
+        ]
+        return SolveRecord(*vals)
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+
+import pytest
+pytest.importorskip("acados_template")
+
+from qrac import codegen
+from qrac.codegen import hash_acados_obj, get_cache_dir,\
+                         get_compiled_function
+import casadi as cs
+import numpy as np
+import os
+
+
+class FakeModel:
+    def __init__(self, name):
+        self.name = name
+        x = cs.SX.sym("x", 2)
+        self.f_expl_expr = cs.vertcat(x[1], -x[0])
+
+
+class FakeOcp:
+    """
+    Stands in for an AcadosOcp, whose attributes are what is hashed.
+    """
+
+    def __init__(self, N=10, W=None):
+        self.model = FakeModel("quad")
+        self.dims = {"N": N, "nx": 2}
+        self.cost = {"W": np.eye(2) if W is None else W}
+        self.solver_options = {"tf": 0.1, "nlp_solver_type": "SQP_RTI"}
+        self.code_export_directory = "c_generated_code"
+        self.json_file = "acados_ocp.json"
+
+
+class FakeSolver:
+    """
+    Records whether it was asked to generate and build the code.
+    """
+
+    builds = 0
+
+    def __init__(self, obj, json_file, generate, build):
+        self.json_file = json_file
+        self.generate = generate
+        if build:
+            FakeSolver.builds += 1
+
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("QRAC_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(codegen, "AcadosOcpSolver", FakeSolver)
+    FakeSolver.builds = 0
+    return tmp_path
+
+
+def test_cache_dir_is_overridden(cache_dir):
+    assert get_cache_dir() == str(cache_dir)
+
+
+def test_hash_is_stable():
+    assert hash_acados_obj(FakeOcp()) == hash_acados_obj(FakeOcp())
+    # where the code is exported does not change the solver
+    ocp = FakeOcp()
+    ocp.code_export_directory = "elsewhere"
+    ocp.json_file = "other.json"
+    assert hash_acados_obj(ocp) == hash_acados_obj(FakeOcp())
+
+
+@pytest.mark.parametrize("ocp", [
+    FakeOcp(N=11), FakeOcp(W=2*np.eye(2)), FakeOcp(W=np.eye(2)[:, :1]),
+])
+def test_hash_changes_with_problem(ocp):
+    assert hash_acados_obj(ocp) != hash_acados_obj(FakeOcp())
+
+
+@pytest.mark.parametrize("sym", [cs.SX, cs.MX])
+def test_hash_keeps_every_digit(sym):
+    # printed, both constants read 3.14499e-05
+    x = sym.sym("x", 2)
+    assert str(3.144988e-5*x) == str(3.1449884e-5*x)
+    assert hash_acados_obj(3.144988e-5*x) != hash_acados_obj(3.1449884e-5*x)
+    assert hash_acados_obj(cs.DM([3.144988e-5])) \
+        != hash_acados_obj(cs.DM([3.1449884e-5]))
+    ocp_a, ocp_b = FakeOcp(), FakeOcp()
+    ocp_b.model.f_expl_expr *= 1 + 10**-7
+    assert hash_acados_obj(ocp_a) != hash_acados_obj(ocp_b)
+
+
+def test_hash_changes_with_version(monkeypatch):
+    h = hash_acados_obj(FakeOcp())
+    monkeypatch.setattr(codegen, "CACHE_VERSION", "test")
+    assert hash_acados_obj(FakeOcp()) != h
+
+
+def test_rebuild_hits_cache(cache_dir):
+    solver, info = codegen.get_ocp_solver(FakeOcp(), "nmpc", True)
+    assert not info.cache_hit and solver.generate
+    assert os.path.dirname(info.path) == str(cache_dir)
+
+    # an equal problem is loaded without building, whereas a new
+    # namespace or a changed problem is built on its own
+    solver, hit = codegen.get_ocp_solver(FakeOcp(), "nmpc", True)
+    assert hit.cache_hit and not solver.generate and hit.path == info.path
+    assert FakeSolver.builds == 1
+    other = codegen.get_ocp_solver(FakeOcp(), "mhe", True)[1]
+    changed = codegen.get_ocp_solver(FakeOcp(N=11), "nmpc", True)[1]
+    assert not other.cache_hit and not changed.cache_hit
+    assert len({info.path, other.path, changed.path}) == 3
+
+
+def test_uncached_build_is_private(cache_dir):
+    a = codegen.get_ocp_solver(FakeOcp(), "nmpc", False)[1]
+    b = codegen.get_ocp_solver(FakeOcp(), "nmpc", False)[1]
+    assert not a.cache_hit and not b.cache_hit and a.path != b.path
+    assert not os.listdir(cache_dir)
+
+
+def get_func(gain=2.0):
+    x = cs.SX.sym("x", 3)
+    u = cs.SX.sym("u", 2)
+    return cs.Function(
+        "step", [x, u], [x + gain*cs.vertcat(u, u[0]*u[1]), cs.sumsqr(x)]
+    )
+
+
+def test_compiled_function_hits_cache(cache_dir):
+    func = get_func()
+    compiled, info = get_compiled_function(func, "step", True)
+    assert not info.cache_hit
+    x, u = np.array([1.0, 2.0, 3.0]), np.array([0.5, -1.0])
+    for out, ref in zip(compiled(x, u), func(x, u)):
+        assert np.allclose(out, np.array(ref).flatten())
+
+    # the same function is loaded from the same build,
+    # a changed one is compiled on its own
+    compiled, hit = get_compiled_function(get_func(), "step", True)
+    assert hit.cache_hit and hit.path == info.path
+    assert np.allclose(compiled(x, u)[0], [2.0, 0.0, 2.0])
+    changed = get_compiled_function(get_func(3.0), "step", True)[1]
+    assert not changed.cache_hit and changed.path != info.path
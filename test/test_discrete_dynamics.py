@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+
+import pytest
+pytest.importorskip("acados_template")
+
+from qrac.models import Crazyflie, AffineQuadrotor
+from qrac.estimation import get_discrete_dynamics, DiscreteDynamics
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+DT = 0.01
+CALLS = 20000
+
+
+def get_reference(model, xs, us):
+    func, rows, cols = DiscreteDynamics.get_func(model, DT)
+    Fds = np.zeros(xs.shape)
+    Gds = np.zeros((len(xs), xs.shape[1], model.np))
+    for k, (x, u) in enumerate(zip(xs, us)):
+        Fd, Gd_nz = func(x, u)
+        Fds[k] = np.array(Fd).flatten()
+        Gds[k, rows, cols] = np.array(Gd_nz).flatten()
+    return Fds, Gds
+
+
+def test_eval_matches_casadi():
+    model = AffineQuadrotor(Crazyflie(Ax=0, Ay=0, Az=0))
+    nx = model.nx - model.np
+    rng = np.random.default_rng(0)
+    xs = rng.standard_normal((20, nx))
+    us = rng.random((20, model.nu))
+    Fds, Gds = get_reference(model, xs, us)
+
+    dyn = get_discrete_dynamics(model, DT, cache=False)
+    for k, (x, u) in enumerate(zip(xs, us)):
+        Fd, Gd = dyn.eval(x, u)
+        assert np.allclose(Fd, Fds[k])
+        assert np.allclose(Gd, Gds[k])
+
+
+def test_kernels_have_own_buffers():
+    model = AffineQuadrotor(Crazyflie(Ax=0, Ay=0, Az=0))
+    dyn_a = get_discrete_dynamics(model, DT, cache=False)
+    dyn_b = get_discrete_dynamics(model, DT, cache=False)
+    assert dyn_a.build_info == dyn_b.build_info
+    Fd_a, Gd_a = dyn_a.eval(np.ones(12), np.ones(4))
+    Fd_b, Gd_b = dyn_b.eval(np.zeros(12), np.zeros(4))
+    assert not np.shares_memory(Fd_a, Fd_b)
+    assert not np.shares_memory(Gd_a, Gd_b)
+
+
+def test_thread_safety():
+    model = AffineQuadrotor(Crazyflie(Ax=0, Ay=0, Az=0))
+    nx = model.nx - model.np
+    rng = np.random.default_rng(1)
+    xs = rng.standard_normal((2, CALLS, nx))
+    us = rng.random((2, CALLS, model.nu))
+    refs = [get_reference(model, xs[i], us[i]) for i in range(2)]
+    dyns = [get_discrete_dynamics(model, DT, cache=False) for _ in range(2)]
+
+    def count_errors(i):
+        Fds, Gds = refs[i]
+        errors = 0
+        for k in range(CALLS):
+            Fd, Gd = dyns[i].eval(xs[i, k], us[i, k])
+            if not (np.allclose(Fd, Fds[k]) and np.allclose(Gd, Gds[k])):
+                errors += 1
+        return errors
+
+    with ThreadPoolExecutor(2) as pool:
+        errors = list(pool.map(count_errors, range(2)))
+    assert errors == [0, 0]
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+
+import pytest
+pytest.importorskip("acados_template")
+
+from qrac.models import Crazyflie, AffineQuadrotor
+from qrac.estimation import MHE, DiscreteDynamics
+import numpy as np
+
+
+DT = 0.01
+N = 4
+
+
+class FakeSolver:
+    """
+    Keeps what MHE pushes to acados per stage, without solving.
+    """
+
+    def __init__(self, N, nx, nu, np_):
+        nb = nx + np_
+        self.N = N
+        self.fields = {
+            "x": np.zeros((N+1, nb)), "u": np.zeros((N, nx)),
+            "p": np.zeros((N+1, nu)), "yref": np.zeros((N, nb + nx)),
+            "lbx": np.zeros((N+1, nb)), "ubx": np.zeros((N+1, nb)),
+            "W": np.zeros((N, nb + nx, nb + nx)),
+        }
+
+    def set(self, k, field, value):
+        self.fields[field][k] = value
+
+    cost_set = set
+
+    def get(self, k, field):
+        return np.copy(self.fields[field][k])
+
+    def get_flat(self, field):
+        return np.copy(self.fields[field]).ravel()
+
+    def set_flat(self, field, value):
+        self.fields[field][:] = value.reshape(self.fields[field].shape)
+
+    def options_set(self, field, value):
+        pass
+
+    def solve(self):
+        return 0
+
+
+@pytest.fixture
+def fake_solver(monkeypatch):
+    def init_solver(self, **kwargs):
+        return FakeSolver(self._N, self._nx, self._nu, self._np), None
+    monkeypatch.setattr(MHE, "_init_solver", init_solver)
+
+
+def get_mhe(model, R, **kwargs):
+    aff = AffineQuadrotor(model)
+    p = aff.get_parameters()
+    return MHE(
+        model=model, Q=10**-3 * np.eye(aff.np), R=R,
+        param_min=p - 2*np.abs(p), param_max=p + 2*np.abs(p),
+        disturb_min=-np.ones(model.nx), disturb_max=np.ones(model.nx),
+        time_step=DT, num_nodes=N, rti=True, cache=False, **kwargs
+    )
+
+
+def solve(mhe, x, u, p):
+    with mhe._lock:
+        mhe._solve(
+            x=x, u=u, p=p, timer=False,
+            p_min=np.array([]), p_max=np.array([])
+        )
+
+
+def test_arrival_cost_is_kalman_information(fake_solver):
+    STEPS = 12
+    model = Crazyflie(Ax=0, Ay=0, Az=0)
+    aff = AffineQuadrotor(model)
+    R = np.diag(np.linspace(1, 2, model.nx))
+    p_var = np.linspace(1, 10, aff.np)
+    mhe = get_mhe(model, R, arrival_cov=p_var)
+
+    rng = np.random.default_rng(0)
+    xs = rng.standard_normal((STEPS, model.nx))
+    us = model.u_max * rng.random((STEPS, model.nu))
+    p = aff.get_parameters()
+    for k in range(STEPS):
+        solve(mhe, xs[k], us[k], p)
+
+    # the transitions into the first stage that left the horizon,
+    # with the noise variance dt R^-1 per step
+    func, rows, cols = DiscreteDynamics.get_func(aff, DT)
+    info = np.diag(1 / p_var)
+    for j in range(1, STEPS - N + 1):
+        Gd = np.zeros((model.nx, aff.np))
+        Gd[rows, cols] = np.array(func(xs[j-1], us[j])[1]).flatten()
+        info += Gd.T @ np.diag(np.diag(R) / DT) @ Gd
+
+    # acados weights the stage by dt
+    nx = model.nx
+    W = mhe._solver.fields["W"][0][nx : nx+aff.np, nx : nx+aff.np]
+    assert np.allclose(DT * (W - 10**-3 * np.eye(aff.np)), info)
+
+
+def test_stages_and_state_round_trip(fake_solver):
+    model = Crazyflie(Ax=0, Ay=0, Az=0)
+    mhe = get_mhe(model, np.eye(model.nx))
+    rng = np.random.default_rng(1)
+    p = AffineQuadrotor(model).get_parameters()
+    xs = rng.standard_normal((10, model.nx))
+    us = rng.random((10, model.nu))
+    for k in range(6):
+        solve(mhe, xs[k], us[k], p)
+
+    # stages 0 to N-2 hold the newest measurements before the new one
+    state = mhe.get_state()
+    assert np.array_equal(state["x"], xs[2:6])
+    assert np.array_equal(state["u"], us[3:6])
+    solve(mhe, xs[6], us[6], p)
+    lbx = mhe._solver.fields["lbx"]
+    assert np.array_equal(lbx[:N-1, :model.nx], xs[3:6])
+    assert np.array_equal(lbx[N, :model.nx], xs[6])
+    assert np.array_equal(mhe._solver.fields["p"][:N-1], us[3:6])
+
+    mhe.set_state(state)
+    assert all(
+        np.array_equal(mhe.get_state()[key], state[key]) for key in "xud"
+    )
+
+
+def test_arrival_cost_needs_affine_model():
+    model = Crazyflie(Ax=0, Ay=0, Az=0)
+    with pytest.raises(ValueError):
+        MHE(
+            model=model, Q=np.eye(7), R=np.eye(model.nx),
+            param_min=np.zeros(7), param_max=np.ones(7),
+            disturb_min=-np.ones(model.nx), disturb_max=np.ones(model.nx),
+            time_step=DT, num_nodes=N, rti=True, nonlinear=True,
+            arrival_cov=np.ones(7),
+        )
@@ -0,0 +1,415 @@
+#!/usr/bin/python3
+
+import pytest
+pytest.importorskip("acados_template")
+
+from qrac.models import Crazyflie
+from qrac.control import NMPC, AdaptiveNMPC, MultiRateCascade
+import numpy as np
+
+
+CTRL_T = 0.01
+Q = np.diag([1,1,1, 1,1,1, 1,1,1, 1,1,1,])
+R = np.diag([1, 1, 1, 1])
+
+
+class FakeSolver:
+    """
+    Records what NMPC pushes to acados and in which order, without
+    solving. The stages have 2, 3 and 1 inequality multipliers at
+    the first, path and terminal stages.
+    """
+
+    def __init__(self, N, nx, nu):
+        self.N = N
+        self.x = np.zeros((N+1, nx))
+        self.u = np.zeros((N, nu))
+        self.pi = np.zeros((N, nx))
+        self.lam_dims = [2] + [3]*(N-1) + [1]
+        self.lam = np.zeros(sum(self.lam_dims))
+        self.costs = {}
+        self.sets = {}
+        self.flats = {}
+        self.slices = {}
+        self.calls = []
+
+    def set(self, k, field, value):
+        self.calls.append(("set", k, field))
+        self.sets[(k, field)] = np.copy(value)
+
+    def cost_set(self, k, field, value):
+        self.costs[(k, field)] = np.copy(value)
+
+    def cost_set_slice(self, start, end, field, value):
+        self.calls.append(("cost_set_slice", start, end, field))
+        self.slices[field] = np.copy(value)
+
+    def options_set(self, field, value):
+        self.calls.append(("options_set", field, value))
+
+    def get(self, k, field):
+        self.calls.append(("get", k, field))
+        if field == "lam":
+            start = sum(self.lam_dims[:k])
+            return np.copy(self.lam[start : start + self.lam_dims[k]])
+        return np.copy(getattr(self, field)[k])
+
+    def get_flat(self, field):
+        self.calls.append(("get_flat", field))
+        return np.copy(getattr(self, field)).ravel()
+
+    def set_flat(self, field, value):
+        self.flats[field] = np.copy(value)
+
+    def solve(self):
+        self.calls.append(("solve",))
+        return 0
+
+
+class FakeSolverNoSlice(FakeSolver):
+    """
+    acados_template before cost_set_slice.
+    """
+
+    def __getattribute__(self, name):
+        if name == "cost_set_slice":
+            raise AttributeError(name)
+        return super().__getattribute__(name)
+
+
+def patch_solver(monkeypatch, solver_type):
+    def init_solver(self, model, W_e=None, **kwargs):
+        solver = solver_type(self._N, self._nx, self._nu)
+        solver.costs[(self._N, "W")] = W_e
+        return solver, None
+    monkeypatch.setattr(NMPC, "_init_solver", init_solver)
+
+
+@pytest.fixture
+def fake_solver(monkeypatch):
+    """
+    NMPC with a FakeSolver, the terminal weight it was built with
+    is kept in the "W_e" cost.
+    """
+    patch_solver(monkeypatch, FakeSolver)
+
+
+@pytest.fixture
+def fake_solver_no_slice(monkeypatch):
+    patch_solver(monkeypatch, FakeSolverNoSlice)
+
+
+def get_nmpc(num_nodes=10, **kwargs):
+    model = Crazyflie(Ax=0, Ay=0, Az=0)
+    return NMPC(
+        model=model, Q=Q, R=R, u_min=model.u_min, u_max=model.u_max,
+        time_step=CTRL_T, num_nodes=num_nodes, rti=True, **kwargs
+    )
+
+
+def test_terminal_weight_is_cost_to_go(fake_solver):
+    nmpc = get_nmpc(terminal_cost="hover")
+    W_e = nmpc._solver.costs[(nmpc._N, "W")]
+    A = np.array(nmpc._jac_A(nmpc._x_lin, nmpc._u_lin, nmpc._p_val))
+    B = np.array(nmpc._jac_B(nmpc._x_lin, nmpc._u_lin, nmpc._p_val))
+
+    # LQR closed loop of the weights that acados applies per
+    # control step, dt*Q and dt*R
+    K = np.linalg.solve(
+        CTRL_T*R + B.T @ W_e @ B, B.T @ W_e @ A
+    )
+    x0 = 0.1*np.ones(12)
+    x = np.copy(x0)
+    cost = 0
+    for _ in range(20000):
+        u = -K @ x
+        cost += CTRL_T * (x @ Q @ x + u @ R @ u)
+        x = A @ x + B @ u
+    assert np.isclose(x0 @ W_e @ x0, cost, rtol=10**-3)
+
+
+def test_reference_terminal_cost_is_cached(fake_solver):
+    nmpc = get_nmpc(terminal_cost="reference", terminal_tol=0.05)
+    N = nmpc._N
+    # the jacobians do not depend on the positions
+    assert not np.isin([0, 1, 2], nmpc._lin_idx).any()
+
+    xset = np.zeros((N, 12))
+    xset[:, 0:3] = 1.0
+    nmpc.get_input(x=np.zeros(12), xset=xset)
+    W_0 = nmpc._solver.costs.get((N, "W"))
+
+    # small attitude changes keep the cached weight
+    xset[-1, 3] = 0.04
+    nmpc.get_input(x=np.zeros(12), xset=xset)
+    assert nmpc._solver.costs.get((N, "W")) is W_0
+
+    xset[-1, 3] = 0.2
+    nmpc.get_input(x=np.zeros(12), xset=xset)
+    W_e = nmpc._solver.costs[(N, "W")]
+    assert np.allclose(W_e, nmpc._get_terminal_weight(xset[-1]))
+    assert np.allclose(nmpc._solver.costs[(N, "yref")], xset[-1])
+
+
+def test_warm_start_needs_uniform_grid(fake_solver):
+    with pytest.raises(ValueError):
+        get_nmpc(num_nodes=3, warm_start=True, time_steps=[0.01, 0.02, 0.04])
+    with pytest.raises(ValueError):
+        get_nmpc(num_nodes=3, warm_start=True, input_blocks=[1, 2, 4])
+    nmpc = get_nmpc(num_nodes=3, warm_start=True, time_steps=[0.01]*3)
+    assert len(nmpc._lam_dims) == 4
+
+
+@pytest.mark.parametrize("grid", [
+    {}, {"time_steps": [0.01, 0.02, 0.03]}, {"input_blocks": [1, 2, 3]},
+])
+def test_grid_construction(fake_solver, grid):
+    nmpc = get_nmpc(num_nodes=3, **grid)
+    if grid:
+        assert np.allclose(nmpc.t_nodes, [0, 0.01, 0.03])
+        assert nmpc.n_ref == 6
+    else:
+        assert np.allclose(nmpc.t_nodes, [0, 0.01, 0.02])
+        assert nmpc.n_ref == 3
+
+    # a ramp sampled at the control step is resampled onto the nodes
+    M = nmpc.n_ref
+    ref = np.arange(M).reshape(M, 1) * np.ones((M, 12))
+    out = np.zeros((3, 12))
+    nmpc._resample(ref, out)
+    assert np.allclose(out[:, 0], nmpc.t_nodes / CTRL_T)
+
+
+def test_single_node(fake_solver):
+    nmpc = get_nmpc(num_nodes=1)
+    assert nmpc.n_ref == 1
+    u = nmpc.get_input(x=np.zeros(12), xset=np.zeros(12))
+    assert u.shape == (4,)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"num_nodes": 0},
+    {"num_nodes": 1, "time_steps": [0.01]},
+    {"num_nodes": 2, "time_steps": [0.002, 0.004]},
+    {"num_nodes": 1, "input_blocks": [1]},
+])
+def test_invalid_grids(fake_solver, kwargs):
+    with pytest.raises(ValueError):
+        get_nmpc(**kwargs)
+
+
+def test_cascade_needs_two_nodes(fake_solver):
+    model = Crazyflie(Ax=0, Ay=0, Az=0)
+    nmpc = get_nmpc(num_nodes=1)
+    with pytest.raises(ValueError):
+        MultiRateCascade(
+            model=model, control_ref=nmpc, adapt_gain=80,
+            bandwidth=1000, inner_step=CTRL_T/10, interpolate=True,
+        )
+
+
+def test_reference_is_pushed_at_once(fake_solver):
+    nmpc = get_nmpc()
+    N = nmpc._N
+    xset = np.arange(N*12, dtype=float).reshape(N, 12)
+    uset = np.ones((N, 4))
+    nmpc.get_input(x=np.zeros(12), xset=xset.flatten())
+    assert nmpc._solver.calls.count(("cost_set_slice", 0, N, "yref")) == 1
+    yref = nmpc._solver.slices["yref"]
+    assert np.array_equal(yref[:, :12], xset)
+    assert np.allclose(yref[:, 12:], nmpc._u_avg)
+
+    nmpc.get_input(x=np.zeros(12), xset=xset, uset=uset)
+    assert np.array_equal(nmpc._solver.slices["yref"][:, 12:], uset)
+
+
+def test_reference_falls_back_to_stages(fake_solver_no_slice):
+    nmpc = get_nmpc()
+    N = nmpc._N
+    xset = np.arange(N*12, dtype=float).reshape(N, 12)
+    nmpc.get_input(x=np.zeros(12), xset=xset)
+    for k in range(N):
+        yref = nmpc._solver.costs[(k, "yref")]
+        assert np.array_equal(yref[:12], xset[k])
+        assert np.allclose(yref[12:], nmpc._u_avg)
+
+
+def test_warm_start_shifts_iterate(fake_solver):
+    nmpc = get_nmpc(num_nodes=5, warm_start=True)
+    solver = nmpc._solver
+    N = nmpc._N
+    solver.x[:] = np.arange(solver.x.size).reshape(solver.x.shape)
+    solver.u[:] = np.arange(solver.u.size).reshape(solver.u.shape)
+    solver.pi[:] = np.arange(solver.pi.size).reshape(solver.pi.shape)
+    solver.lam[:] = np.arange(len(solver.lam))
+    nmpc.get_input(x=np.zeros(12), xset=np.zeros(nmpc.n_set))
+
+    # the terminal state is padded with one model step and
+    # the last input and multipliers are kept
+    xs = solver.flats["x"].reshape(N+1, 12)
+    x_e = nmpc._f_step(solver.x[N], solver.u[N-1], nmpc._p_val)
+    assert np.array_equal(xs[:N], solver.x[1:])
+    assert np.allclose(xs[N], np.array(x_e).flatten())
+    us = solver.flats["u"].reshape(N, 4)
+    assert np.array_equal(us[:N-1], solver.u[1:])
+    assert np.array_equal(us[N-1], solver.u[N-1])
+    pis = solver.flats["pi"].reshape(N, 12)
+    assert np.array_equal(pis[:N-1], solver.pi[1:])
+    assert np.array_equal(pis[N-1], solver.pi[N-1])
+
+    # the path stages are shifted, the first stage has its own
+    # dims and keeps its multipliers, as does the terminal stage
+    lams = solver.flats["lam"]
+    stages = np.split(solver.lam, np.cumsum(solver.lam_dims)[:-1])
+    shifted = np.split(lams, np.cumsum(solver.lam_dims)[:-1])
+    assert np.array_equal(shifted[0], stages[0])
+    for k in range(1, N-1):
+        assert np.array_equal(shifted[k], stages[k+1])
+    assert np.array_equal(shifted[N-1], stages[N-1])
+    assert np.array_equal(shifted[N], stages[N])
+
+
+def test_rti_phases(fake_solver):
+    nmpc = get_nmpc(stats_size=10)
+    solver = nmpc._solver
+    xset = np.zeros(nmpc.n_set)
+    with pytest.raises(RuntimeError):
+        nmpc.feedback(x=np.zeros(12))
+
+    nmpc.prepare(xset=xset)
+    assert solver.calls[-2:] == [
+        ("options_set", "rti_phase", 1), ("solve",),
+    ]
+    # the initial state is only set in the feedback phase
+    assert ("set", 0, "lbx") not in solver.calls
+    solver.calls.clear()
+    nmpc.feedback(x=np.ones(12))
+    assert solver.calls[:5] == [
+        ("set", 0, "lbx"), ("set", 0, "ubx"),
+        ("options_set", "rti_phase", 2), ("solve",), ("get", 0, "u"),
+    ]
+    # every feedback needs its own preparation
+    with pytest.raises(RuntimeError):
+        nmpc.feedback(x=np.ones(12))
+
+    solver.calls.clear()
+    nmpc.get_input(x=np.ones(12), xset=xset)
+    assert ("options_set", "rti_phase", 0) in solver.calls
+    assert np.array_equal(nmpc.stats.get_records()[:, 1], [1, 2, 0])
+
+
+@pytest.mark.parametrize("num_nodes", [1, 4, 5, 10])
+def test_solution_reads(fake_solver, num_nodes):
+    nmpc = get_nmpc()
+    solver = nmpc._solver
+    solver.x[:] = np.arange(solver.x.size).reshape(solver.x.shape)
+    solver.u[:] = np.arange(solver.u.size).reshape(solver.u.shape)
+    xs = np.empty((num_nodes, 12))
+    us = np.empty((num_nodes, 4))
+    assert nmpc.get_solution(xs=xs, us=us)[0] is xs
+    assert np.array_equal(xs, solver.x[:num_nodes])
+    assert np.array_equal(us, solver.u[:num_nodes])
+
+    # short prefixes are read per stage,
+    # from half the horizon on with one get per field
+    gets = [c for c in solver.calls if c[0] in ("get", "get_flat")]
+    if 2*num_nodes < nmpc._N:
+        assert len(gets) == 2*num_nodes
+        assert all(c[0] == "get" for c in gets)
+    else:
+        assert gets == [("get_flat", "x"), ("get_flat", "u")]
+
+
+class FakeEstimator:
+    """
+    Records every update and returns the number
+    of updates so far as every param.
+    """
+
+    is_nonlinear = False
+
+    def __init__(self):
+        self.k = 0
+        self.us = []
+
+    def get_param(self, x, u, param, timer=False):
+        self.k += 1
+        self.us.append(np.copy(u))
+        return np.full(len(param), float(self.k))
+
+
+def get_adaptive(estimator, num_nodes=10, **kwargs):
+    model = Crazyflie(Ax=0, Ay=0, Az=0)
+    return AdaptiveNMPC(
+        model=model, estimator=estimator, Q=Q, R=R,
+        u_min=model.u_min, u_max=model.u_max, time_step=CTRL_T,
+        num_nodes=num_nodes, real_time=False, rti=True, **kwargs
+    )
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_adaptive_estimate_order(fake_solver, pipelined):
+    est = FakeEstimator()
+    mpc = get_adaptive(est, pipelined=pipelined)
+    solver = mpc._mpc._solver
+    p_init = np.copy(mpc._p)
+    xset = np.zeros(mpc.n_set)
+    for k in range(1, 5):
+        solver.u[0] = k
+        mpc.get_input(x=np.zeros(12), xset=xset)
+        # the solve of step k uses the estimate of step k,
+        # or that of step k-1 when they overlap
+        p_used = solver.sets[(0, "lbx")][12:]
+        if not pipelined:
+            assert np.all(p_used == k)
+        elif k == 1:
+            assert np.array_equal(p_used, p_init)
+        else:
+            assert np.all(p_used == k-1)
+        # either way the estimate of step k is ready for the next one
+        assert np.all(mpc._p == k)
+    # each measurement is paired with the input that led to it
+    assert np.array_equal([u[0] for u in est.us], [0, 1, 2, 3])
+    mpc.close()
+
+
+def test_adaptive_close_stops_pool(fake_solver):
+    mpc = get_adaptive(FakeEstimator(), pipelined=True)
+    xset = np.zeros(mpc.n_set)
+    mpc.get_input(x=np.zeros(12), xset=xset)
+    mpc.close()
+    with pytest.raises(RuntimeError):
+        mpc.get_input(x=np.zeros(12), xset=xset)
+
+
+def test_adaptive_runtime_params(fake_solver):
+    mpc = get_adaptive(FakeEstimator(), runtime_params=True)
+    solver = mpc._mpc._solver
+    N = mpc._N
+    xset = np.zeros(mpc.n_set)
+    # the solver keeps the nominal state, the estimate is
+    # set as the params of every stage
+    mpc.get_input(x=np.ones(12), xset=xset)
+    assert np.array_equal(solver.sets[(0, "lbx")], np.ones(12))
+    assert np.array_equal(solver.flats["p"], np.ones((N+1) * 10))
+
+    # the preparation uses the estimate of the last feedback
+    mpc.prepare(xset=xset)
+    assert np.array_equal(solver.flats["p"], np.ones((N+1) * 10))
+    mpc.feedback(x=np.ones(12))
+    assert np.all(mpc._p == 2)
+    mpc.prepare(xset=xset)
+    assert np.array_equal(solver.flats["p"], 2*np.ones((N+1) * 10))
+
+
+def test_adaptive_augments_reference(fake_solver):
+    mpc = get_adaptive(FakeEstimator())
+    N = mpc._N
+    xset = np.arange(mpc.n_set, dtype=float)
+    xset_aug = mpc._augment_xset(xset)
+    assert xset_aug.shape == (N, 22)
+    assert np.array_equal(xset_aug[:, :12], xset.reshape(N, 12))
+    assert not xset_aug[:, 12:].any()
+    # the buffer is reused and takes (N, nx) references as well
+    assert mpc._augment_xset(2*xset.reshape(N, 12)) is xset_aug
+    assert np.array_equal(xset_aug[:, :12], 2*xset.reshape(N, 12))
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+
+import pytest
+pytest.importorskip("acados_template")
+
+from qrac.estimation import project, project_box, project_polytope
+from proxsuite import proxqp
+from scipy.optimize import nnls
+import numpy as np
+
+
+def get_reference(p, C, l, u, p_min, p_max):
+    """
+    Projection as a QP solved by ProxQP to a tight duality gap,
+    with the rows scaled to unit norm.
+    """
+    norms = np.linalg.norm(C, axis=1)
+    C, l, u = C / norms[:, None], l / norms, u / norms
+    qp = proxqp.dense.QP(len(p), 0, len(C), True)
+    qp.settings.eps_abs = 10**-12
+    qp.settings.eps_rel = 0.0
+    qp.settings.max_iter = 10**4
+    qp.settings.verbose = False
+    qp.settings.check_duality_gap = True
+    qp.settings.eps_duality_gap_abs = 10**-12
+    qp.settings.eps_duality_gap_rel = 0.0
+    qp.init(np.eye(len(p)), -p, None, None, C, l, u, p_min, p_max)
+    qp.solve()
+    assert qp.results.info.status == proxqp.QPSolverOutput.PROXQP_SOLVED
+    return qp.results.x
+
+
+def get_problems(trials, scaled, seed=0):
+    """
+    Random nonempty polytopes of window size, optionally with
+    params as far apart in scale as those of the models.
+    """
+    rng = np.random.default_rng(seed)
+    problems = []
+    for k in range(trials):
+        n = rng.integers(2, 5)
+        m = rng.integers(1, 30)
+        p_feas = rng.standard_normal(n)
+        C = rng.standard_normal((m, n))
+        l = C@p_feas - rng.random(m)
+        u = C@p_feas + rng.random(m)
+        p_min = p_feas - 2*rng.random(n)
+        p_max = p_feas + 2*rng.random(n)
+        p = p_feas + 0.5*rng.standard_normal(n)
+        scale = 10**rng.uniform(0, 4, n) if scaled else np.ones(n)
+        problems.append((
+            scale*p, C/scale, l, u, scale*p_min, scale*p_max
+        ))
+    return problems
+
+
+def test_box_is_clip():
+    rng = np.random.default_rng(0)
+    p = 3*rng.standard_normal(10)
+    p_min = -np.ones(10)
+    p_max = np.ones(10)
+    assert np.array_equal(project_box(p, p_min, p_max), np.clip(p, -1, 1))
+    assert np.array_equal(project(p, p_min, p_max), np.clip(p, -1, 1))
+    assert np.array_equal(
+        project(p, p_min, p_max, np.zeros((0, 10)), np.zeros(0), np.zeros(0)),
+        np.clip(p, -1, 1)
+    )
+
+
+def test_polytope_matches_qp():
+    for p, C, l, u, p_min, p_max in get_problems(200, scaled=False):
+        q = project_polytope(p, C, l, u, p_min, p_max)
+        ref = get_reference(p, C, l, u, p_min, p_max)
+        assert np.linalg.norm(q - p) <= np.linalg.norm(ref - p) + 10**-9
+        assert np.allclose(q, ref, atol=10**-6)
+
+
+@pytest.mark.parametrize("scaled", [False, True])
+def test_polytope_satisfies_kkt(scaled):
+    """
+    q is the projection iff it is feasible and p - q is a nonnegative
+    combination of the outward normals of the constraints active at q,
+    which holds without a reference solver.
+    """
+    for p, C, l, u, p_min, p_max in get_problems(200, scaled):
+        q = project_polytope(p, C, l, u, p_min, p_max)
+        eye = np.eye(len(p))
+        A = np.vstack((C, -C, eye, -eye))
+        b = np.concatenate((u, -l, p_max, -p_min))
+        norms = np.linalg.norm(A, axis=1)
+        A = A / norms[:, None]
+        b = b / norms
+        slack = b - A @ q
+        tol = 10**-9 * max(1, np.abs(q).max())
+        assert np.all(slack >= -tol)
+        active = slack <= tol
+        lam, res = nnls(A[active].T, p - q)
+        assert res <= 10**-6 * max(1, np.linalg.norm(p - q))
+
+
+def test_polytope_keeps_feasible_point():
+    C = np.array([[1.0, 1.0], [1.0, -1.0]])
+    p = np.array([0.2, 0.1])
+    q = project_polytope(
+        p, C, -np.ones(2), np.ones(2), -np.ones(2), np.ones(2)
+    )
+    assert np.array_equal(q, p)
+
+
+def test_polytope_drops_constraints():
+    # x1 + x2 <= 1 is added first but is inactive at the projection
+    # onto the cone x1 <= x2 <= 0, which is its apex
+    C = np.array([[1.0, -1.0], [2.0, 2.0], [0.0, 1.0]])
+    q = project_polytope(
+        np.array([2.0, 2.0]), C, np.full(3, -np.inf),
+        np.array([0.0, 2.0, 0.0]), np.full(2, -10.0), np.full(2, 10.0)
+    )
+    assert np.allclose(q, 0, atol=10**-12)
+
+
+def test_empty_polytope_falls_back_to_box():
+    C = np.array([[1.0, 0.0], [1.0, 0.0]])
+    p = np.array([3.0, -3.0])
+    q = project_polytope(
+        p, C, np.array([-np.inf, 0.5]), np.array([0.0, np.inf]),
+        -np.ones(2), np.ones(2)
+    )
+    assert np.array_equal(q, project_box(p, -np.ones(2), np.ones(2)))
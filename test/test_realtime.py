@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+
+import pytest
+from qrac.realtime import SharedDoubleBuffer, SharedRingBuffer,\
+                          PeriodicScheduler
+import multiprocessing as mp
+import numpy as np
+import threading
+import time
+
+
+def publish_in_child(buf, vals):
+    for val in vals:
+        buf.publish(val)
+
+
+def test_double_buffer_reads_latest():
+    buf = SharedDoubleBuffer(np.zeros(3))
+    assert len(buf) == 3 and buf.version == 0
+    assert np.array_equal(buf.read(), np.zeros(3))
+    buf.publish(np.ones(3))
+    buf.publish(2*np.ones(3))
+    out = np.empty(3)
+    assert buf.read(out) is out
+    assert np.array_equal(out, 2*np.ones(3)) and buf.version == 2
+    buf.unlink()
+
+
+def test_double_buffer_across_processes():
+    buf = SharedDoubleBuffer(np.zeros(4))
+    vals = np.arange(40, dtype=float).reshape(10, 4)
+    proc = mp.get_context("spawn").Process(
+        target=publish_in_child, args=(buf, vals)
+    )
+    proc.start()
+    proc.join(30)
+    assert proc.exitcode == 0
+    assert buf.version == 10
+    assert np.array_equal(buf.read(), vals[-1])
+    buf.unlink()
+
+
+def push_in_child(ring, rows):
+    for row in rows:
+        ring.push(row)
+
+
+def test_ring_buffer_returns_every_row():
+    ring = SharedRingBuffer(width=2, size=4)
+    assert len(ring) == 4 and ring.count == 0
+    rows = np.arange(18, dtype=float).reshape(9, 2)
+    for row in rows[:3]:
+        ring.push(row)
+    out, cursor, dropped = ring.read(0)
+    assert np.array_equal(out, rows[:3])
+    assert cursor == 3 and dropped == 0
+
+    out, cursor, dropped = ring.read(cursor)
+    assert len(out) == 0 and cursor == 3 and dropped == 0
+    ring.unlink()
+
+
+def test_ring_buffer_counts_laps():
+    ring = SharedRingBuffer(width=2, size=4)
+    rows = np.arange(18, dtype=float).reshape(9, 2)
+    for row in rows[:3]:
+        ring.push(row)
+    cursor = ring.read(0)[1]
+    # the writer laps the reader, rows 3 and 4 are overwritten
+    for row in rows[3:]:
+        ring.push(row)
+    out, cursor, dropped = ring.read(cursor)
+    assert np.array_equal(out, rows[5:])
+    assert cursor == 9 and dropped == 2
+
+    # a reader a full lap behind loses everything older than the ring
+    out, cursor, dropped = ring.read(0)
+    assert np.array_equal(out, rows[5:])
+    assert cursor == 9 and dropped == 5
+    ring.unlink()
+
+
+def test_ring_buffer_across_processes():
+    ring = SharedRingBuffer(width=3, size=8)
+    rows = np.arange(30, dtype=float).reshape(10, 3)
+    proc = mp.get_context("spawn").Process(
+        target=push_in_child, args=(ring, rows)
+    )
+    proc.start()
+    proc.join(30)
+    assert proc.exitcode == 0
+    out, cursor, dropped = ring.read(0)
+    assert np.array_equal(out, rows[2:])
+    assert cursor == 10 and dropped == 2
+    ring.unlink()
+
+
+def test_ring_buffer_rows_are_intact():
+    # every row is filled with its own index, so a row copied while
+    # the writer was overwriting it is no longer constant
+    n, width = 2000, 512
+    ring = SharedRingBuffer(width=width, size=4)
+    rows = np.repeat(np.arange(n, dtype=float)[:, None], width, axis=1)
+    proc = mp.get_context("spawn").Process(
+        target=push_in_child, args=(ring, rows)
+    )
+    proc.start()
+    cursor = 0
+    n_read = 0
+    n_dropped = 0
+    while cursor < n:
+        out, end, dropped = ring.read(cursor)
+        assert len(out) + dropped == end - cursor
+        for k, row in enumerate(out, end - len(out)):
+            assert np.all(row == k)
+        cursor = end
+        n_read += len(out)
+        n_dropped += dropped
+    proc.join(30)
+    assert proc.exitcode == 0
+    assert n_read + n_dropped == n and n_read > 0
+    ring.unlink()
+
+
+@pytest.mark.parametrize("size", [0, 2.0])
+def test_ring_buffer_needs_positive_size(size):
+    with pytest.raises(ValueError):
+        SharedRingBuffer(width=2, size=size)
+
+
+def test_scheduler_keeps_period():
+    sched = PeriodicScheduler(0.002)
+    st = time.perf_counter()
+    for _ in range(50):
+        assert sched.wait()
+    stats = sched.get_stats()
+    # the first tick starts the clock
+    assert time.perf_counter() - st >= 49 * 0.002
+    assert stats.ticks == 50
+    assert stats.max_jitter >= stats.mean_jitter >= 0
+
+
+def test_scheduler_drops_missed_deadlines():
+    T = 0.02
+    sched = PeriodicScheduler(T)
+    sched.wait()
+    st = time.perf_counter()
+    time.sleep(3.2 * T)
+    sched.wait()
+    stats = sched.get_stats()
+    assert stats.overruns == 1
+    assert stats.max_overrun >= 2.2 * T
+    # the missed deadlines are skipped rather than run back to back,
+    # so the next tick is on the grid after the overrun
+    sched.wait()
+    assert time.perf_counter() - st >= 3.9 * T
+    assert sched.get_stats().overruns == 1
+
+
+def test_scheduler_stops():
+    sched = PeriodicScheduler(10.0)
+    stop = threading.Event()
+    sched.wait(stop)
+    threading.Timer(0.05, stop.set).start()
+    st = time.perf_counter()
+    assert not sched.wait(stop)
+    assert time.perf_counter() - st < 5.0
+
+
+def test_scheduler_needs_positive_period():
+    with pytest.raises(ValueError):
+        PeriodicScheduler(0.0)
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+
+import pytest
+pytest.importorskip("acados_template")
+
+from qrac.models import Crazyflie, Quadrotor, AffineQuadrotor
+from qrac.estimation import RLS, DiscreteDynamics
+import numpy as np
+
+
+DT = 0.01
+D_MAX = 0.001*np.array([
+    0,0,0, 0,0,0, 1,1,1, 1,1,1,
+])
+
+
+def get_models():
+    inacc = Crazyflie(Ax=0, Ay=0, Az=0)
+    acc = Quadrotor(
+        1.5*inacc.m, 1.8*inacc.Ixx, 1.8*inacc.Iyy, 1.8*inacc.Izz,
+        0, 0, 0, inacc.xB, inacc.yB, inacc.k, inacc.u_min, inacc.u_max)
+    return inacc, acc
+
+
+def get_transitions(model, p_true, steps, seed=0):
+    """
+    Transitions of the discretized model with bounded noise, where
+    p_true holds the params of each step.
+    """
+    aff = AffineQuadrotor(model)
+    func, rows, cols = DiscreteDynamics.get_func(aff, DT)
+    rng = np.random.default_rng(seed)
+    xs = np.zeros((steps+1, model.nx))
+    us = np.zeros((steps, model.nu))
+    xs[0, 2] = 1
+    xs[0, 6:9] = [1, 1, 0]
+    xs[0, 9:12] = [3, -3, 2]
+    for k in range(steps):
+        us[k] = model.u_max * (0.3 + 0.1*rng.random(model.nu))
+        Fd, Gd_nz = func(xs[k], us[k])
+        Gd = np.zeros((model.nx, aff.np))
+        Gd[rows, cols] = np.array(Gd_nz).flatten()
+        d = D_MAX * (2*rng.random(model.nx) - 1)
+        xs[k+1] = np.array(Fd).flatten() + Gd @ p_true[k] + d
+    return xs, us
+
+
+def run_rls(rls, xs, us, p_init, p_min, p_max):
+    ps = np.zeros((len(us), len(p_init)))
+    p = rls.get_param(
+        x=xs[0], u=us[0], param=p_init,
+        param_min=p_min, param_max=p_max, timer=False
+    )
+    for k in range(len(us)):
+        p = rls.get_param(
+            x=xs[k+1], u=us[k], param=p,
+            param_min=p_min, param_max=p_max, timer=False
+        )
+        ps[k] = p
+    return ps
+
+
+def get_rls(model, p_min, p_max, forget_factor):
+    return RLS(
+        model=model, param_cov=((p_max - p_min)/2)**2 + 10**-12,
+        noise_var=D_MAX**2/3 + 10**-12, time_step=DT,
+        forget_factor=forget_factor, cache=False
+    )
+
+
+def test_converges():
+    inacc, acc = get_models()
+    p_true = AffineQuadrotor(acc).get_parameters()
+    p_min = p_true - 2*np.abs(p_true)
+    p_max = p_true + 2*np.abs(p_true)
+    xs, us = get_transitions(acc, np.tile(p_true, (300, 1)), 300)
+
+    rls = get_rls(inacc, p_min, p_max, 1.0)
+    p_init = AffineQuadrotor(inacc).get_parameters()
+    ps = run_rls(rls, xs, us, p_init, p_min, p_max)
+    # 1/m is excited by the thrust
+    assert abs(ps[-1, 0] - p_true[0]) < 0.01 * p_true[0]
+    assert np.all(np.linalg.eigvalsh(rls.param_cov) > 0)
+
+
+def test_forgetting_tracks_step():
+    STEPS = 600
+    inacc, acc = get_models()
+    p_true = AffineQuadrotor(acc).get_parameters()
+    p_min = p_true - 2*np.abs(p_true)
+    p_max = p_true + 2*np.abs(p_true)
+    # the mass drops by 20 % half way through
+    p_steps = np.tile(p_true, (STEPS, 1))
+    p_steps[STEPS//2:, 0] *= 1.25
+    xs, us = get_transitions(acc, p_steps, STEPS)
+    p_init = AffineQuadrotor(inacc).get_parameters()
+
+    errs = {}
+    for lam in [1.0, 0.95]:
+        rls = get_rls(inacc, p_min, p_max, lam)
+        ps = run_rls(rls, xs, us, p_init, p_min, p_max)
+        errs[lam] = abs(ps[-1, 0] - p_steps[-1, 0]) / p_steps[-1, 0]
+        # unexcited directions stay within their initial variances
+        assert np.all(np.diag(rls.param_cov) <= np.diag(rls._P0) + 10**-12)
+
+    assert errs[0.95] < 0.01
+    assert errs[0.95] < errs[1.0] / 10
+
+
+def test_state_round_trip():
+    inacc, acc = get_models()
+    p_true = AffineQuadrotor(acc).get_parameters()
+    p_min = p_true - 2*np.abs(p_true)
+    p_max = p_true + 2*np.abs(p_true)
+    xs, us = get_transitions(acc, np.tile(p_true, (40, 1)), 40)
+    p_init = AffineQuadrotor(inacc).get_parameters()
+
+    rls = get_rls(inacc, p_min, p_max, 0.99)
+    p = run_rls(rls, xs[:21], us[:20], p_init, p_min, p_max)[-1]
+    state = rls.get_state()
+
+    def resume():
+        return [
+            rls.get_param(
+                x=xs[k+1], u=us[k], param=p,
+                param_min=p_min, param_max=p_max, timer=False
+            ) for k in range(20, 40)
+        ]
+
+    p_a = resume()
+    rls.set_state(state)
+    p_b = resume()
+    assert np.array_equal(p_a, p_b)
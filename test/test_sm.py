@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+
+import pytest
+pytest.importorskip("acados_template")
+
+from qrac.models import Crazyflie, Quadrotor, AffineQuadrotor
+from qrac.estimation import SetMembershipEstimator, BoundLP
+from scipy.optimize import linprog
+import casadi as cs
+import numpy as np
+
+
+DT = 0.01
+D_MAX = 0.01*np.array([
+    0,0,0, 0,0,0, 1,1,1, 1,1,1,
+])
+
+
+class PassThrough:
+    """
+    Inner estimator that keeps the params,
+    so only the set membership update is tested.
+    """
+    @property
+    def is_nonlinear(self) -> bool:
+        return False
+
+    def get_param(self, x, u, param, param_min, param_max, timer=False):
+        return param
+
+    def get_state(self):
+        return {}
+
+    def set_state(self, state):
+        pass
+
+
+def get_models():
+    inacc = Crazyflie(Ax=0, Ay=0, Az=0)
+    acc = Quadrotor(
+        1.5*inacc.m, 1.8*inacc.Ixx, 1.8*inacc.Iyy, 1.8*inacc.Izz,
+        0, 0, 0, inacc.xB, inacc.yB, inacc.k, inacc.u_min, inacc.u_max)
+    return inacc, acc
+
+
+def get_transitions(model, p_true, steps, seed=0):
+    """
+    Transitions of the discretized model with disturbances
+    within the bounds, so every update is feasible.
+    """
+    aff = AffineQuadrotor(model)
+    nx = model.nx
+    step = cs.Function(
+        "step", [aff.x[:nx], aff.u], [aff.x[:nx] + DT*aff.F, DT*aff.G]
+    )
+    rng = np.random.default_rng(seed)
+    xs = np.zeros((steps+1, nx))
+    us = np.zeros((steps, model.nu))
+    xs[0, 2] = 1
+    xs[0, 6:9] = [1, 1, 0]
+    xs[0, 9:12] = [3, -3, 2]
+    for k in range(steps):
+        us[k] = model.u_max * (0.3 + 0.1*rng.random(model.nu))
+        Fd, Gd = step(xs[k], us[k])
+        d = D_MAX * (2*rng.random(nx) - 1)
+        xs[k+1] = np.array(Fd + Gd @ p_true).flatten() + d
+    return xs, us
+
+
+def get_sm(model, p_min, p_max, window=1):
+    return SetMembershipEstimator(
+        model=model, estimator=PassThrough(),
+        param_tol=10**-6*np.ones(10), param_min=p_min, param_max=p_max,
+        disturb_min=-D_MAX, disturb_max=D_MAX, time_step=DT,
+        qp_tol=10**-6, max_iter=10, window=window, cache=False
+    )
+
+
+def get_lp_bound(c, A, l, u, p_min, p_max):
+    res = linprog(
+        c, A_ub=np.vstack((A, -A)), b_ub=np.concatenate((u, -l)),
+        bounds=list(zip(p_min, p_max)), method="highs"
+    )
+    assert res.status == 0
+    return res.fun
+
+
+def test_blocks_follow_sparsity():
+    inacc, acc = get_models()
+    p = AffineQuadrotor(inacc).get_parameters()
+    sm = get_sm(inacc, p - np.abs(p), p + np.abs(p))
+
+    # p1 couples rows 0 and 3, and with them p0 and p3
+    s = cs.SX.sym("s", 4)
+    G = cs.SX(4, 4)
+    G[0, 0] = s[0]
+    G[0, 1] = s[1]
+    G[1, 2] = s[2]
+    G[3, 1] = s[3]
+    G[3, 3] = s[0]
+    blocks, zero_rows = sm._get_blocks(G)
+    assert sorted((list(cols), list(rows)) for cols, rows in blocks) \
+        == [([0, 1, 3], [0, 3]), ([2], [1])]
+    assert list(zero_rows) == [2]
+
+    # the blocks of the model split the params and rows between them
+    cols = np.concatenate([cols for cols, rows in sm._blocks])
+    rows = np.concatenate([rows for cols, rows in sm._blocks])
+    assert np.array_equal(np.sort(cols), np.arange(10))
+    assert np.array_equal(
+        np.sort(np.concatenate((rows, sm._zero_rows))), np.arange(12)
+    )
+
+
+def test_bound_row_is_exact():
+    inacc, acc = get_models()
+    p = AffineQuadrotor(inacc).get_parameters()
+    sm = get_sm(inacc, p - np.abs(p), p + np.abs(p))
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        n = rng.integers(1, 5)
+        a = rng.standard_normal(n) * (rng.random(n) > 0.2)
+        p_min = -0.1 - rng.random(n)
+        p_max = 0.1 + rng.random(n)
+        p_feas = p_min + rng.random(n)*(p_max - p_min)
+        l = a@p_feas - rng.random()
+        u = a@p_feas + rng.random()
+        bd_min, bd_max = sm._bound_row(a, l, u, p_min, p_max)
+        for i in range(n):
+            e = np.eye(n)[i]
+            A, l_A, u_A = a[None], np.array([l]), np.array([u])
+            ref_min = get_lp_bound(e, A, l_A, u_A, p_min, p_max)
+            ref_max = -get_lp_bound(-e, A, l_A, u_A, p_min, p_max)
+            assert bd_min[i] == pytest.approx(ref_min, abs=10**-9)
+            assert bd_max[i] == pytest.approx(ref_max, abs=10**-9)
+
+    assert sm._bound_row(
+        np.array([1.0, 1.0]), 3.0, 4.0, -np.ones(2), np.ones(2)
+    ) is None
+
+
+@pytest.mark.parametrize("scaled", [False, True])
+def test_bound_lp_is_tight(scaled):
+    # one LP is updated across the trials, as within the estimator
+    n, m, tol = 3, 8, 10**-6
+    lp = BoundLP(n_p=n, n_in=m, tol=tol, max_iter=10**3)
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        p_feas = rng.standard_normal(n)
+        C = rng.standard_normal((m, n))
+        l = C@p_feas - rng.random(m)
+        u = C@p_feas + rng.random(m)
+        p_min = p_feas - 2*rng.random(n)
+        p_max = p_feas + 2*rng.random(n)
+        # the params of the models are orders of magnitude apart
+        scale = 10**rng.uniform(-3, 3, n) if scaled else np.ones(n)
+        C, p_min, p_max = C/scale, scale*p_min, scale*p_max
+
+        lp.set_constraints(C=C, l=l, u=u, p_min=p_min, p_max=p_max)
+        for i in range(n):
+            e = np.eye(n)[i]
+            ref_min = get_lp_bound(e, C, l, u, p_min, p_max)
+            ref_max = -get_lp_bound(-e, C, l, u, p_min, p_max)
+            # the tolerance holds relative to the box of each param
+            width = p_max[i] - p_min[i]
+            bd_min = lp.solve(idx=i, max=False)
+            bd_max = lp.solve(idx=i, max=True)
+            assert bd_min == pytest.approx(ref_min, abs=2*tol*width)
+            assert bd_max == pytest.approx(ref_max, abs=2*tol*width)
+
+
+def test_unsolved_bound_lp_keeps_box():
+    p_min = np.array([-1.0, -10.0])
+    p_max = np.array([1.0, 10.0])
+    C = np.array([[1.0, 1.0], [1.0, -1.0]])
+    # no point of the box is within the rows
+    lp = BoundLP(n_p=2, n_in=2, tol=10**-6, max_iter=10**3)
+    lp.set_constraints(
+        C=C, l=np.array([20.0, -1.0]), u=np.array([30.0, 1.0]),
+        p_min=p_min, p_max=p_max
+    )
+    assert lp.solve(idx=1, max=False) == p_min[1]
+    assert lp.solve(idx=1, max=True) == p_max[1]
+
+    # nor is a feasible LP solved within a single iteration
+    lp = BoundLP(n_p=2, n_in=2, tol=10**-12, max_iter=1)
+    lp.set_constraints(
+        C=C, l=np.array([-1.0, -1.0]), u=np.array([1.0, 1.0]),
+        p_min=p_min, p_max=p_max
+    )
+    assert lp.solve(idx=0, max=True) == p_max[0]
+
+
+@pytest.mark.parametrize("window", [1, 5])
+def test_bounds_keep_true_params(window):
+    inacc, acc = get_models()
+    p_true = AffineQuadrotor(acc).get_parameters()
+    p_min = p_true - 2*np.abs(p_true)
+    p_max = p_true + 2*np.abs(p_true)
+    xs, us = get_transitions(acc, p_true, 200)
+
+    sm = get_sm(inacc, p_min, p_max, window)
+    p = AffineQuadrotor(inacc).get_parameters()
+    sm.get_param(x=xs[0], u=us[0], param=p, timer=False)
+    for k in range(len(us)):
+        p = sm.get_param(x=xs[k+1], u=us[k], param=p, timer=False)
+        bd_min, bd_max = sm.param_bounds
+        assert np.all(bd_min <= p_true) and np.all(p_true <= bd_max)
+    # the intervals never grow, and the transitions shrink those
+    # of the mass and inertia
+    assert sm.num_lps > 0
+    assert np.all(bd_max - bd_min <= p_max - p_min)
+    assert np.all((bd_max - bd_min)[[0, 4, 5]] < (p_max - p_min)[[0, 4, 5]])
+
+
+def test_window_prunes_redundant_rows():
+    inacc, acc = get_models()
+    p_true = AffineQuadrotor(acc).get_parameters()
+    p_min = p_true - 2*np.abs(p_true)
+    p_max = p_true + 2*np.abs(p_true)
+    xs, us = get_transitions(acc, p_true, 100)
+
+    window = 5
+    sm = get_sm(inacc, p_min, p_max, window)
+    p = AffineQuadrotor(inacc).get_parameters()
+    sm.get_param(x=xs[0], u=us[0], param=p, timer=False)
+    n_pruned = 0
+    for k in range(len(us)):
+        p = sm.get_param(x=xs[k+1], u=us[k], param=p, timer=False)
+        bd_min, bd_max = sm.param_bounds
+        for (cols, rows), (A, A_l, A_u, active) in zip(
+            sm._blocks, sm._cons
+        ):
+            filled = min(k+1, window) * len(rows)
+            # a dropped row holds over the whole box, which only shrinks
+            lo, hi = sm._get_row_ranges(
+                A[:filled], bd_min[cols], bd_max[cols]
+            )
+            pruned = ~active[:filled]
+            assert np.all(lo[pruned] >= A_l[:filled][pruned])
+            assert np.all(hi[pruned] <= A_u[:filled][pruned])
+            n_pruned += pruned.sum()
+    assert n_pruned > 0
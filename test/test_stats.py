@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+import pytest
+from qrac.stats import SolverStats, SolveRecord
+import numpy as np
+
+
+class FakeSolver:
+    """
+    Answers get_stats like acados, the k-th solve taking k ms.
+    """
+
+    def __init__(self, missing=()):
+        self.k = 0
+        self.missing = missing
+
+    def solve(self):
+        self.k += 1
+
+    def get_stats(self, field):
+        if field in self.missing:
+            raise Exception(f"{field} is not available!")
+        if field == "residuals":
+            return np.array([1, 2, 3, 4]) * 10.0**-self.k
+        if field == "time_tot":
+            return 10**-3 * self.k
+        if field == "sqp_iter":
+            return self.k
+        if field == "qp_iter":
+            # one entry per sqp iteration
+            return np.ones(self.k)
+        return 0.0
+
+
+def record(stats, solver, n, status=0, rti_phase=0):
+    for _ in range(n):
+        solver.solve()
+        stats.record(solver, status, rti_phase)
+
+
+def test_records_fields():
+    stats = SolverStats(4)
+    solver = FakeSolver()
+    record(stats, solver, 1)
+    rec = stats.get_latest()
+    assert isinstance(rec, SolveRecord)
+    assert rec.status == 0 and rec.sqp_iter == 1 and rec.qp_iter == 1
+    assert type(rec.sqp_iter) == int
+    assert rec.time_tot == 10**-3
+    assert np.allclose(
+        [rec.res_stat, rec.res_eq, rec.res_ineq, rec.res_comp],
+        [0.1, 0.2, 0.3, 0.4]
+    )
+
+
+def test_ring_keeps_newest():
+    stats = SolverStats(4)
+    solver = FakeSolver()
+    record(stats, solver, 3)
+    assert len(stats) == 3
+    assert np.array_equal(stats.get_records()[:, 2], [1, 2, 3])
+
+    # the oldest solves are overwritten, the order stays oldest first
+    record(stats, solver, 3)
+    assert len(stats) == 4
+    assert np.array_equal(stats.get_records()[:, 2], [3, 4, 5, 6])
+    assert stats.get_latest().sqp_iter == 6
+
+    stats.reset()
+    assert len(stats) == 0
+    with pytest.raises(IndexError):
+        stats.get_latest()
+
+
+def test_summary_failures_and_overruns():
+    stats = SolverStats(100)
+    solver = FakeSolver()
+    record(stats, solver, 10, rti_phase=1)
+    record(stats, solver, 10, status=2, rti_phase=2)
+
+    summary = stats.get_summary()
+    assert summary["time_tot"]["max"] == pytest.approx(0.02)
+    assert summary["sqp_iter"]["p50"] == pytest.approx(10.5)
+    assert stats.get_summary(rti_phase=1)["time_tot"]["max"] \
+        == pytest.approx(0.01)
+    assert stats.get_failures() == 10
+    assert stats.get_overruns(0.015) == pytest.approx(0.25)
+
+
+def test_missing_fields_are_nan():
+    stats = SolverStats(2)
+    solver = FakeSolver(missing=("residuals", "time_lin"))
+    record(stats, solver, 1)
+    rec = stats.get_latest()
+    assert np.isnan(rec.time_lin) and np.isnan(rec.res_stat)
+    assert "time_lin" not in stats.get_summary()
+    assert "time_tot" in stats.get_summary()
+
+
+@pytest.mark.parametrize("size", [0, -1, 2.0])
+def test_invalid_size(size):
+    with pytest.raises(ValueError):
+        SolverStats(size)